@@ -84,13 +84,82 @@ const Activity = styled.p`
   margin-bottom: 0.5rem;
 `;
 
+// Read the NDJSON stream from /generate-itinerary/stream and hand each event to onEvent,
+// aborting signal stops the request
+const streamItinerary = async (preferences, onEvent, signal) => {
+  const response = await fetch('http://localhost:5000/generate-itinerary/stream', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    credentials: 'include',
+    body: JSON.stringify(preferences),
+    signal,
+  });
+  if (!response.ok) {
+    throw new Error(`Itinerary stream failed with status ${response.status}`);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    const lines = buffer.split('\n');
+    buffer = lines.pop();
+    lines.filter((line) => line.trim()).forEach((line) => onEvent(JSON.parse(line)));
+  }
+  if (buffer.trim()) {
+    onEvent(JSON.parse(buffer));
+  }
+};
+
 const TripPlan = () => {
   const location = useLocation();
+  const preferences = location.state?.preferences;
   const [itinerary, setItinerary] = useState(location.state?.itinerary || {});
   const [animatedDays, setAnimatedDays] = useState([]);
   const [center, setCenter] = useState([51.505, -0.09]); // Default center
+  const [error, setError] = useState(null);
+  const [notice, setNotice] = useState(null);
+
+  // Streaming mode: render each day as soon as the server sends it. The request is
+  // aborted when the component unmounts or the effect re-runs, so it is never left running.
+  useEffect(() => {
+    if (!preferences) return;
+    const controller = new AbortController();
+    let finished = false;
+    setAnimatedDays([]);
+    setError(null);
+    setNotice(null);
+
+    streamItinerary(preferences, (event) => {
+      if (event.type === 'day') {
+        setAnimatedDays(prevDays => [...prevDays, event.day]);
+      } else if (event.type === 'done') {
+        // The final event carries the whole itinerary as stored
+        finished = true;
+        setAnimatedDays(event.itinerary);
+        setItinerary(event);
+        if (event.fallback) {
+          setNotice("Some days were planned without the AI planner, which was unavailable.");
+        }
+      }
+    }, controller.signal).then(() => {
+      if (!finished) {
+        setError("The itinerary stream ended before the trip was complete. Please try again.");
+      }
+    }).catch((error) => {
+      if (error.name === 'AbortError') return;
+      console.error("Error streaming itinerary:", error);
+      setError("Failed to save preferences and generate itinerary.");
+    });
+
+    return () => controller.abort();
+  }, [preferences]);
 
   useEffect(() => {
+    if (preferences) return;
     // Fetch itinerary if not passed via state
     if (!itinerary.itinerary) {
       const fetchItinerary = async () => {
@@ -162,6 +231,8 @@ const TripPlan = () => {
       </MapWrapper>
       <ItineraryWrapper>
         <Title>Your Trip Itinerary</Title>
+        {notice && <p>{notice}</p>}
+        {animatedDays.length > 0 && error && <p>{error}</p>}
         {animatedDays.length > 0 ? (
           animatedDays.map((day, index) => (
             <DayCard key={index} style={{ animationDelay: `${index * 0.3}s` }}>
@@ -172,7 +243,7 @@ const TripPlan = () => {
             </DayCard>
           ))
         ) : (
-          <p>Loading itinerary...</p>
+          <p>{error || 'Loading itinerary...'}</p>
         )}
       </ItineraryWrapper>
     </TripPlanContainer>
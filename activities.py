@@ -0,0 +1,100 @@
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Normalized activity storage.
+# Activity names live once in the activities table and each trip links to them
+# through trip_activities (in the order the user picked them). The old
+# comma-joined trip_preferences.activities column and the Firestore 'activities'
+# string are still written for entry points that read them, but readers here
+# prefer the join table and the Firestore 'activity_list' array, which keep
+# names containing commas intact.
+
+# Column expression returning a trip's activities as a JSON array, for SELECTs on trip_preferences
+ACTIVITY_LIST_SQL = '''(SELECT json_group_array(name) FROM (
+                           SELECT a.name FROM trip_activities ta JOIN activities a ON a.id = ta.activity_id
+                           WHERE ta.trip_id = trip_preferences.id ORDER BY ta.position))'''
+
+
+# Clean up a list of activity names: trimmed, no blanks, no duplicates, order kept
+def normalize_activities(activities):
+    seen = set()
+    names = []
+    for activity in activities or []:
+        name = str(activity).strip()
+        if name and name not in seen:
+            seen.add(name)
+            names.append(name)
+    return names
+
+
+# Legacy comma-joined form of an activity list
+def encode_activities(activities):
+    return ",".join(normalize_activities(activities))
+
+
+# Activity list from the legacy comma-joined form
+def decode_activities(value):
+    return [name for name in (value or '').split(",") if name]
+
+
+# Replace a trip's activity links, meant to run inside the transaction that saved the trip
+def save_trip_activities(conn, trip_id, activities):
+    names = normalize_activities(activities)
+    conn.execute("DELETE FROM trip_activities WHERE trip_id = ?", (trip_id,))
+    if not names:
+        return
+    conn.executemany("INSERT OR IGNORE INTO activities (name) VALUES (?)", [(name,) for name in names])
+    placeholders = ",".join("?" * len(names))
+    ids = dict(conn.execute(f"SELECT name, id FROM activities WHERE name IN ({placeholders})", names).fetchall())
+    conn.executemany("INSERT INTO trip_activities (trip_id, activity_id, position) VALUES (?, ?, ?)",
+                     [(trip_id, ids[name], position) for position, name in enumerate(names)])
+
+
+# Link many freshly inserted trips to their activities at once, for bulk imports.
+# links is a list of (trip_id, activities).
+def link_trip_activities(conn, links):
+    links = [(trip_id, normalize_activities(activities)) for trip_id, activities in links]
+    names = {name for _, activity_names in links for name in activity_names}
+    if not names:
+        return
+    conn.executemany("INSERT OR IGNORE INTO activities (name) VALUES (?)", [(name,) for name in names])
+    ids = {}
+    names = list(names)
+    for i in range(0, len(names), 500):
+        chunk = names[i:i + 500]
+        placeholders = ",".join("?" * len(chunk))
+        ids.update(conn.execute(f"SELECT name, id FROM activities WHERE name IN ({placeholders})", chunk).fetchall())
+    conn.executemany("INSERT OR IGNORE INTO trip_activities (trip_id, activity_id, position) VALUES (?, ?, ?)",
+                     [(trip_id, ids[name], position)
+                      for trip_id, activity_names in links for position, name in enumerate(activity_names)])
+
+
+# Activity list of a trip_preferences row selected with ACTIVITY_LIST_SQL, rows
+# written by entry points that only know the legacy column fall back to splitting it
+def row_activities(activity_list, activities_str):
+    return json.loads(activity_list or '[]') or decode_activities(activities_str)
+
+
+# Trips that include an activity, newest first, answered from the (activity_id, trip_id) index
+def find_trips_with_activity(pool, activity, user_id=None, limit=100):
+    query = '''SELECT tp.id, tp.user_id, tp.destination, tp.start_date, tp.end_date, tp.created_at
+               FROM activities a
+               JOIN trip_activities ta ON ta.activity_id = a.id
+               JOIN trip_preferences tp ON tp.id = ta.trip_id
+               WHERE a.name = ?'''
+    args = [activity.strip()]
+    if user_id is not None:
+        query += " AND tp.user_id = ?"
+        args.append(user_id)
+    query += " ORDER BY tp.id DESC LIMIT ?"
+    args.append(limit)
+    return [{
+        "trip_id": trip_id,
+        "user_id": trip_user_id,
+        "destination": destination,
+        "start_date": start_date,
+        "end_date": end_date,
+        "created_at": created_at
+    } for trip_id, trip_user_id, destination, start_date, end_date, created_at in pool.read(query, args)]
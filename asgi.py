@@ -0,0 +1,244 @@
+import os
+import asyncio
+import logging
+import importlib
+from functools import partial
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Match, Route
+
+from health import CircuitOpen
+from itinerary_cache import itinerary_cache_key, redate_itinerary
+
+# ASGI entry point, for itinerary traffic that mostly waits on Gemini and Firestore:
+#   uvicorn asgi:app --port 5000 --workers 4
+# /generate-itinerary, /api/trip-preferences/<id> and /api/forgot-password are served
+# by the coroutines below with the same URLs, bodies and status codes as the Flask
+# routes, so a waiting request costs a suspended coroutine instead of a thread. Gemini
+# is awaited through LLMClient.agenerate and Firestore through its AsyncClient.
+# SQLite work (the pool in db_pool.py) runs on a few dedicated threads, and Firebase
+# Auth, which has no async API, on the loop's default executor. Every other route is
+# passed to the Flask app unchanged.
+server = importlib.import_module('new-server')
+logger = logging.getLogger(__name__)
+
+db_executor = ThreadPoolExecutor(max_workers=int(os.getenv('ASYNC_DB_THREADS', 4)), thread_name_prefix='sqlite')
+
+
+# Run a blocking SQLite call on the database threads
+async def run_db(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(db_executor, partial(fn, *args))
+
+
+# Request body as a dict, an empty one when it is missing or not JSON so the field checks answer 400
+async def json_body(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+# Function to call the Gemini API, parse the itinerary and store it in the itinerary cache
+async def generate_and_cache_itinerary(cache_key, prompt):
+    itinerary_text = await server.gemini.agenerate(prompt)
+    itinerary = server.parse_itinerary(itinerary_text)
+    await run_db(server.itinerary_cache.put, cache_key, itinerary)
+    return itinerary
+
+
+# Async generate_itinerary_with_gemini, same cache, coalescing and redating
+async def generate_itinerary_with_gemini(destination, start_date, end_date, budget, activities, group_size):
+    if not server.GEMINI_API_KEY:
+        raise ValueError("GEMINI_API_KEY environment variable is not set")
+
+    cache_key = itinerary_cache_key(destination, start_date, end_date, budget, activities, group_size)
+    itinerary = await run_db(server.itinerary_cache.get, cache_key)
+
+    if itinerary is None:
+        prompt = server.build_itinerary_prompt(destination, start_date, end_date, budget, activities, group_size)
+        if cache_key is None:
+            itinerary = await generate_and_cache_itinerary(cache_key, prompt)
+        else:
+            itinerary = await server.itinerary_async_flights.do(cache_key, generate_and_cache_itinerary,
+                                                                cache_key, prompt)
+
+    return redate_itinerary(itinerary, start_date)
+
+
+async def get_trip_preferences_local(user_id):
+    return await run_db(server.get_trip_preferences_local, user_id)
+
+
+async def trip_preferences_version(user_id):
+    return await run_db(server.trip_preferences_version, user_id)
+
+
+# Function to get trip preferences for a user from Firebase Firestore through the async client
+async def get_trip_preferences_firebase(user_id):
+    async def latest():
+        query = server.db_async.collection('trip_preferences').where('user_id', '==', user_id) \
+            .order_by('created_at', direction=server.firestore.Query.DESCENDING).limit(1)
+        return [doc async for doc in query.stream()]
+
+    try:
+        docs = await server.firestore_breaker.acall(latest)
+    except CircuitOpen:
+        return None
+    except Exception as e:
+        logger.error(f"Error getting trip preferences from Firebase Firestore: {e}")
+        return None
+    for doc in docs:
+        return server.preferences_from_document(doc.to_dict())
+    return None
+
+
+# Generate Itinerary Route
+async def generate_itinerary(request):
+    data = await json_body(request)
+    logger.info("Received itinerary data: %s", data)
+
+    user_id = data.get('user_id')
+    destination = data.get('destination')
+    start_date = data.get('start_date')
+    end_date = data.get('end_date')
+    budget = data.get('budget')
+    activities = data.get('activities')
+    group_size = data.get('group_size')
+
+    if not all([user_id, destination, start_date, end_date, budget, activities, group_size]):
+        logger.error("Missing required fields in itinerary data")
+        return JSONResponse({"error": "All fields are required!"}, 400)
+
+    # Job mode, answered with 202 and a job to poll or follow over SSE
+    if server.wants_itinerary_job(request.query_params, request.headers):
+        body, status = await run_db(server.submit_itinerary_job, user_id, destination, start_date, end_date, budget,
+                                    activities, group_size, data.get('priority'))
+        headers = {"Location": body["status_url"]} if status == 202 else None
+        return JSONResponse(body, status, headers=headers)
+
+    # Save trip preferences locally, the outbox mirrors them to Firebase Firestore
+    trip_id = await run_db(server.save_trip_preferences_local,
+                           user_id, destination, start_date, end_date, budget, activities, group_size)
+
+    if not trip_id:
+        server.log_message(f"Failed to save trip preferences for user {user_id}", "ERROR")
+        return JSONResponse({"error": "Failed to save preferences"}, 500)
+
+    try:
+        itinerary = await generate_itinerary_with_gemini(destination, start_date, end_date, budget, activities,
+                                                         group_size)
+        itinerary_details = {
+            "destination": destination,
+            "start_date": start_date,
+            "end_date": end_date,
+            "budget": budget,
+            "group_size": group_size,
+            "activities": activities,
+            "itinerary": itinerary,
+            "trip_id": trip_id
+        }
+        await run_db(server.store_itinerary, user_id, trip_id, itinerary_details)
+        return JSONResponse(itinerary_details)
+
+    except Exception as e:
+        logger.error(f"Error generating itinerary with Gemini API: {e}")
+        # If Gemini API fails, generate a dynamic itinerary as a fallback
+        itinerary = server.generate_dynamic_itinerary(destination, start_date, end_date, budget, activities,
+                                                      group_size)
+        itinerary["trip_id"] = trip_id
+        await run_db(server.store_itinerary, user_id, trip_id, itinerary)
+        return JSONResponse(itinerary)
+
+
+# Get Trip Preferences Route
+async def get_preferences(request):
+    user_id = request.path_params['user_id']
+    preferences = await server.preference_cache.aget(user_id, get_trip_preferences_local,
+                                                     get_trip_preferences_firebase, trip_preferences_version)
+
+    if preferences:
+        server.log_message(f"Retrieved trip preferences for user {user_id}", "INFO")
+        return JSONResponse(preferences)
+    server.log_message(f"No trip preferences found for user {user_id}", "WARNING")
+    return JSONResponse({"error": "No preferences found for this user"}, 404)
+
+
+# Forgot Password Route
+async def forgot_password(request):
+    if request.method == 'OPTIONS':
+        return Response(status_code=200)
+
+    data = await json_body(request)
+    logger.info("Received forgot password data: %s", data)
+
+    email = data.get('email')
+
+    if not email:
+        logger.error("Missing required fields in forgot password data")
+        return JSONResponse({"error": "Email is required!"}, 400)
+
+    try:
+        logger.info(f"Attempting to send password reset email to {email}")
+
+        action_code_settings = server.auth.ActionCodeSettings(
+            url="http://localhost:3000/reset-password",
+            handle_code_in_app=False
+        )
+
+        await asyncio.to_thread(server.firebase_auth_call, 'send_password_reset_email', email, action_code_settings)
+        logger.info(f"Password reset email sent to {email}")
+
+        return JSONResponse({"message": "Password reset email sent successfully!"})
+    except server.auth.EmailNotFoundError:
+        logger.error(f"Email {email} not found in Firebase Authentication")
+        return JSONResponse({"error": "Email not found in Firebase Authentication!"}, 404)
+    except Exception as e:
+        logger.error(f"Error sending password reset email: {e}")
+        return JSONResponse({"error": "Failed to send password reset email."}, 500)
+
+
+# Starts the process like create_app() does for WSGI servers and builds the clients the
+# async routes use before the first request. The Gemini SDK import runs off the loop, the
+# Firestore AsyncClient is built on it since its channel belongs to this loop.
+@asynccontextmanager
+async def lifespan(_):
+    await asyncio.to_thread(server.create_app)
+    try:
+        await asyncio.to_thread(server.model.get)
+        server.db_async.get()
+    except Exception as e:
+        logger.warning(f"Could not initialize the Gemini and Firestore clients at startup: {e}")
+    yield
+    await asyncio.to_thread(server.stop_background_workers)
+    db_executor.shutdown(wait=False)
+
+
+routes = [
+    Route('/generate-itinerary', generate_itinerary, methods=['POST']),
+    Route('/api/trip-preferences/{user_id:int}', get_preferences, methods=['GET']),
+    Route('/api/forgot-password', forgot_password, methods=['POST', 'OPTIONS']),
+]
+
+async_app = Starlette(routes=routes, lifespan=lifespan, middleware=[
+    Middleware(CORSMiddleware,
+               allow_origins=[server.CORS_OPTIONS['origins']],
+               allow_credentials=server.CORS_OPTIONS['supports_credentials'],
+               allow_methods=server.CORS_OPTIONS['methods'],
+               allow_headers=server.CORS_OPTIONS['allow_headers']),
+])
+flask_app = WSGIMiddleware(server.app)
+
+
+# The async routes (preflights included) and the lifespan go to Starlette, the rest to Flask
+async def app(scope, receive, send):
+    if scope['type'] != 'http' or any(route.matches(scope)[0] != Match.NONE for route in routes):
+        await async_app(scope, receive, send)
+    else:
+        await flask_app(scope, receive, send)
@@ -0,0 +1,75 @@
+import os
+import sys
+import sqlite3
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from db_pool import ConnectionPool
+
+# Microbenchmark: the old connect-per-call query_db against the pooled read/write paths.
+# Runs against a throwaway database so user.db is never touched.
+#   python benchmarks/bench_db_pool.py [iterations]
+
+
+def legacy_query_db(path):
+    # The helper every entry point used before db_pool.py
+    def query_db(query, args=(), one=False):
+        with sqlite3.connect(path) as conn:
+            cur = conn.cursor()
+            cur.execute(query, args)
+            conn.commit()
+            rv = cur.fetchall()
+            return (rv[0] if rv else None) if one else rv
+    return query_db
+
+
+def setup(path):
+    with sqlite3.connect(path) as conn:
+        conn.execute('''CREATE TABLE users (
+                        id INTEGER PRIMARY KEY,
+                        username TEXT UNIQUE NOT NULL,
+                        email TEXT UNIQUE NOT NULL,
+                        phone TEXT UNIQUE NOT NULL,
+                        password TEXT NOT NULL,
+                        created_at DATETIME NOT NULL)''')
+
+
+def run(label, n, select, insert):
+    start = time.perf_counter()
+    for i in range(n):
+        insert("INSERT INTO users (username, email, phone, password, created_at) VALUES (?, ?, ?, ?, ?)",
+               (f"{label}{i}", f"{label}{i}@example.com", f"{label}-{i}", "x", "2025-01-01 00:00:00"))
+    write_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(n):
+        select("SELECT * FROM users WHERE email = ?", (f"{label}{i}@example.com",), one=True)
+    read_time = time.perf_counter() - start
+
+    print(f"{label:>8}: {n} inserts {write_time * 1e6 / n:8.1f} us/op | "
+          f"{n} selects {read_time * 1e6 / n:8.1f} us/op")
+    return write_time, read_time
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, 'legacy.db')
+        pooled_path = os.path.join(tmp, 'pooled.db')
+        setup(legacy_path)
+        setup(pooled_path)
+
+        legacy = legacy_query_db(legacy_path)
+        pool = ConnectionPool(pooled_path)
+
+        lw, lr = run('legacy', n, legacy, legacy)
+        pw, pr = run('pooled', n, pool.read, pool.write)
+        pool.close_all()
+
+    print(f"speedup: writes x{lw / pw:.1f}, reads x{lr / pr:.1f}")
+
+
+if __name__ == '__main__':
+    main()
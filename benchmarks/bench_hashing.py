@@ -0,0 +1,43 @@
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import bcrypt
+from hashing import HashingPool
+
+# Login throughput with bcrypt verification on the request threads versus in
+# HashingPool's worker processes, with the same number of concurrent "requests".
+#   python benchmarks/bench_hashing.py [logins] [threads] [rounds]
+
+
+def run(verify, logins, threads):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        assert all(executor.map(lambda _: verify(), range(logins)))
+    return logins / (time.perf_counter() - start)
+
+
+def main():
+    logins = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    rounds = int(sys.argv[3]) if len(sys.argv) > 3 else 12
+    hashed = bcrypt.hashpw(b'correct horse', bcrypt.gensalt(rounds))
+
+    inline = run(lambda: bcrypt.checkpw(b'correct horse', hashed), logins, threads)
+
+    pool = HashingPool(max_workers=os.cpu_count(), max_pending=threads, rounds=rounds)
+    pool.verify('warm up', hashed.decode())
+    pooled = run(lambda: pool.verify('correct horse', hashed.decode()), logins, threads)
+    metrics = pool.metrics()
+    pool.shutdown()
+
+    print(f"{logins} logins, {threads} threads, cost {rounds}, {os.cpu_count()} cores")
+    print(f"{'request threads':<18}{inline:>10.1f} logins/s")
+    print(f"{'hashing pool':<18}{pooled:>10.1f} logins/s  (avg verify {metrics['verify_latency_avg']}s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+import os
+import sys
+import time
+import random
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import migrations
+from db_pool import ConnectionPool
+
+# Query latency for the trip_preferences and users lookups before and after the
+# indexes added by migrations.py, on synthetic data in a throwaway database.
+#   python benchmarks/bench_migrations.py [preference_rows] [users]
+
+LATEST = "SELECT * FROM trip_preferences WHERE user_id = ? ORDER BY created_at DESC LIMIT 1"
+EXISTS = "SELECT * FROM trip_preferences WHERE user_id = ? AND created_at = ?"
+USER_OR = "SELECT * FROM users WHERE email = ? OR phone = ?"
+USER_UNION = "SELECT 1 FROM users WHERE email = ? UNION ALL SELECT 1 FROM users WHERE phone = ? LIMIT 1"
+
+
+def populate(pool, rows, users):
+    # Only the base tables, as init_db created them before migrations existed
+    with pool.connection() as conn:
+        migrations.create_base_tables(conn)
+    pool.write_many("INSERT INTO users (username, email, phone, password, created_at) VALUES (?, ?, ?, ?, ?)",
+                    ((f"user{i}", f"user{i}@example.com", f"{9000000000 + i}", "x", "2025-01-01 00:00:00")
+                     for i in range(users)))
+    rng = random.Random(42)
+    pool.write_many("INSERT INTO trip_preferences (user_id, destination, start_date, end_date, budget, "
+                    "activities, group_size, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    ((rng.randrange(users), "Goa", "2025-01-01", "2025-01-05", "20000", "Beach,Hiking", "2",
+                      f"2025-{1 + i % 12:02d}-{1 + i % 28:02d} {i // 3600 % 24:02d}:{i // 60 % 60:02d}:{i % 60:02d}.{i:07d}")
+                     for i in range(rows)))
+
+
+def measure(pool, users, samples):
+    rng = random.Random(7)
+    targets = [rng.randrange(users) for _ in range(samples)]
+    sample = pool.read(LATEST, (targets[0],), one=True)
+    results = {}
+    for label, query, args in (
+        ('latest preference', LATEST, lambda u: (u,)),
+        ('preference exists', EXISTS, lambda u: (u, sample[8] if sample else '')),
+        ('user email OR phone', USER_OR, lambda u: (f"user{u}@example.com", f"{9000000000 + u}")),
+        ('user email UNION phone', USER_UNION, lambda u: (f"user{u}@example.com", f"{9000000000 + u}")),
+    ):
+        start = time.perf_counter()
+        for user_id in targets:
+            pool.read(query, args(user_id), one=True)
+        results[label] = (time.perf_counter() - start) * 1e6 / samples
+    return results
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 50_000
+    samples = 200
+    with tempfile.TemporaryDirectory() as tmp:
+        pool = ConnectionPool(os.path.join(tmp, 'bench.db'))
+        start = time.perf_counter()
+        populate(pool, rows, users)
+        print(f"populated {rows} preference rows and {users} users in {time.perf_counter() - start:.1f}s")
+
+        before = measure(pool, users, samples)
+        start = time.perf_counter()
+        migrations.migrate(pool)
+        print(f"migrations applied in {time.perf_counter() - start:.1f}s")
+        after = measure(pool, users, samples)
+        pool.close_all()
+
+    print(f"{'query':<24}{'before us':>12}{'after us':>12}")
+    for label in before:
+        print(f"{label:<24}{before[label]:>12.1f}{after[label]:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import tempfile
+import subprocess
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import migrations
+from db_pool import ConnectionPool
+from hashing import _bcrypt_hash
+
+# Throughput and tail latency of the production serving mode (gunicorn.conf.py) for
+# 1..N worker processes. Each run starts gunicorn on a throwaway user.db seeded with
+# one user and one trip, then drives login, preference fetch and itinerary generation
+# with `concurrency` client threads. Without GEMINI_API_KEY the itinerary route
+# answers from its built-in generator, so it measures the serving path, not Gemini.
+#   python benchmarks/bench_serving.py [max_workers] [requests] [concurrency]
+
+EMAIL = 'bench@example.com'
+PASSWORD = 'bench-password'
+TRIP = {'user_id': 1, 'destination': 'Goa', 'start_date': '2025-01-10', 'end_date': '2025-01-13',
+        'budget': '20000', 'activities': ['beach', 'food'], 'group_size': 2}
+
+
+def seed(database):
+    pool = ConnectionPool(database)
+    migrations.migrate(pool)
+    pool.write("INSERT INTO users (username, email, phone, password, created_at) VALUES (?, ?, ?, ?, ?)",
+               ('bench', EMAIL, 'bench-phone', _bcrypt_hash(PASSWORD, int(os.getenv('BCRYPT_ROUNDS', 12))),
+                '2025-01-01 00:00:00'))
+    pool.write("INSERT INTO trip_preferences (user_id, destination, start_date, end_date, budget, activities, "
+               "group_size, created_at) VALUES (1, 'Goa', '2025-01-10', '2025-01-13', '20000', 'beach,food', 2, "
+               "'2025-01-01 00:00:00')")
+    pool.close_all()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def request(url, body=None):
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(req, timeout=60) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def wait_ready(base, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("gunicorn exited during startup")
+        try:
+            if request(f'{base}/api/health') == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("gunicorn did not become ready")
+
+
+def drive(url, body, requests, concurrency):
+    def one(_):
+        start = time.perf_counter()
+        status = request(url, body)
+        return (time.perf_counter() - start) * 1000, status
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(one, range(requests)))
+    elapsed = time.perf_counter() - start
+    latencies = sorted(latency for latency, _ in results)
+    errors = sum(1 for _, status in results if status >= 400)
+    return requests / elapsed, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99) - 1], errors
+
+
+def main():
+    max_workers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    concurrency = int(sys.argv[3]) if len(sys.argv) > 3 else 16
+
+    endpoints = (
+        ('login', '/api/login', {'email': EMAIL, 'password': PASSWORD}),
+        ('preferences', '/api/trip-preferences/1', None),
+        ('itinerary', '/generate-itinerary', TRIP),
+    )
+
+    print(f"{requests} requests per endpoint, {concurrency} concurrent clients")
+    print(f"{'workers':<9}{'endpoint':<13}{'req/s':>9}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for workers in range(1, max_workers + 1):
+        with tempfile.TemporaryDirectory() as tmp:
+            database = os.path.join(tmp, 'user.db')
+            seed(database)
+            port = free_port()
+            env = dict(os.environ, USER_DB_PATH=database, WEB_CONCURRENCY=str(workers),
+                       BIND=f'127.0.0.1:{port}', RUN_MIGRATIONS='1')
+            process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+                                        '--access-logfile', '/dev/null', 'wsgi:app'],
+                                       cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                base = f'http://127.0.0.1:{port}'
+                wait_ready(base, process)
+                for label, path, body in endpoints:
+                    # Warm every worker's pools and caches before measuring
+                    drive(base + path, body, concurrency * workers, concurrency)
+                    rate, p50, p99, errors = drive(base + path, body, requests, concurrency)
+                    print(f"{workers:<9}{label:<13}{rate:>9.1f}{p50:>10.1f}{p99:>10.1f}{errors:>8}")
+            finally:
+                process.send_signal(signal.SIGTERM)
+                process.wait(timeout=60)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+import os
+import sys
+import time
+import statistics
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import bcrypt
+import migrations
+from db_pool import ConnectionPool
+from hashing import HashingPool
+from outbox import Outbox
+from signup_pipeline import SignupPipeline
+
+# Signup latency of the old sequential route versus SignupPipeline, with the
+# Firebase calls replaced by sleeps of typical round-trip times and real bcrypt
+# and SQLite work. The Firestore mirror write only counts for the sequential
+# path, the pipeline leaves it to the outbox.
+#   python benchmarks/bench_signup.py [signups] [remote_ms] [rounds]
+
+
+def main():
+    signups = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    remote = (int(sys.argv[2]) if len(sys.argv) > 2 else 120) / 1000
+    rounds = int(sys.argv[3]) if len(sys.argv) > 3 else 12
+
+    def remote_call(*args):
+        time.sleep(remote)
+        return False
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pool = ConnectionPool(os.path.join(tmp, 'bench.db'))
+        migrations.migrate(pool)
+        outbox = Outbox(pool, client=None)
+
+        def check_local(email, phone):
+            return pool.read("SELECT 1 FROM users WHERE email = ? UNION ALL SELECT 1 FROM users WHERE phone = ?",
+                             (email, phone), one=True) is not None
+
+        def store_local(username, email, phone, hashed_pw, hashed_phone):
+            with pool.transaction() as conn:
+                conn.execute("INSERT INTO users (username, email, phone, password, created_at) VALUES (?, ?, ?, ?, ?)",
+                             (username, email, hashed_phone, hashed_pw, '2025-01-01 00:00:00'))
+                outbox.enqueue(conn, 'users', email, {'username': username})
+            return True
+
+        def sequential(i):
+            email, phone = f"seq{i}@example.com", f"{8000000000 + i}"
+            if check_local(email, phone) or remote_call(email):
+                raise RuntimeError("exists")
+            hashed_pw = bcrypt.hashpw(b'secret', bcrypt.gensalt(rounds)).decode()
+            hashed_phone = bcrypt.hashpw(phone.encode(), bcrypt.gensalt(rounds)).decode()
+            remote_call()  # auth.create_user
+            store_local(f"seq{i}", email, phone, hashed_pw, hashed_phone)
+            remote_call()  # Firestore users document
+
+        hashing_pool = HashingPool(rounds=rounds)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            pipeline = SignupPipeline(executor, hashing_pool, check_local, remote_call, remote_call,
+                                      lambda uid: None, store_local, phone_rounds=8)
+            hashing_pool.hash('warm up', rounds=4)
+
+            results = {}
+            for label, signup in (('sequential', sequential),
+                                  ('pipeline', lambda i: pipeline.run(f"p{i}", f"p{i}@example.com", f"{9000000000 + i}",
+                                                                      'secret'))):
+                latencies = []
+                for i in range(signups):
+                    start = time.perf_counter()
+                    signup(i)
+                    latencies.append((time.perf_counter() - start) * 1000)
+                latencies.sort()
+                results[label] = (statistics.median(latencies), latencies[int(len(latencies) * 0.95) - 1])
+        hashing_pool.shutdown()
+        pool.close_all()
+
+    print(f"{signups} signups, {remote * 1000:.0f}ms per Firebase call, cost {rounds}")
+    print(f"{'path':<12}{'p50 ms':>10}{'p95 ms':>10}")
+    for label, (p50, p95) in results.items():
+        print(f"{label:<12}{p50:>10.1f}{p95:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
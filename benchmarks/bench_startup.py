@@ -0,0 +1,50 @@
+import os
+import sys
+import json
+import statistics
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Cold import time of new-server.py and the startup breakdown of create_app(), each
+# run in a fresh interpreter. No client is built and no file or network I/O happens
+# until create_app() or the first request. Flask and Flask-Cors are imported and
+# timed first: they are needed to register the routes and take about 250ms cold,
+# most of a full import of roughly 330ms. The target is the rest, the app's own
+# modules, under 100ms (about 75ms; asyncio is only imported by the ASGI app).
+#   python benchmarks/bench_startup.py [runs]
+
+CHILD = '''
+import json, time, importlib
+start = time.perf_counter()
+import flask, flask_cors
+flask_loaded = time.perf_counter()
+server = importlib.import_module('new-server')
+imported = time.perf_counter()
+server.create_app()
+ready = time.perf_counter()
+print(json.dumps({"flask_ms": (flask_loaded - start) * 1000, "import_ms": (imported - flask_loaded) * 1000,
+                  "create_app_ms": (ready - imported) * 1000, "report": server.startup.report()}))
+'''
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    env = dict(os.environ, RUN_MIGRATIONS=os.getenv('RUN_MIGRATIONS', '1'))
+
+    results = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', CHILD], cwd=ROOT, env=env, check=True,
+                                capture_output=True, text=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"{runs} cold starts")
+    print(f"{'step':<14}{'p50 ms':>10}{'max ms':>10}")
+    for step in ('flask_ms', 'import_ms', 'create_app_ms'):
+        values = [result[step] for result in results]
+        print(f"{step[:-3]:<14}{statistics.median(values):>10.1f}{max(values):>10.1f}")
+    print(f"breakdown of the last run (ms): {results[-1]['report']}")
+
+
+if __name__ == '__main__':
+    main()
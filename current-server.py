@@ -2,6 +2,10 @@ from flask import Flask, request, jsonify
 from flask_cors import CORS
 from flask_bcrypt import Bcrypt
 import sqlite3
+import db_pool
+import migrations
+from activities import encode_activities, save_trip_activities
+from hashing import hashing_pool, needs_hash, credential_scheme
 from datetime import datetime
 import firebase_admin
 from firebase_admin import credentials, firestore, auth
@@ -72,19 +76,17 @@ def init_db():
                         message TEXT NOT NULL,
                         level TEXT NOT NULL,
                         timestamp DATETIME NOT NULL)''')
+    # Trip activities are stored in the trip_activities join table, which comes with
+    # migration 4. Later migrations add columns this file's SELECT * reads don't expect.
+    migrations.migrate(db_pool.pool, migrations.MIGRATIONS[:4])
     logger.info("Database initialized.")
 
 # Call init_db when the app starts
 init_db()
 
 # Helper function to interact with local database
-def query_db(query, args=(), one=False):
-    with sqlite3.connect('user.db') as conn:
-        cur = conn.cursor()
-        cur.execute(query, args)
-        conn.commit()
-        rv = cur.fetchall()
-        return (rv[0] if rv else None) if one else rv
+# Connections are pooled and reused, SELECTs skip the commit (see db_pool.py)
+query_db = db_pool.query_db
 
 # Function to insert user data into the local database
 def insert_user_local(username, email, phone, password, created_at):
@@ -100,6 +102,12 @@ def insert_user_local(username, email, phone, password, created_at):
         logger.error(f"General Error: {e}")
         return False
 
+# Function to bring a credential from Firestore into the local DB without rehashing bcrypt hashes
+def import_credential(value, scheme=None):
+    if needs_hash(value, scheme):
+        return hashing_pool.hash(value)
+    return value
+
 # Function to check if user exists in local database
 def check_user_exists_local(email, phone):
     try:
@@ -122,7 +130,11 @@ def insert_user_firebase(username, email, phone, password, created_at):
             'email': email,
             'phone': phone,
             'password': password,
-            'created_at': created_at
+            'password_scheme': credential_scheme(password),
+            'phone_scheme': credential_scheme(phone),
+            'created_at': created_at,
+            # Incremental pulls in new-server.py only see documents stamped with updated_at
+            'updated_at': firestore.SERVER_TIMESTAMP
         })
         logger.info(f"User {username} registered successfully in Firebase Firestore!")
         return True
@@ -163,16 +175,21 @@ def check_user_exists_firebase(email, phone):
 def save_trip_preferences_local(user_id, destination, start_date, end_date, budget, activities, group_size):
     try:
         # Convert activities list to a comma-separated string
-        activities_str = ",".join(activities)
-        created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        
-        query_db("""
-            INSERT INTO trip_preferences 
-            (user_id, destination, start_date, end_date, budget, activities, group_size, created_at) 
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """, 
-            (user_id, destination, start_date, end_date, budget, activities_str, group_size, created_at))
-        
+        activities_str = encode_activities(activities)
+        # (user_id, created_at) is unique, sub-second stamps keep two saves in one second apart
+        created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')
+
+        # The activities are linked in trip_activities in the same transaction, like new-server.py does
+        with db_pool.pool.transaction() as conn:
+            trip_id = conn.execute("""
+                INSERT INTO trip_preferences
+                (user_id, destination, start_date, end_date, budget, activities, group_size, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                RETURNING id
+                """,
+                (user_id, destination, start_date, end_date, budget, activities_str, group_size, created_at)).fetchone()[0]
+            save_trip_activities(conn, trip_id, activities)
+
         logger.info(f"Trip preferences for user {user_id} saved successfully in local DB!")
         return True
     except Exception as e:
@@ -195,7 +212,8 @@ def save_trip_preferences_firebase(user_id, destination, start_date, end_date, b
             'budget': budget,
             'activities': activities_str,
             'group_size': group_size,
-            'created_at': created_at
+            'created_at': created_at,
+            'updated_at': firestore.SERVER_TIMESTAMP
         })
         
         logger.info(f"Trip preferences for user {user_id} saved successfully in Firebase Firestore!")
@@ -308,8 +326,9 @@ def sync_users_from_firebase_firestore():
     for doc in users_ref:
         data = doc.to_dict()
         if not check_user_exists_local(data['email'], data['phone']):
-            hashed_pw = bcrypt.generate_password_hash(data['password']).decode('utf-8')
-            hashed_phone = bcrypt.generate_password_hash(data['phone'].encode('utf-8')).decode('utf-8')
+            # Values that are already hashed are copied verbatim, raw ones are hashed off-thread
+            hashed_pw = import_credential(data['password'], data.get('password_scheme'))
+            hashed_phone = import_credential(data['phone'], data.get('phone_scheme'))
             if insert_user_local(data['username'], data['email'], hashed_phone, hashed_pw, data['created_at']):
                 logger.info(f"User {data['username']} synced from Firebase Firestore to local DB!")
             else:
@@ -357,7 +376,8 @@ def log_message(message, level):
         log_ref.set({
             'message': message,
             'level': level,
-            'timestamp': timestamp
+            'timestamp': timestamp,
+            'updated_at': firestore.SERVER_TIMESTAMP
         })
         logger.info(f"Log '{message}' stored in Firebase Firestore.")
     except Exception as e:
@@ -166,19 +166,9 @@ const Dashboard = () => {
     }
   };
 
-  const readySetGo = async () => {
-    try {
-      const response = await axios.post(
-        'http://localhost:5000/generate-itinerary',
-        formData,
-        { withCredentials: true }
-      );
-      alert("Preferences saved and itinerary generated successfully!");
-      navigate('/tripplan', { state: { itinerary: response.data } });
-    } catch (error) {
-      console.error("Error saving preferences and generating itinerary:", error);
-      alert("Failed to save preferences and generate itinerary.");
-    }
+  // Open the trip plan right away, it streams the itinerary day by day
+  const readySetGo = () => {
+    navigate('/tripplan', { state: { preferences: formData } });
   };
 
   return (
@@ -0,0 +1,139 @@
+import os
+import sqlite3
+import threading
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Default location of the local database, same file every entry point already uses
+DATABASE_PATH = os.getenv('USER_DB_PATH', 'user.db')
+
+# Pragmas applied once to every pooled connection.
+# WAL lets readers run while a writer commits, synchronous=NORMAL is safe under WAL
+# and avoids an fsync per commit, and the cache/mmap settings keep hot pages in memory.
+DEFAULT_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('temp_store', 'MEMORY'),
+    ('cache_size', -8000),
+    ('mmap_size', 64 * 1024 * 1024),
+    ('busy_timeout', 5000),
+)
+
+
+# Pool of long-lived SQLite connections shared by all threads of a process.
+# A thread keeps the connection it checked out for the whole call, then hands it
+# back so the next request (which may run on a brand new thread under the
+# Werkzeug dev server) reuses it instead of reconnecting.
+class ConnectionPool:
+    def __init__(self, database=DATABASE_PATH, max_idle=8, pragmas=DEFAULT_PRAGMAS, cached_statements=256):
+        self.database = database
+        self.max_idle = max_idle
+        self.pragmas = pragmas
+        # sqlite3 keeps an LRU of prepared statements per connection, so reusing
+        # connections is what lets repeated queries skip the parse/prepare step
+        self.cached_statements = cached_statements
+        self._idle = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self.opened = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database, timeout=30, check_same_thread=False,
+                               cached_statements=self.cached_statements)
+        for name, value in self.pragmas:
+            conn.execute(f"PRAGMA {name} = {value}")
+        self.opened += 1
+        return conn
+
+    # Connections must never cross a fork, the child starts with an empty pool
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._idle = []
+                    self._pid = os.getpid()
+
+    def _acquire(self):
+        self._check_pid()
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self._connect()
+
+    def _release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if len(self._idle) < self.max_idle and self._pid == os.getpid():
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    # Borrow a connection for the duration of a with-block
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    # Run several statements atomically, commit on success and roll back on error.
+    # immediate takes the write lock up front (BEGIN IMMEDIATE), so what the block
+    # reads cannot change before its writes commit.
+    @contextmanager
+    def transaction(self, immediate=False):
+        with self.connection() as conn:
+            with conn:
+                if immediate:
+                    conn.execute("BEGIN IMMEDIATE")
+                yield conn
+
+    # Read path: plain SELECTs, no commit
+    def read(self, query, args=(), one=False):
+        with self.connection() as conn:
+            cur = conn.execute(query, args)
+            rv = cur.fetchone() if one else cur.fetchall()
+            cur.close()
+            return rv
+
+    # Write path: one statement in its own transaction
+    def write(self, query, args=(), one=False):
+        with self.transaction() as conn:
+            cur = conn.execute(query, args)
+            rv = cur.fetchall()
+            cur.close()
+            return (rv[0] if rv else None) if one else rv
+
+    # Write path for many rows of the same statement in a single transaction
+    def write_many(self, query, seq_of_args):
+        with self.transaction() as conn:
+            cur = conn.executemany(query, seq_of_args)
+            count = cur.rowcount
+            cur.close()
+            return count
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                logger.error(f"Error closing pooled connection: {e}")
+
+
+# Process-wide pool for user.db
+pool = ConnectionPool()
+
+
+# Drop-in replacement for the old connect-per-call query_db helper.
+# SELECT/WITH statements take the read path and skip the commit, everything else
+# is committed through the write path.
+def query_db(query, args=(), one=False):
+    head = query.lstrip()[:6].upper()
+    if head.startswith('SELECT') or head.startswith('WITH'):
+        return pool.read(query, args, one=one)
+    return pool.write(query, args, one=one)
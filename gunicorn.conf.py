@@ -0,0 +1,36 @@
+import os
+
+# Production serving, see wsgi.py:
+#   gunicorn -c gunicorn.conf.py wsgi:app
+# WEB_CONCURRENCY worker processes, each serving WEB_THREADS requests at a time, so a
+# slow Gemini or Firestore call holds one thread rather than the whole server.
+
+bind = os.getenv('BIND', '0.0.0.0:5000')
+workers = int(os.getenv('WEB_CONCURRENCY', os.cpu_count() or 1))
+worker_class = 'gthread'
+threads = int(os.getenv('WEB_THREADS', 8))
+# Import the app once in the master, workers are forked from it
+preload_app = True
+# gthread workers heartbeat between requests, so this only catches a stuck worker
+timeout = int(os.getenv('WEB_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+accesslog = '-'
+
+# Every worker has its own bcrypt process pool, split the cores between them
+os.environ.setdefault('HASHING_WORKERS', str(max(1, (os.cpu_count() or 2) // (2 * workers))))
+
+
+def on_starting(server):
+    import wsgi
+    wsgi.prepare()
+
+
+def post_fork(server, worker):
+    import wsgi
+    wsgi.post_fork()
+
+
+def worker_exit(server, worker):
+    import wsgi
+    wsgi.worker_exit()
@@ -0,0 +1,157 @@
+import os
+import time
+import bisect
+import threading
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+
+logger = logging.getLogger(__name__)
+
+# Markers stored next to credential fields in Firestore documents so an importer
+# can tell a value that is already hashed from one that still needs hashing
+SCHEME_BCRYPT = 'bcrypt'
+SCHEME_PLAIN = 'plain'
+
+BCRYPT_PREFIXES = ('$2a$', '$2b$', '$2y$')
+
+
+# True if the value has the shape of a bcrypt hash ($2b$12$ + 53 chars)
+def is_bcrypt_hash(value):
+    return isinstance(value, str) and len(value) == 60 and value.startswith(BCRYPT_PREFIXES)
+
+
+# Scheme marker to store alongside a credential value
+def credential_scheme(value):
+    return SCHEME_BCRYPT if is_bcrypt_hash(value) else SCHEME_PLAIN
+
+
+# Whether an imported credential still has to be hashed.
+# The explicit marker wins, documents written before markers existed are sniffed.
+def needs_hash(value, scheme=None):
+    if scheme == SCHEME_BCRYPT:
+        return False
+    if scheme == SCHEME_PLAIN:
+        return True
+    return not is_bcrypt_hash(value)
+
+
+# Upper bounds (seconds) of the latency histogram buckets, the last bucket is open-ended
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5)
+
+# Cost factor for new hashes, 12 matches Flask-Bcrypt's default so existing hashes verify unchanged
+DEFAULT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 12))
+
+
+class HashingBusy(Exception):
+    """Raised when no hashing slot frees up within the caller's timeout."""
+
+
+# Run in the worker process
+def _bcrypt_hash(value, rounds):
+    return bcrypt.hashpw(value.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _bcrypt_verify(value, hashed):
+    try:
+        return bcrypt.checkpw(value.encode('utf-8'), hashed.encode('utf-8'))
+    except ValueError:
+        # Not a bcrypt hash (e.g. a plain value copied from an old document)
+        return False
+
+
+# Process pool for bcrypt work that must not run on the server's threads.
+# At most max_pending operations are queued or running. Beyond that, callers
+# without a timeout block (the sync import path), and request handlers pass a
+# timeout and get HashingBusy, so a login burst is answered quickly instead of
+# piling up behind the workers. Hash and verify latencies are recorded per
+# operation, queue wait included.
+class HashingPool:
+    def __init__(self, max_workers=None, max_pending=None, rounds=DEFAULT_ROUNDS):
+        self.max_workers = max_workers or max(1, (os.cpu_count() or 2) // 2)
+        self.max_pending = max_pending or self.max_workers * 2
+        self.rounds = rounds
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._pending = 0
+        self.stats = {'hashes': 0, 'verifies': 0, 'failed': 0, 'rejected': 0}
+        self._histograms = {op: [0] * (len(LATENCY_BUCKETS) + 1) for op in ('hash', 'verify')}
+        self._latency_total = {'hash': 0.0, 'verify': 0.0}
+
+    def _get_executor(self):
+        with self._lock:
+            # Worker processes and the executor's management thread belong to the
+            # process that started them, a forked server worker starts its own
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+                self._pid = os.getpid()
+            return self._executor
+
+    def _done(self, op, started, future):
+        latency = time.monotonic() - started
+        self._slots.release()
+        with self._lock:
+            self._pending -= 1
+            if future.exception() is not None:
+                self.stats['failed'] += 1
+                return
+            self.stats['hashes' if op == 'hash' else 'verifies'] += 1
+            self._latency_total[op] += latency
+            self._histograms[op][bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+
+    def _submit(self, op, fn, args, timeout):
+        if not self._slots.acquire(timeout=timeout):
+            with self._lock:
+                self.stats['rejected'] += 1
+            raise HashingBusy(f"No hashing slot free within {timeout}s")
+        started = time.monotonic()
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._pending += 1
+        future.add_done_callback(lambda f: self._done(op, started, f))
+        return future
+
+    def submit(self, value, rounds=None, timeout=None):
+        return self._submit('hash', _bcrypt_hash, (value, rounds or self.rounds), timeout)
+
+    def hash(self, value, rounds=None, timeout=None):
+        return self.submit(value, rounds, timeout).result()
+
+    def verify(self, value, hashed, timeout=None):
+        return self._submit('verify', _bcrypt_verify, (value, hashed), timeout).result()
+
+    def metrics(self):
+        with self._lock:
+            completed = self.stats['hashes'] + self.stats['verifies']
+            metrics = dict(self.stats,
+                           rounds=self.rounds,
+                           workers=self.max_workers,
+                           max_pending=self.max_pending,
+                           pending=self._pending,
+                           throughput_per_s=round(completed / max(time.monotonic() - self._started, 1e-9), 3))
+            for op, counts in self._histograms.items():
+                done = sum(counts)
+                histogram = {f"le_{bound}": count for bound, count in zip(LATENCY_BUCKETS, counts)}
+                histogram['le_inf'] = counts[-1]
+                metrics[f'{op}_latency_avg'] = round(self._latency_total[op] / done, 4) if done else None
+                metrics[f'{op}_latency_histogram'] = histogram
+            return metrics
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None and self._pid == os.getpid():
+            executor.shutdown(wait=True)
+
+
+# Shared pool for signup/login and the sync import path
+hashing_pool = HashingPool(max_workers=int(os.getenv('HASHING_WORKERS', 0)) or None,
+                           max_pending=int(os.getenv('HASHING_MAX_PENDING', 0)) or None)
@@ -0,0 +1,196 @@
+import time
+import random
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling a dependency whose circuit is open."""
+
+    def __init__(self, name, retry_in):
+        super().__init__(f"{name} is unavailable, retrying in {retry_in:.1f}s")
+        self.name = name
+        self.retry_in = retry_in
+
+
+# Circuit breaker for one remote dependency, fed by the outcomes of real calls.
+# After failure_threshold consecutive failures the circuit opens and callers are
+# turned away at once. Once reset_timeout has passed, a single trial call (real
+# traffic, or the probe run by HealthMonitor) is let through. Success closes the
+# circuit, failure opens it again for twice as long, up to max_reset_timeout.
+# Exceptions listed in `ignore` are answers from a healthy backend (e.g. "email
+# already exists") and count as successes. `ignore` may also be a predicate on the
+# exception, for exception classes that should not be imported up front. state and available() only read
+# memory, so request handlers can consult them freely.
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=5, reset_timeout=5.0, max_reset_timeout=300.0,
+                 probe=None, ignore=(), trial_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.probe = probe
+        self.ignore = ignore if callable(ignore) else tuple(ignore)
+        self.trial_timeout = trial_timeout
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._timeout = reset_timeout
+        self._retry_at = 0.0
+        self._trial_started = None
+        self.stats = {'successes': 0, 'failures': 0, 'rejected': 0, 'opened': 0, 'probes': 0}
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and time.monotonic() >= self._retry_at:
+                return HALF_OPEN
+            return self._state
+
+    # False only while the circuit is open and not yet due for a trial
+    def available(self):
+        return self.state != OPEN
+
+    def retry_in(self):
+        with self._lock:
+            return max(0.0, self._retry_at - time.monotonic()) if self._state == OPEN else 0.0
+
+    # Whether a call may go out now. In half-open state only one trial runs at a time.
+    def allow(self):
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            now = time.monotonic()
+            trial_running = self._trial_started is not None and now - self._trial_started < self.trial_timeout
+            if (self._state == OPEN and now < self._retry_at) or trial_running:
+                self.stats['rejected'] += 1
+                return False
+            self._state = HALF_OPEN
+            self._trial_started = now
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.stats['successes'] += 1
+            if self._state != CLOSED:
+                logger.info(f"{self.name} recovered, circuit closed")
+            self._state = CLOSED
+            self._failures = 0
+            self._timeout = self.reset_timeout
+            self._trial_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self.stats['failures'] += 1
+            self._failures += 1
+            if self._state == HALF_OPEN:
+                self._timeout = min(self.max_reset_timeout, self._timeout * 2)
+            elif self._state == OPEN or self._failures < self.failure_threshold:
+                return
+            self._state = OPEN
+            self._trial_started = None
+            self._retry_at = time.monotonic() + self._timeout * random.uniform(0.8, 1.2)
+            self.stats['opened'] += 1
+            logger.warning(f"{self.name} circuit opened after {self._failures} failures, "
+                           f"retrying in {self._timeout:.0f}s")
+
+    # Record an exception from a call, returns True if it counted as a failure
+    def record_error(self, error):
+        ignored = self.ignore(error) if callable(self.ignore) else isinstance(error, self.ignore)
+        if ignored:
+            self.record_success()
+            return False
+        self.record_failure()
+        return True
+
+    def call(self, fn, *args, **kwargs):
+        if not self.allow():
+            raise CircuitOpen(self.name, self.retry_in())
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            self.record_error(e)
+            raise
+        self.record_success()
+        return result
+
+    async def acall(self, fn, *args, **kwargs):
+        if not self.allow():
+            raise CircuitOpen(self.name, self.retry_in())
+        try:
+            result = await fn(*args, **kwargs)
+        except Exception as e:
+            self.record_error(e)
+            raise
+        self.record_success()
+        return result
+
+    def probe_due(self):
+        return self.probe is not None and self.state == HALF_OPEN
+
+    def run_probe(self):
+        if not self.allow():
+            return
+        with self._lock:
+            self.stats['probes'] += 1
+        try:
+            self.probe()
+        except Exception as e:
+            logger.info(f"{self.name} probe failed: {e}")
+            self.record_failure()
+            return
+        self.record_success()
+
+    def metrics(self):
+        state = self.state
+        with self._lock:
+            return dict(self.stats,
+                        state=state,
+                        consecutive_failures=self._failures,
+                        retry_in=round(max(0.0, self._retry_at - time.monotonic()), 1) if state == OPEN else 0.0)
+
+
+# Background prober for open circuits. Circuits that are due for a trial and have a
+# cheap probe are tested here rather than on the next user request.
+class HealthMonitor:
+    def __init__(self, breakers, interval=1.0):
+        self.breakers = {breaker.name: breaker for breaker in breakers}
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __getitem__(self, name):
+        return self.breakers[name]
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='health-monitor', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            for breaker in self.breakers.values():
+                if breaker.probe_due():
+                    breaker.run_probe()
+
+    # Current state of every dependency, no I/O
+    def snapshot(self):
+        return {name: breaker.state for name, breaker in self.breakers.items()}
+
+    def metrics(self):
+        return {name: breaker.metrics() for name, breaker in self.breakers.items()}
+
+    def shutdown(self, timeout=5):
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            thread.join(timeout)
+        self._thread = None
@@ -0,0 +1,166 @@
+import re
+import json
+import time
+import threading
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# Budget band upper bounds in INR, a budget falls into the first band it fits under
+BUDGET_BANDS = (5000, 10000, 25000, 50000, 100000, 250000, 500000)
+
+# Group size bands: solo, couple, small group, large group
+GROUP_BANDS = (1, 2, 5)
+
+
+def _canonical_text(value):
+    value = re.sub(r'[^\w\s]', ' ', str(value).casefold())
+    return ' '.join(value.split())
+
+
+def _band(value, bands):
+    for i, bound in enumerate(bands):
+        if value <= bound:
+            return i
+    return len(bands)
+
+
+def _number(value):
+    match = re.search(r'\d+(?:\.\d+)?', str(value).replace(',', ''))
+    return float(match.group()) if match else None
+
+
+# Normalized cache key for a set of trip preferences, None when the request can't be keyed.
+# Destination is canonicalized, activities are sorted, absolute dates become a trip
+# length and budget/group size are bucketed, so near-identical requests share an entry.
+def itinerary_cache_key(destination, start_date, end_date, budget, activities, group_size):
+    try:
+        days = (datetime.strptime(end_date, '%Y-%m-%d') - datetime.strptime(start_date, '%Y-%m-%d')).days + 1
+    except (TypeError, ValueError):
+        return None
+    if days < 1:
+        return None
+    amount = _number(budget)
+    people = _number(group_size)
+    budget_band = _band(amount, BUDGET_BANDS) if amount is not None else 'x'
+    group_band = _band(people, GROUP_BANDS) if people is not None else 'x'
+    activity_set = sorted({_canonical_text(activity) for activity in activities or []})
+    return f"{_canonical_text(destination)}|{days}d|b{budget_band}|g{group_band}|{','.join(activity_set)}"
+
+
+# Stamp each day with its calendar date counted from start_date.
+# Cached itineraries are stored without dates so they can be reused for any start date.
+def redate_itinerary(itinerary, start_date):
+    start = datetime.strptime(start_date, '%Y-%m-%d')
+    return [dict(day, date=(start + timedelta(days=day['day'] - 1)).strftime('%Y-%m-%d')) for day in itinerary]
+
+
+def _undated(itinerary):
+    return [{k: v for k, v in day.items() if k != 'date'} for day in itinerary]
+
+
+# LRU + TTL cache of generated itineraries with an optional SQLite tier.
+# Memory holds the hottest max_entries keys, the disk tier (when a pool is given)
+# keeps everything until it expires so a restart doesn't start cold. Its table is
+# created by migrations.py.
+class ItineraryCache:
+    def __init__(self, max_entries=1024, ttl=24 * 3600, pool=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.pool = pool
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'evictions': 0,
+            'expirations': 0,
+        }
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _remember(self, key, itinerary, expires_at):
+        with self._lock:
+            self._entries[key] = (itinerary, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def get(self, key):
+        if key is None:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                itinerary, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.stats['memory_hits'] += 1
+                    return itinerary
+                del self._entries[key]
+                self.stats['expirations'] += 1
+
+        if self.pool is not None:
+            try:
+                row = self.pool.read("SELECT itinerary, expires_at FROM itinerary_cache WHERE cache_key = ?",
+                                     (key,), one=True)
+            except Exception as e:
+                logger.error(f"Error reading itinerary cache from local DB: {e}")
+                row = None
+            if row and row[1] > now:
+                itinerary = json.loads(row[0])
+                self._remember(key, itinerary, row[1])
+                self._count('disk_hits')
+                return itinerary
+
+        self._count('misses')
+        return None
+
+    def put(self, key, itinerary, ttl=None):
+        if key is None or not itinerary:
+            return
+        itinerary = _undated(itinerary)
+        now = time.time()
+        expires_at = now + (ttl or self.ttl)
+        self._remember(key, itinerary, expires_at)
+        self._count('stores')
+        if self.pool is not None:
+            try:
+                self.pool.write("INSERT OR REPLACE INTO itinerary_cache (cache_key, itinerary, created_at, expires_at) "
+                                "VALUES (?, ?, ?, ?)",
+                                (key, json.dumps(itinerary, separators=(',', ':'), ensure_ascii=False), now, expires_at))
+            except Exception as e:
+                logger.error(f"Error writing itinerary cache to local DB: {e}")
+
+    # Seconds until the entry for key expires, None if there is none
+    def expires_in(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None:
+            return max(0.0, entry[1] - now)
+        if self.pool is not None:
+            row = self.pool.read("SELECT expires_at FROM itinerary_cache WHERE cache_key = ?", (key,), one=True)
+            if row and row[0] > now:
+                return row[0] - now
+        return None
+
+    # Drop expired rows from the disk tier
+    def purge_expired(self):
+        if self.pool is not None:
+            self.pool.write("DELETE FROM itinerary_cache WHERE expires_at <= ?", (time.time(),))
+
+    def metrics(self):
+        with self._lock:
+            lookups = self.stats['memory_hits'] + self.stats['disk_hits'] + self.stats['misses']
+            hits = lookups - self.stats['misses']
+            return dict(self.stats, entries=len(self._entries),
+                        hit_ratio=round(hits / lookups, 3) if lookups else 0.0)
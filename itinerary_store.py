@@ -0,0 +1,75 @@
+import json
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+# Per-user itinerary storage.
+# Every generated itinerary is persisted in the itineraries table as compact JSON,
+# keyed by (user_id, trip_id), together with an ETag of that JSON. The most recently
+# used trips are kept in a bounded LRU so dashboard polls are answered from memory
+# with the stored body and ETag as-is. A user's latest trip is never memoized, other
+# processes save trips too: it is resolved with one lookup on the (user_id, trip_id)
+# index per call. The table is created by migrations.py.
+class ItineraryStore:
+    def __init__(self, pool, max_entries=512):
+        self.pool = pool
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'memory_hits': 0, 'disk_reads': 0, 'misses': 0, 'saves': 0}
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    # Persist an itinerary and return its ETag
+    def save(self, user_id, trip_id, itinerary):
+        body = json.dumps(itinerary, separators=(',', ':'), ensure_ascii=False)
+        etag = hashlib.sha1(body.encode('utf-8')).hexdigest()
+        self.pool.write("INSERT OR REPLACE INTO itineraries (user_id, trip_id, itinerary, etag, created_at) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (user_id, trip_id, body, etag, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        self._remember((user_id, trip_id), (trip_id, body, etag))
+        self._count('saves')
+        return etag
+
+    # (trip_id, json body, etag) of a trip, or of the user's latest trip when trip_id is None
+    def get(self, user_id, trip_id=None):
+        if trip_id is None:
+            trip_id = self.pool.read("SELECT MAX(trip_id) FROM itineraries WHERE user_id = ?", (user_id,), one=True)[0]
+            if trip_id is None:
+                self._count('misses')
+                return None
+        key = (user_id, trip_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.stats['memory_hits'] += 1
+                return entry
+
+        row = self.pool.read("SELECT trip_id, itinerary, etag FROM itineraries WHERE user_id = ? AND trip_id = ?",
+                             (user_id, trip_id), one=True)
+        if row is None:
+            self._count('misses')
+            return None
+        self._count('disk_reads')
+        entry = tuple(row)
+        self._remember(key, entry)
+        return entry
+
+    def metrics(self):
+        with self._lock:
+            return dict(self.stats, entries=len(self._entries))
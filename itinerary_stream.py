@@ -0,0 +1,67 @@
+import re
+import json
+
+SLOTS = (('Morning:', 'morning'), ('Afternoon:', 'afternoon'), ('Evening:', 'evening'))
+
+
+# Line-oriented parser for Gemini's "Day N / Morning / Afternoon / Evening" format
+# that can be fed the response a chunk at a time. A partial line is kept until its
+# newline arrives, and a day is handed out as soon as the next "Day" header shows
+# up (or the stream ends), so callers can forward each day while later ones are
+# still being generated.
+class IncrementalItineraryParser:
+    def __init__(self):
+        self._buffer = ''
+        self._current = None
+        self.days = []
+
+    def _line(self, line):
+        line = line.strip()
+        completed = None
+        if line.startswith('Day'):
+            match = re.search(r'\d+', line)
+            if not match:
+                return None
+            completed = self._current
+            self._current = {
+                "day": int(match.group()),
+                "morning": "",
+                "afternoon": "",
+                "evening": ""
+            }
+        elif self._current is not None:
+            for prefix, slot in SLOTS:
+                if line.startswith(prefix):
+                    self._current[slot] = line.replace(prefix, '').strip()
+                    break
+        if completed is not None:
+            self.days.append(completed)
+        return completed
+
+    # Feed the next chunk of text, returns the days completed by it
+    def feed(self, chunk):
+        self._buffer += chunk
+        *lines, self._buffer = self._buffer.split('\n')
+        completed = []
+        for line in lines:
+            day = self._line(line)
+            if day is not None:
+                completed.append(day)
+        return completed
+
+    # End of the response, returns the last day(s) still open
+    def close(self):
+        completed = self.feed('\n')
+        if self._current is not None:
+            self.days.append(self._current)
+            completed.append(self._current)
+            self._current = None
+        return completed
+
+
+# One event in the wire format the client asked for
+def format_event(event, data, sse=False):
+    payload = json.dumps(dict(data, type=event), ensure_ascii=False)
+    if sse:
+        return f"event: {event}\ndata: {payload}\n\n"
+    return payload + '\n'
@@ -0,0 +1,168 @@
+import os
+import json
+import time
+import threading
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+
+from activities import ACTIVITY_LIST_SQL
+from health import CircuitOpen
+from itinerary_cache import itinerary_cache_key
+from sync_scheduler import LockFile
+
+logger = logging.getLogger(__name__)
+
+
+# Parse an hours window such as "1-6" (01:00 to 05:59) or "22-5" (across midnight)
+def parse_hours(value):
+    start, end = (int(hour) % 24 for hour in value.split('-', 1))
+    return start, end
+
+
+def in_hours(hours, hour):
+    start, end = hours
+    return start <= hour < end if start <= end else hour >= start or hour < end
+
+
+# Pre-generated itineraries for the trips asked for most.
+# mine() counts recent trip_preferences by itinerary cache key (destination, trip
+# length, budget band, group band, activity set) and keeps the top_n keys requested at
+# least min_requests times. run_once() generates the ones without a template in the
+# itinerary cache, or whose template expires within refresh_before, and stores them for
+# template_ttl, so matching requests are answered from the cache. Generations are
+# paced to rate_per_minute and wait while busy() reports live Gemini traffic. The
+# background thread only works inside the off-peak `hours` window and only in the
+# process holding the lock file, one per host.
+class ItineraryWarmup:
+    def __init__(self, pool, cache, generate, lock_path, top_n=50, lookback_days=30, min_requests=3,
+                 rate_per_minute=6, template_ttl=7 * 24 * 3600, refresh_before=24 * 3600, hours=(1, 6),
+                 interval=900, busy=None, enabled=True):
+        self.pool = pool
+        self.cache = cache
+        # generate(destination, start_date, end_date, budget, activities, group_size) -> itinerary days
+        self.generate = generate
+        self.lock = LockFile(lock_path)
+        self.top_n = top_n
+        self.lookback_days = lookback_days
+        self.min_requests = min_requests
+        self.pace = 60.0 / rate_per_minute
+        self.template_ttl = template_ttl
+        self.refresh_before = refresh_before
+        self.hours = hours
+        self.interval = interval
+        self.busy = busy
+        self.enabled = enabled
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._last_run = None
+        self.stats = {'runs': 0, 'candidates': 0, 'generated': 0, 'refreshed': 0, 'failed': 0, 'deferred': 0}
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.stats[name] += n
+
+    # [(cache_key, preferences, requests)] for the most requested trips, most requested first.
+    # Rows are pre-grouped in SQL, activities taken from trip_activities, then merged on
+    # the normalized key.
+    def mine(self):
+        since = (datetime.now() - timedelta(days=self.lookback_days)).strftime('%Y-%m-%d %H:%M:%S')
+        rows = self.pool.read(f'''SELECT destination, start_date, end_date, budget, activity_list, group_size, COUNT(*)
+                                  FROM (SELECT destination, start_date, end_date, budget, group_size,
+                                        {ACTIVITY_LIST_SQL} AS activity_list
+                                        FROM trip_preferences WHERE created_at >= ?)
+                                  GROUP BY lower(trim(destination)), julianday(end_date) - julianday(start_date),
+                                           budget, activity_list, group_size''', (since,))
+        counts = Counter()
+        examples = {}
+        for destination, start_date, end_date, budget, activity_list, group_size, requests in rows:
+            preferences = (destination, start_date, end_date, budget, json.loads(activity_list), group_size)
+            key = itinerary_cache_key(*preferences)
+            if key is None:
+                continue
+            counts[key] += requests
+            examples.setdefault(key, preferences)
+        return [(key, examples[key], requests) for key, requests in counts.most_common(self.top_n)
+                if requests >= self.min_requests]
+
+    def _in_window(self):
+        return in_hours(self.hours, datetime.now().hour)
+
+    def _may_continue(self, scheduled):
+        return not self._stop.is_set() and (not scheduled or self._in_window())
+
+    # Generate the missing and expiring templates, returns how many were stored.
+    # A scheduled run stops when the off-peak window closes.
+    def run_once(self, scheduled=False):
+        plan = []
+        for key, preferences, _ in self.mine():
+            remaining = self.cache.expires_in(key)
+            if remaining is None or remaining < self.refresh_before:
+                plan.append((key, preferences, remaining is not None))
+        self._count('runs')
+        self._count('candidates', len(plan))
+
+        stored = 0
+        for key, preferences, refresh in plan:
+            while self.busy is not None and self.busy() and self._may_continue(scheduled):
+                self._count('deferred')
+                self._stop.wait(self.pace)
+            if not self._may_continue(scheduled):
+                break
+            started = time.monotonic()
+            try:
+                itinerary = self.generate(*preferences)
+            except CircuitOpen:
+                logger.info("Gemini unavailable, itinerary warm-up stopped for this run")
+                break
+            except Exception as e:
+                self._count('failed')
+                logger.warning(f"Could not pre-generate itinerary for {key}: {e}")
+            else:
+                self.cache.put(key, itinerary, ttl=self.template_ttl)
+                self._count('refreshed' if refresh else 'generated')
+                stored += 1
+            # Rate budget, at most rate_per_minute generations
+            self._stop.wait(max(0.0, self.pace - (time.monotonic() - started)))
+
+        with self._lock:
+            self._last_run = time.time()
+        if plan:
+            logger.info(f"Itinerary warm-up stored {stored} of {len(plan)} templates")
+        return stored
+
+    def start(self):
+        if not self.enabled or (self._thread is not None and self._pid == os.getpid()):
+            return
+        if self._pid is not None and self._pid != os.getpid():
+            self.lock.forget()
+        self._stop.clear()
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='itinerary-warmup', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if not self._in_window() or not self.lock.acquire():
+                continue
+            try:
+                self.run_once(scheduled=True)
+            except Exception as e:
+                logger.error(f"Itinerary warm-up failed: {e}")
+        self.lock.release()
+
+    def metrics(self):
+        with self._lock:
+            return dict(self.stats,
+                        enabled=self.enabled,
+                        active=self.lock.held,
+                        seconds_since_run=round(time.time() - self._last_run, 1) if self._last_run else None)
+
+    def shutdown(self, timeout=10):
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive() and self._pid == os.getpid():
+            thread.join(timeout)
+        self._thread = None
@@ -0,0 +1,274 @@
+import os
+import json
+import time
+import uuid
+import random
+import sqlite3
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+FINISHED = (DONE, FAILED)
+
+
+class JobLimitExceeded(Exception):
+    """Raised when a user already has the maximum number of jobs waiting."""
+
+
+# Durable queue of itinerary generation jobs in user.db, no external broker.
+# submit() records a job and returns its id at once. Worker threads, in every server
+# process, claim the job with the highest priority (oldest first) whose user has fewer
+# than per_user_limit jobs running, run handler(payload) and keep the result for
+# polling. The claim is a single UPDATE, so processes sharing user.db never run the
+# same job twice. A job with the dedupe_key of a queued or running job is not added
+# again, the caller gets the existing one. Claims hold a lease: the job of a worker
+# that died is queued again once it expires. Failed jobs are retried with backoff up
+# to max_attempts, finished jobs are deleted after `retention` seconds.
+class JobQueue:
+    def __init__(self, pool, handler, workers=4, per_user_limit=2, max_queued_per_user=10, lease=120,
+                 max_attempts=2, backoff=2.0, poll_interval=1.0, retention=24 * 3600):
+        self.pool = pool
+        self.handler = handler
+        self.workers = workers
+        self.per_user_limit = per_user_limit
+        self.max_queued_per_user = max_queued_per_user
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self._wakeup = threading.Condition()
+        self._finished = threading.Condition()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._pid = None
+        self._last_maintenance = 0.0
+        self.stats = {'submitted': 0, 'deduped': 0, 'rejected': 0, 'completed': 0, 'failed': 0, 'retried': 0,
+                      'expired_leases': 0}
+        self._wait_total = 0.0
+        self._run_total = 0.0
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.stats[name] += n
+
+    # Id of the queued or running job with this dedupe_key, None if there is none
+    def active(self, dedupe_key):
+        if dedupe_key is None:
+            return None
+        row = self.pool.read("SELECT id FROM itinerary_jobs WHERE dedupe_key = ? AND status IN ('queued', 'running')",
+                             (dedupe_key,), one=True)
+        return row[0] if row else None
+
+    # Queue a job inside the caller's transaction, so it commits or rolls back with the
+    # caller's own writes, and call notify() after the commit. Returns the job id.
+    # The transaction must be pool.transaction(immediate=True), otherwise two requests
+    # can both pass the limit check before either inserts.
+    # Raises JobLimitExceeded when the user already has max_queued_per_user jobs waiting,
+    # and sqlite3.IntegrityError when a job with dedupe_key is queued or running.
+    def enqueue(self, conn, user_id, payload, priority=0, dedupe_key=None):
+        queued = conn.execute("SELECT COUNT(*) FROM itinerary_jobs WHERE user_id = ? AND status = 'queued'",
+                              (user_id,)).fetchone()[0]
+        if queued >= self.max_queued_per_user:
+            self._count('rejected')
+            raise JobLimitExceeded(f"User {user_id} already has {queued} jobs waiting")
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn.execute('''INSERT INTO itinerary_jobs (id, user_id, dedupe_key, priority, status, payload,
+                        available_at, created_at) VALUES (?, ?, ?, ?, 'queued', ?, ?, ?)''',
+                     (job_id, user_id, dedupe_key, priority, json.dumps(payload), now, now))
+        self._count('submitted')
+        return job_id
+
+    # Wake a worker for a freshly committed job
+    def notify(self):
+        self.start()
+        with self._wakeup:
+            self._wakeup.notify()
+
+    # Id of the job that was queued first with dedupe_key, after enqueue() lost that race,
+    # None if it has finished since
+    def duplicate_of(self, dedupe_key):
+        existing = self.active(dedupe_key)
+        if existing is not None:
+            self._count('deduped')
+        return existing
+
+    # Queue a job, returns (job_id, deduped). Raises JobLimitExceeded when the user
+    # already has max_queued_per_user jobs waiting.
+    def submit(self, user_id, payload, priority=0, dedupe_key=None):
+        try:
+            with self.pool.transaction(immediate=True) as conn:
+                job_id = self.enqueue(conn, user_id, payload, priority, dedupe_key)
+        except sqlite3.IntegrityError:
+            # Another request queued the same work first
+            existing = self.duplicate_of(dedupe_key)
+            if existing is None:
+                raise
+            return existing, True
+        self.notify()
+        return job_id, False
+
+    # Status of a job for polling, None if unknown. Finished jobs carry result or error,
+    # queued ones their position in the queue.
+    def get(self, job_id):
+        row = self.pool.read('''SELECT id, status, priority, attempts, result, error, created_at, started_at, finished_at
+                                FROM itinerary_jobs WHERE id = ?''', (job_id,), one=True)
+        if row is None:
+            return None
+        job_id, status, priority, attempts, result, error, created_at, started_at, finished_at = row
+        job = {
+            "job_id": job_id,
+            "status": status,
+            "priority": priority,
+            "attempts": attempts,
+            "created_at": created_at,
+            "started_at": started_at,
+            "finished_at": finished_at
+        }
+        if status == QUEUED:
+            job["position"] = self.pool.read('''SELECT COUNT(*) FROM itinerary_jobs WHERE status = 'queued'
+                                                AND (priority > ? OR (priority = ? AND created_at < ?))''',
+                                             (priority, priority, created_at), one=True)[0]
+        elif status == DONE:
+            job["result"] = json.loads(result)
+        elif status == FAILED:
+            job["error"] = error
+        return job
+
+    # Block until the job has finished or `timeout` has passed, returns get(job_id).
+    # Jobs finished in this process wake the waiter at once, jobs finished by another
+    # process are seen on the next poll.
+    def wait(self, job_id, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job["status"] in FINISHED or remaining <= 0:
+                return job
+            with self._finished:
+                self._finished.wait(min(remaining, self.poll_interval))
+
+    def start(self):
+        # Worker threads do not survive a fork, a forked child starts its own
+        if self._threads and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._threads and self._pid == os.getpid():
+                return
+            self._stop.clear()
+            self._pid = os.getpid()
+            self._threads = [threading.Thread(target=self._run, name=f'itinerary-job-{i}', daemon=True)
+                             for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+
+    # Highest priority job whose user is below the running limit, marked running under a lease
+    def _claim(self):
+        now = time.time()
+        return self.pool.write('''UPDATE itinerary_jobs SET status = 'running', attempts = attempts + 1,
+                                  started_at = ?, lease_until = ?
+                                  WHERE id = (SELECT id FROM itinerary_jobs AS j
+                                              WHERE status = 'queued' AND available_at <= ?
+                                              AND (SELECT COUNT(*) FROM itinerary_jobs AS r
+                                                   WHERE r.user_id = j.user_id AND r.status = 'running') < ?
+                                              ORDER BY priority DESC, created_at LIMIT 1)
+                                  RETURNING id, payload, attempts, created_at''',
+                               (now, now + self.lease, now, self.per_user_limit), one=True)
+
+    def _finish(self, job_id, status, result=None, error=None):
+        self.pool.write('''UPDATE itinerary_jobs SET status = ?, result = ?, error = ?, finished_at = ?, lease_until = NULL
+                           WHERE id = ?''', (status, result, error, time.time(), job_id))
+        with self._finished:
+            self._finished.notify_all()
+
+    def _execute(self, job):
+        job_id, payload, attempts, created_at = job
+        started = time.time()
+        try:
+            result = self.handler(json.loads(payload))
+        except Exception as e:
+            if attempts < self.max_attempts:
+                delay = self.backoff * 2 ** (attempts - 1) * random.uniform(0.5, 1.0)
+                logger.warning(f"Itinerary job {job_id} failed ({e}), retrying in {delay:.1f}s")
+                self.pool.write('''UPDATE itinerary_jobs SET status = 'queued', lease_until = NULL, available_at = ?,
+                                   error = ? WHERE id = ?''', (time.time() + delay, str(e)[:500], job_id))
+                self._count('retried')
+            else:
+                logger.error(f"Itinerary job {job_id} failed after {attempts} attempts: {e}")
+                self._finish(job_id, FAILED, error=str(e)[:500])
+                self._count('failed')
+            return
+        self._finish(job_id, DONE, result=json.dumps(result))
+        with self._lock:
+            self.stats['completed'] += 1
+            self._wait_total += started - created_at
+            self._run_total += time.time() - started
+
+    # Requeue jobs whose worker died (or fail them once out of attempts) and delete old finished jobs
+    def _maintain(self):
+        now = time.time()
+        with self._lock:
+            if now - self._last_maintenance < self.poll_interval * 10:
+                return
+            self._last_maintenance = now
+        failed = self.pool.write('''UPDATE itinerary_jobs SET status = 'failed', error = 'worker lost', finished_at = ?,
+                                    lease_until = NULL
+                                    WHERE status = 'running' AND lease_until < ? AND attempts >= ? RETURNING id''',
+                                 (now, now, self.max_attempts))
+        requeued = self.pool.write('''UPDATE itinerary_jobs SET status = 'queued', lease_until = NULL, available_at = ?
+                                      WHERE status = 'running' AND lease_until < ? RETURNING id''', (now, now))
+        if failed or requeued:
+            self._count('expired_leases', len(failed) + len(requeued))
+            logger.warning(f"Itinerary jobs with expired leases: {len(requeued)} requeued, {len(failed)} failed")
+        self.pool.write("DELETE FROM itinerary_jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                        (now - self.retention,))
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                job = self._claim()
+                if job is None:
+                    self._maintain()
+            except Exception as e:
+                logger.error(f"Itinerary job queue error: {e}")
+                job = None
+            if job is None:
+                with self._wakeup:
+                    self._wakeup.wait(self.poll_interval)
+                continue
+            try:
+                self._execute(job)
+            except Exception as e:
+                # Recording the outcome failed (e.g. database is locked), the lease
+                # expires and _maintain() requeues the job
+                logger.error(f"Itinerary job {job[0]} could not be recorded, left to its lease: {e}")
+
+    def metrics(self):
+        counts = dict(self.pool.read("SELECT status, COUNT(*) FROM itinerary_jobs GROUP BY status"))
+        with self._lock:
+            completed = self.stats['completed']
+            return dict(self.stats,
+                        workers=self.workers,
+                        queued=counts.get(QUEUED, 0),
+                        running=counts.get(RUNNING, 0),
+                        done=counts.get(DONE, 0),
+                        failed_jobs=counts.get(FAILED, 0),
+                        queue_wait_avg=round(self._wait_total / completed, 3) if completed else None,
+                        run_time_avg=round(self._run_total / completed, 3) if completed else None)
+
+    # Stop claiming, let running jobs finish. Queued jobs stay in user.db for the next start.
+    def shutdown(self, timeout=30):
+        self._stop.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        threads, self._threads = self._threads, []
+        if self._pid == os.getpid():
+            for thread in threads:
+                thread.join(timeout)
@@ -0,0 +1,327 @@
+import time
+import random
+import bisect
+import threading
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from health import CircuitOpen
+from startup import Lazy, LazyModule
+
+# Only the ASGI app awaits Gemini, WSGI processes never import asyncio
+asyncio = LazyModule('asyncio')
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the latency histogram buckets, the last bucket is open-ended
+LATENCY_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60)
+
+
+class LLMTimeout(Exception):
+    pass
+
+
+# Execution layer for Gemini calls.
+# Calls run on a dedicated thread pool instead of the Flask worker and at most
+# max_concurrency of them are in flight at once, the rest wait for a slot. Every
+# call has a deadline, failures are retried with exponential backoff inside that
+# deadline, and once enough latencies are known a second (hedged) request is sent
+# if the first one is slower than the hedge percentile. Whichever answers first wins.
+# agenerate() is the same for coroutines on an event loop (see asgi.py): it awaits
+# Gemini's async API under its own async_max_concurrency slots and holds no thread.
+class LLMClient:
+    def __init__(self, model, max_concurrency=4, timeout=30, retries=2, backoff=0.5,
+                 hedge_percentile=0.95, hedge_min_samples=20, hedge=True, breaker=None,
+                 async_max_concurrency=None):
+        self.model = model
+        # Optional health.CircuitBreaker, while it is open calls fail fast with CircuitOpen
+        self.breaker = breaker
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        # Room for hedges and for attempts abandoned at their deadline that are still finishing
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency * 2, thread_name_prefix='gemini')
+        self.async_max_concurrency = async_max_concurrency or max_concurrency
+        self._async_slots = Lazy('gemini_async_slots', lambda: asyncio.Semaphore(self.async_max_concurrency))
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=200)
+        self._waiting = 0
+        self._in_flight = 0
+        self.stats = {
+            'calls': 0,
+            'succeeded': 0,
+            'failed': 0,
+            'timeouts': 0,
+            'retries': 0,
+            'hedges': 0,
+            'hedge_wins': 0,
+            'rejected': 0,
+        }
+        self._histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.stats[name] += n
+
+    def _call(self, prompt, timeout):
+        response = self.model.generate_content(prompt, request_options={'timeout': timeout})
+        return response.text
+
+    def _record(self, future, started):
+        self._slots.release()
+        with self._lock:
+            self._in_flight -= 1
+            if future.exception() is None:
+                latency = time.monotonic() - started
+                self._latencies.append(latency)
+                self._histogram[bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+
+    # Start one attempt once a concurrency slot is free, None if no slot came up in time
+    def _submit(self, prompt, deadline, block=True):
+        with self._lock:
+            self._waiting += 1
+        try:
+            acquired = self._slots.acquire(timeout=max(0, deadline - time.monotonic())) if block \
+                else self._slots.acquire(blocking=False)
+        finally:
+            with self._lock:
+                self._waiting -= 1
+        if not acquired:
+            return None
+        with self._lock:
+            self._in_flight += 1
+        started = time.monotonic()
+        future = self._executor.submit(self._call, prompt, max(1, deadline - started))
+        future.add_done_callback(lambda f: self._record(f, started))
+        return future
+
+    # Delay after which a hedged request is sent, None until enough samples exist
+    def hedge_delay(self):
+        with self._lock:
+            if not self.hedge or len(self._latencies) < self.hedge_min_samples:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.hedge_percentile))]
+
+    def _attempt(self, prompt, deadline):
+        primary = self._submit(prompt, deadline)
+        if primary is None:
+            raise LLMTimeout("Timed out waiting for a free Gemini slot")
+        pending = {primary}
+
+        hedge_after = self.hedge_delay()
+        if hedge_after is not None:
+            done, _ = wait(pending, timeout=min(hedge_after, max(0, deadline - time.monotonic())))
+            if not done and time.monotonic() < deadline:
+                hedged = self._submit(prompt, deadline, block=False)
+                if hedged is not None:
+                    self._count('hedges')
+                    pending.add(hedged)
+
+        error = None
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise LLMTimeout("Gemini call exceeded its deadline")
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is not primary:
+                        self._count('hedge_wins')
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def _check_breaker(self):
+        if self.breaker is not None and not self.breaker.allow():
+            self._count('rejected')
+            raise CircuitOpen(self.breaker.name, self.breaker.retry_in())
+
+    def _report(self, error=None):
+        if self.breaker is None:
+            return
+        if error is None:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_error(error)
+
+    # Generate text for a prompt, raises LLMTimeout once the deadline passes
+    def generate(self, prompt, timeout=None):
+        self._check_breaker()
+        deadline = time.monotonic() + (timeout or self.timeout)
+        self._count('calls')
+        attempt = 0
+        while True:
+            try:
+                text = self._attempt(prompt, deadline)
+                self._count('succeeded')
+                self._report()
+                return text
+            except LLMTimeout as e:
+                self._count('timeouts')
+                self._report(e)
+                raise
+            except Exception as e:
+                attempt += 1
+                delay = self.backoff * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+                if attempt > self.retries or time.monotonic() + delay >= deadline:
+                    self._count('failed')
+                    self._report(e)
+                    raise
+                logger.warning(f"Gemini call failed ({e}), retrying in {delay:.2f}s")
+                self._count('retries')
+                time.sleep(delay)
+
+    async def _acall(self, prompt, deadline):
+        with self._lock:
+            self._waiting += 1
+        try:
+            await asyncio.wait_for(self._async_slots.acquire(), max(0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            raise LLMTimeout("Timed out waiting for a free Gemini slot")
+        finally:
+            with self._lock:
+                self._waiting -= 1
+        with self._lock:
+            self._in_flight += 1
+        started = time.monotonic()
+        succeeded = False
+        try:
+            response = await self.model.generate_content_async(
+                prompt, request_options={'timeout': max(1, deadline - started)})
+            succeeded = True
+            return response.text
+        finally:
+            self._async_slots.release()
+            with self._lock:
+                self._in_flight -= 1
+                if succeeded:
+                    latency = time.monotonic() - started
+                    self._latencies.append(latency)
+                    self._histogram[bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+
+    # Like _attempt, except that the losing or abandoned call is cancelled rather than left to finish
+    async def _aattempt(self, prompt, deadline):
+        primary = asyncio.ensure_future(self._acall(prompt, deadline))
+        pending = {primary}
+        try:
+            hedge_after = self.hedge_delay()
+            if hedge_after is not None:
+                done, _ = await asyncio.wait(pending, timeout=min(hedge_after, max(0, deadline - time.monotonic())))
+                if not done and time.monotonic() < deadline and not self._async_slots.locked():
+                    self._count('hedges')
+                    pending.add(asyncio.ensure_future(self._acall(prompt, deadline)))
+
+            error = None
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise LLMTimeout("Gemini call exceeded its deadline")
+                done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self._count('hedge_wins')
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    # Async generate(), same deadline, retries, hedging and breaker
+    async def agenerate(self, prompt, timeout=None):
+        self._check_breaker()
+        deadline = time.monotonic() + (timeout or self.timeout)
+        self._count('calls')
+        attempt = 0
+        while True:
+            try:
+                text = await self._aattempt(prompt, deadline)
+                self._count('succeeded')
+                self._report()
+                return text
+            except LLMTimeout as e:
+                self._count('timeouts')
+                self._report(e)
+                raise
+            except Exception as e:
+                attempt += 1
+                delay = self.backoff * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+                if attempt > self.retries or time.monotonic() + delay >= deadline:
+                    self._count('failed')
+                    self._report(e)
+                    raise
+                logger.warning(f"Gemini call failed ({e}), retrying in {delay:.2f}s")
+                self._count('retries')
+                await asyncio.sleep(delay)
+
+    # Yield the response text chunk by chunk as Gemini produces it.
+    # The concurrency slot is held until the stream is exhausted or closed. Nothing is
+    # retried or hedged here because part of the answer may already be with the client.
+    def stream(self, prompt, timeout=None):
+        self._check_breaker()
+        deadline = time.monotonic() + (timeout or self.timeout)
+        self._count('calls')
+        with self._lock:
+            self._waiting += 1
+        try:
+            acquired = self._slots.acquire(timeout=max(0, deadline - time.monotonic()))
+        finally:
+            with self._lock:
+                self._waiting -= 1
+        if not acquired:
+            self._count('timeouts')
+            error = LLMTimeout("Timed out waiting for a free Gemini slot")
+            self._report(error)
+            raise error
+
+        with self._lock:
+            self._in_flight += 1
+        started = time.monotonic()
+        succeeded = False
+        error = None
+        try:
+            response = self.model.generate_content(prompt, stream=True,
+                                                   request_options={'timeout': max(1, deadline - started)})
+            for chunk in response:
+                if time.monotonic() > deadline:
+                    self._count('timeouts')
+                    raise LLMTimeout("Gemini stream exceeded its deadline")
+                yield chunk.text
+            succeeded = True
+            self._count('succeeded')
+        except LLMTimeout as e:
+            error = e
+            raise
+        except Exception as e:
+            error = e
+            self._count('failed')
+            raise
+        finally:
+            # A stream the caller closed early was still answering, that counts as healthy
+            self._report(error)
+            self._slots.release()
+            with self._lock:
+                self._in_flight -= 1
+                if succeeded:
+                    latency = time.monotonic() - started
+                    self._latencies.append(latency)
+                    self._histogram[bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+
+    def metrics(self):
+        with self._lock:
+            histogram = {f"le_{bound}": count for bound, count in zip(LATENCY_BUCKETS, self._histogram)}
+            histogram['le_inf'] = self._histogram[-1]
+            return dict(self.stats,
+                        queue_depth=self._waiting,
+                        in_flight=self._in_flight,
+                        max_concurrency=self.max_concurrency,
+                        async_max_concurrency=self.async_max_concurrency,
+                        latency_histogram=histogram)
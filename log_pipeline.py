@@ -0,0 +1,177 @@
+import os
+import queue
+import time
+import uuid
+import threading
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Largest number of writes Firestore accepts in one batch commit
+MAX_BATCH_WRITES = 500
+
+
+# (doc_id, message, level, timestamp) for one log entry.
+# Second-resolution timestamp as before, the document id is unique per record.
+def log_record(message, level):
+    now = datetime.now()
+    return (f"{now.strftime('%Y%m%d%H%M%S%f')}-{uuid.uuid4().hex[:8]}",
+            message, level, now.strftime('%Y-%m-%d %H:%M:%S'))
+
+
+# Audit log shipping off the request thread.
+# log() only builds a tuple and puts it on a bounded queue. A single background
+# writer drains the queue in batches: one executemany transaction into the local
+# logs table and one Firestore batch commit per 500 records. When the queue is
+# full the record is dropped and counted rather than blocking the request.
+class LogPipeline:
+    def __init__(self, pool, client=None, collection='logs', max_queue=10000, batch_size=200, flush_interval=0.5,
+                 breaker=None):
+        self.pool = pool
+        self.client = client
+        # Optional health.CircuitBreaker for Firestore, while it is open logs are only stored locally
+        self.breaker = breaker
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            'enqueued': 0,
+            'dropped': 0,
+            'written_local': 0,
+            'written_remote': 0,
+            'failed_local': 0,
+            'failed_remote': 0,
+            'skipped_remote': 0,
+            'batches': 0,
+        }
+
+    def _running(self):
+        return self._thread is not None and self._pid == os.getpid() and self._thread.is_alive()
+
+    def _ensure_started(self):
+        # The writer thread does not survive a fork, start a fresh one in the child,
+        # and replace one that died
+        if self._running():
+            return
+        with self._lock:
+            if self._running():
+                return
+            self._stop.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='log-pipeline', daemon=True)
+            self._thread.start()
+
+    # Called from request handlers, never blocks
+    def log(self, message, level):
+        self._ensure_started()
+        record = log_record(message, level)
+        try:
+            self._queue.put_nowait(record)
+            self._count('enqueued')
+            return True
+        except queue.Full:
+            self._count('dropped')
+            return False
+
+    def _count(self, name, n=1):
+        with self._stats_lock:
+            self.stats[name] += n
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def _drain(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0 or self._stop.is_set():
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except queue.Empty:
+                    break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        try:
+            self.pool.write_many("INSERT INTO logs (message, level, timestamp) VALUES (?, ?, ?)",
+                                 [(message, level, timestamp) for _, message, level, timestamp in batch])
+            self._count('written_local', len(batch))
+        except Exception as e:
+            self._count('failed_local', len(batch))
+            logger.error(f"Error storing {len(batch)} logs in local DB: {e}")
+
+        if self.client is None:
+            return
+        try:
+            # A lazily built client is initialized here, logs stay local while that fails
+            coll = self.client.collection(self.collection)
+        except Exception as e:
+            self._count('skipped_remote', len(batch))
+            logger.warning(f"Firebase Firestore client unavailable, {len(batch)} logs stored locally only: {e}")
+            return
+        for i in range(0, len(batch), MAX_BATCH_WRITES):
+            chunk = batch[i:i + MAX_BATCH_WRITES]
+            if self.breaker is not None and not self.breaker.allow():
+                self._count('skipped_remote', len(chunk))
+                continue
+            try:
+                fs_batch = self.client.batch()
+                for doc_id, message, level, timestamp in chunk:
+                    fs_batch.set(coll.document(doc_id), {
+                        'message': message,
+                        'level': level,
+                        'timestamp': timestamp
+                    })
+                fs_batch.commit()
+                if self.breaker is not None:
+                    self.breaker.record_success()
+                self._count('written_remote', len(chunk))
+            except Exception as e:
+                if self.breaker is not None:
+                    self.breaker.record_error(e)
+                self._count('failed_remote', len(chunk))
+                logger.error(f"Error storing {len(chunk)} logs in Firebase Firestore: {e}")
+
+    def _run(self):
+        while not (self._stop.is_set() and self._queue.empty()):
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = [first]
+            try:
+                batch = self._drain(first)
+                self._write(batch)
+                self._count('batches')
+            except Exception as e:
+                # One bad batch must not stop the writer
+                logger.error(f"Log pipeline failed to write {len(batch)} logs: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    # Block until everything enqueued so far has been written
+    def flush(self):
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+
+    # Drain what is queued and stop the writer
+    def shutdown(self, timeout=10):
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive() and self._pid == os.getpid():
+            thread.join(timeout)
+        self._thread = None
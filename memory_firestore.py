@@ -0,0 +1,293 @@
+import copy
+import threading
+from datetime import datetime, timedelta, timezone
+
+# In-memory stand-in for the subset of the google-cloud-firestore client that the
+# sync code uses. It lets the sync engine run (and be benchmarked) without
+# credentials or network access:
+#
+#   migrations.migrate(pool)
+#   client = MemoryFirestore()
+#   engine = SyncEngine(client, pool, specs, server_timestamp=SERVER_TIMESTAMP)
+
+try:
+    from google.api_core.exceptions import AlreadyExists
+except ImportError:  # google-cloud libraries not installed
+    class AlreadyExists(Exception):
+        pass
+
+DOCUMENT_ID = '__name__'
+
+
+# Sentinel replaced by the commit time when a document is written,
+# mirrors firestore.SERVER_TIMESTAMP
+class _ServerTimestamp:
+    def __repr__(self):
+        return 'SERVER_TIMESTAMP'
+
+
+SERVER_TIMESTAMP = _ServerTimestamp()
+
+
+class FieldPath:
+    @staticmethod
+    def document_id():
+        return DOCUMENT_ID
+
+
+class Query:
+    ASCENDING = 'ASCENDING'
+    DESCENDING = 'DESCENDING'
+
+    def __init__(self, client, collection, filters=(), orders=(), limit_to=None, start=None, fields=None):
+        self._client = client
+        self._collection = collection
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit_to
+        self._start = start
+        self._fields = fields
+
+    def _copy(self, **changes):
+        state = dict(filters=self._filters, orders=self._orders, limit_to=self._limit,
+                     start=self._start, fields=self._fields)
+        state.update(changes)
+        return Query(self._client, self._collection, **state)
+
+    def where(self, field, op, value):
+        return self._copy(filters=self._filters + ((field, op, value),))
+
+    def order_by(self, field, direction=ASCENDING):
+        return self._copy(orders=self._orders + ((field, direction),))
+
+    def limit(self, count):
+        return self._copy(limit_to=count)
+
+    # Accepts a snapshot or a dict of order_by field values, like the real client
+    def start_after(self, document_fields):
+        return self._copy(start=document_fields)
+
+    def select(self, field_paths):
+        return self._copy(fields=list(field_paths))
+
+    def _orders_or_default(self):
+        orders = list(self._orders)
+        if not any(field == DOCUMENT_ID for field, _ in orders):
+            orders.append((DOCUMENT_ID, self.ASCENDING))
+        return orders
+
+    def _matches(self, doc_id, data):
+        for field, op, value in self._filters:
+            actual = doc_id if field == DOCUMENT_ID else data.get(field)
+            if actual is None and op != '==':
+                return False
+            if op == '==' and actual != value:
+                return False
+            if op == '>' and not actual > value:
+                return False
+            if op == '>=' and not actual >= value:
+                return False
+            if op == '<' and not actual < value:
+                return False
+            if op == '<=' and not actual <= value:
+                return False
+            if op == 'in' and actual not in value:
+                return False
+        return True
+
+    @staticmethod
+    def _value(doc_id, data, field):
+        return doc_id if field == DOCUMENT_ID else data.get(field)
+
+    def stream(self):
+        docs = self._client._snapshot(self._collection)
+        docs = [(doc_id, data) for doc_id, data in docs if self._matches(doc_id, data)]
+        orders = self._orders_or_default()
+        for field, direction in reversed(orders):
+            docs.sort(key=lambda item: (self._value(item[0], item[1], field) is None,
+                                        self._value(item[0], item[1], field)),
+                      reverse=direction == self.DESCENDING)
+
+        if self._start is not None:
+            if isinstance(self._start, DocumentSnapshot):
+                start_id, start_data = self._start.id, self._start._data
+            else:
+                start_id, start_data = self._start.get(DOCUMENT_ID), self._start
+            start_key = [self._value(start_id, start_data, field) for field, _ in orders]
+            remaining = []
+            for doc_id, data in docs:
+                key = [self._value(doc_id, data, field) for field, _ in orders]
+                if self._after(key, start_key, orders):
+                    remaining.append((doc_id, data))
+            docs = remaining
+
+        if self._limit is not None:
+            docs = docs[:self._limit]
+        for doc_id, data in docs:
+            self._client.reads += 1
+            if self._fields is not None:
+                data = {k: v for k, v in data.items() if k in self._fields}
+            yield DocumentSnapshot(self._collection.document(doc_id), data)
+
+    @staticmethod
+    def _after(key, start_key, orders):
+        for value, start, (_, direction) in zip(key, start_key, orders):
+            if start is None or value == start:
+                continue
+            if direction == Query.DESCENDING:
+                return value < start
+            return value > start
+        return False
+
+    def get(self):
+        return list(self.stream())
+
+
+class DocumentSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return self._data.get(field) if self._data else None
+
+
+class DocumentReference:
+    def __init__(self, collection, doc_id):
+        self._collection = collection
+        self.id = doc_id
+
+    def set(self, data, merge=False):
+        self._collection._client._write(self._collection.id, self.id, data, merge=merge)
+
+    def create(self, data):
+        self._collection._client._write(self._collection.id, self.id, data, create=True)
+
+    def delete(self):
+        self._collection._client._delete(self._collection.id, self.id)
+
+    def get(self):
+        return DocumentSnapshot(self, self._collection._client._read(self._collection.id, self.id))
+
+
+class CollectionReference(Query):
+    def __init__(self, client, name):
+        super().__init__(client, self)
+        self.id = name
+
+    def document(self, doc_id):
+        return DocumentReference(self, doc_id)
+
+
+class WriteBatch:
+    MAX_WRITES = 500
+
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def set(self, reference, data, merge=False):
+        self._writes.append(('set', reference, data, merge))
+
+    def create(self, reference, data):
+        self._writes.append(('create', reference, data, False))
+
+    def delete(self, reference):
+        self._writes.append(('delete', reference, None, False))
+
+    def __len__(self):
+        return len(self._writes)
+
+    # All-or-nothing, like a real batch commit
+    def commit(self):
+        if len(self._writes) > self.MAX_WRITES:
+            raise ValueError(f"A batch can contain at most {self.MAX_WRITES} writes")
+        with self._client._lock:
+            for op, ref, _, _ in self._writes:
+                if op == 'create' and self._client._read(ref._collection.id, ref.id) is not None:
+                    raise AlreadyExists(f"Document already exists: {ref._collection.id}/{ref.id}")
+            for op, ref, data, merge in self._writes:
+                if op == 'delete':
+                    self._client._delete(ref._collection.id, ref.id)
+                else:
+                    self._client._write(ref._collection.id, ref.id, data, merge=merge)
+        self._client.batch_commits += 1
+        self._writes = []
+
+
+class MemoryFirestore:
+    def __init__(self):
+        self._collections = {}
+        self._lock = threading.RLock()
+        self._clock = datetime(2000, 1, 1, tzinfo=timezone.utc)
+        # Counters so callers can assert on round trips
+        self.writes = 0
+        self.reads = 0
+        self.batch_commits = 0
+
+    def collection(self, name):
+        return CollectionReference(self, name)
+
+    def batch(self):
+        return WriteBatch(self)
+
+    # Batched point lookups, one round trip for many documents
+    def get_all(self, references, field_paths=None):
+        snapshots = []
+        with self._lock:
+            for ref in references:
+                data = self._read(ref._collection.id, ref.id)
+                if data is not None and field_paths is not None:
+                    data = {k: v for k, v in data.items() if k in field_paths}
+                snapshots.append(DocumentSnapshot(ref, data))
+        return iter(snapshots)
+
+    def _now(self):
+        now = datetime.now(timezone.utc)
+        self._clock = max(now, self._clock + timedelta(microseconds=1))
+        return self._clock
+
+    def _resolve(self, data):
+        now = None
+        resolved = {}
+        for key, value in data.items():
+            if value is SERVER_TIMESTAMP:
+                now = now or self._now()
+                value = now
+            resolved[key] = copy.deepcopy(value)
+        return resolved
+
+    def _write(self, collection, doc_id, data, merge=False, create=False):
+        with self._lock:
+            docs = self._collections.setdefault(collection, {})
+            if create and doc_id in docs:
+                raise AlreadyExists(f"Document already exists: {collection}/{doc_id}")
+            resolved = self._resolve(data)
+            if merge and doc_id in docs:
+                docs[doc_id].update(resolved)
+            else:
+                docs[doc_id] = resolved
+            self.writes += 1
+
+    def _delete(self, collection, doc_id):
+        with self._lock:
+            self._collections.get(collection, {}).pop(doc_id, None)
+
+    def _read(self, collection, doc_id):
+        with self._lock:
+            self.reads += 1
+            data = self._collections.get(collection, {}).get(doc_id)
+            return copy.deepcopy(data) if data is not None else None
+
+    def _snapshot(self, collection):
+        with self._lock:
+            docs = self._collections.get(collection.id, {})
+            return [(doc_id, copy.deepcopy(data)) for doc_id, data in docs.items()]
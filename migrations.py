@@ -0,0 +1,245 @@
+import argparse
+import sqlite3
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+# Versioned schema migrations for user.db.
+# Each migration runs once, in order, inside its own BEGIN IMMEDIATE transaction
+# and is recorded in schema_migrations, so concurrent processes starting at the
+# same time apply it exactly once and a failed migration leaves no partial schema.
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+# 1: the tables init_db has always created
+def create_base_tables(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS users (
+                    id INTEGER PRIMARY KEY,
+                    username TEXT UNIQUE NOT NULL,
+                    email TEXT UNIQUE NOT NULL,
+                    phone TEXT UNIQUE NOT NULL,
+                    password TEXT NOT NULL,
+                    created_at DATETIME NOT NULL)''')
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS trip_preferences (
+                    id INTEGER PRIMARY KEY,
+                    user_id INTEGER NOT NULL,
+                    destination TEXT NOT NULL,
+                    start_date TEXT NOT NULL,
+                    end_date TEXT NOT NULL,
+                    budget TEXT NOT NULL,
+                    activities TEXT NOT NULL,
+                    group_size TEXT NOT NULL,
+                    created_at DATETIME NOT NULL,
+                    FOREIGN KEY (user_id) REFERENCES users (id))''')
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS logs (
+                    id INTEGER PRIMARY KEY,
+                    message TEXT NOT NULL,
+                    level TEXT NOT NULL,
+                    timestamp DATETIME NOT NULL)''')
+
+
+# 2: databases created by the early userdb.py schema have no users.created_at
+def add_users_created_at(conn):
+    if 'created_at' not in _columns(conn, 'users'):
+        conn.execute("ALTER TABLE users ADD COLUMN created_at DATETIME")
+
+
+# 3: one preference row per (user_id, created_at), newest first.
+# The unique index covers the latest-preferences lookup
+# (WHERE user_id = ? ORDER BY created_at DESC LIMIT 1) and the sync existence
+# check (WHERE user_id = ? AND created_at = ?). Duplicates from earlier sync
+# cycles are removed first, keeping the most recently inserted copy.
+def index_trip_preferences(conn):
+    conn.execute('''DELETE FROM trip_preferences WHERE id NOT IN (
+                    SELECT MAX(id) FROM trip_preferences GROUP BY user_id, created_at)''')
+    conn.execute('''CREATE UNIQUE INDEX IF NOT EXISTS ux_trip_preferences_user_created
+                    ON trip_preferences (user_id, created_at DESC)''')
+
+
+# 4: activities dictionary and trip_activities join table, backfilled once from
+# the comma-joined trip_preferences.activities column
+def normalize_activities(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS activities (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT UNIQUE NOT NULL)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS trip_activities (
+                    trip_id INTEGER NOT NULL,
+                    activity_id INTEGER NOT NULL,
+                    position INTEGER NOT NULL,
+                    PRIMARY KEY (trip_id, activity_id),
+                    FOREIGN KEY (trip_id) REFERENCES trip_preferences (id),
+                    FOREIGN KEY (activity_id) REFERENCES activities (id)) WITHOUT ROWID''')
+    conn.execute('''CREATE INDEX IF NOT EXISTS ix_trip_activities_activity
+                    ON trip_activities (activity_id, trip_id)''')
+
+    links = []
+    for trip_id, activities_str in conn.execute("SELECT id, activities FROM trip_preferences"):
+        names = []
+        for name in (activities_str or '').split(","):
+            name = name.strip()
+            if name and name not in names:
+                names.append(name)
+        links.extend((trip_id, name, position) for position, name in enumerate(names))
+    conn.executemany("INSERT OR IGNORE INTO activities (name) VALUES (?)", {(name,) for _, name, _ in links})
+    conn.executemany('''INSERT OR IGNORE INTO trip_activities (trip_id, activity_id, position)
+                        SELECT ?, id, ? FROM activities WHERE name = ?''',
+                     [(trip_id, position, name) for trip_id, name, position in links])
+
+
+# 5: keyed phone fingerprint next to the salted phone hash (see phone_fingerprint.py).
+# Existing rows are filled by the backfill tool, which needs the key. NULLs don't
+# collide under the unique index.
+def add_phone_fingerprint(conn):
+    if 'phone_fingerprint' not in _columns(conn, 'users'):
+        conn.execute("ALTER TABLE users ADD COLUMN phone_fingerprint TEXT")
+    conn.execute('''CREATE UNIQUE INDEX IF NOT EXISTS ux_users_phone_fingerprint
+                    ON users (phone_fingerprint)''')
+
+
+# 6: outbox of Firestore writes waiting to be delivered (see outbox.py)
+def create_outbox(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY,
+                    collection TEXT NOT NULL,
+                    doc_id TEXT NOT NULL,
+                    op TEXT NOT NULL,
+                    data TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL DEFAULT 0,
+                    last_error TEXT,
+                    created_at REAL NOT NULL)''')
+
+
+# 7: tables the sync engine and itinerary caches used to create in their constructors,
+# so starting a process runs no DDL once the schema is current
+def create_state_tables(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS sync_state (
+                    name TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    updated_at DATETIME NOT NULL)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS itineraries (
+                    id INTEGER PRIMARY KEY,
+                    user_id INTEGER NOT NULL,
+                    trip_id INTEGER NOT NULL,
+                    itinerary TEXT NOT NULL,
+                    etag TEXT NOT NULL,
+                    created_at DATETIME NOT NULL,
+                    UNIQUE (user_id, trip_id))''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS itinerary_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    itinerary TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    expires_at REAL NOT NULL)''')
+
+
+# 8: durable queue of itinerary generation jobs (see job_queue.py). At most one queued
+# or running job per dedupe_key, enforced by the partial unique index.
+def create_itinerary_jobs(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS itinerary_jobs (
+                    id TEXT PRIMARY KEY,
+                    user_id INTEGER NOT NULL,
+                    dedupe_key TEXT,
+                    priority INTEGER NOT NULL DEFAULT 0,
+                    status TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    available_at REAL NOT NULL,
+                    lease_until REAL,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL)''')
+    conn.execute('''CREATE INDEX IF NOT EXISTS ix_itinerary_jobs_queue
+                    ON itinerary_jobs (status, priority DESC, created_at)''')
+    conn.execute('''CREATE INDEX IF NOT EXISTS ix_itinerary_jobs_user
+                    ON itinerary_jobs (user_id, status)''')
+    conn.execute('''CREATE UNIQUE INDEX IF NOT EXISTS ux_itinerary_jobs_dedupe
+                    ON itinerary_jobs (dedupe_key) WHERE status IN ('queued', 'running')''')
+
+
+# 9: outbox rows that ran out of attempts are kept as dead letters, dead_at set
+def add_outbox_dead_at(conn):
+    if 'dead_at' not in _columns(conn, 'outbox'):
+        conn.execute("ALTER TABLE outbox ADD COLUMN dead_at REAL")
+
+
+MIGRATIONS = (
+    (1, 'create base tables', create_base_tables),
+    (2, 'add users.created_at', add_users_created_at),
+    (3, 'unique (user_id, created_at DESC) index on trip_preferences', index_trip_preferences),
+    (4, 'activities dictionary and trip_activities join table', normalize_activities),
+    (5, 'users.phone_fingerprint with unique index', add_phone_fingerprint),
+    (6, 'outbox table', create_outbox),
+    (7, 'sync_state, itineraries and itinerary_cache tables', create_state_tables),
+    (8, 'itinerary_jobs queue', create_itinerary_jobs),
+    (9, 'outbox.dead_at for dead letters', add_outbox_dead_at),
+)
+
+
+def current_version(pool):
+    row = pool.read("SELECT MAX(version) FROM schema_migrations", one=True)
+    return row[0] or 0
+
+
+# Read-only check, lets a starting process skip the write transaction of migrate()
+def is_current(pool, migrations=MIGRATIONS):
+    try:
+        return current_version(pool) >= max(version for version, _, _ in migrations)
+    except sqlite3.OperationalError:  # no schema_migrations table yet
+        return False
+
+
+# Apply every pending migration, returns the versions applied by this call
+def migrate(pool, migrations=MIGRATIONS):
+    pool.write('''CREATE TABLE IF NOT EXISTS schema_migrations (
+                  version INTEGER PRIMARY KEY,
+                  name TEXT NOT NULL,
+                  applied_at DATETIME NOT NULL)''')
+    applied = []
+    for version, name, migration in migrations:
+        if version <= current_version(pool):
+            continue
+        with pool.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Another process may have applied it while we waited for the lock
+                if conn.execute("SELECT 1 FROM schema_migrations WHERE version = ?", (version,)).fetchone():
+                    conn.rollback()
+                    continue
+                migration(conn)
+                conn.execute("INSERT INTO schema_migrations (version, name, applied_at) VALUES (?, ?, ?)",
+                             (version, name, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        applied.append(version)
+        logger.info(f"Applied migration {version}: {name}")
+    return applied
+
+
+# Deploy step, migrates once per deployment so servers can start with RUN_MIGRATIONS=0
+#   python migrations.py [--database user.db]
+def main():
+    import db_pool
+
+    parser = argparse.ArgumentParser(description="Apply pending user.db migrations")
+    parser.add_argument('--database', default=db_pool.DATABASE_PATH)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    pool = db_pool.ConnectionPool(args.database)
+    applied = migrate(pool)
+    print(f"schema at version {current_version(pool)}, applied {applied or 'none'}")
+    pool.close_all()
+
+
+if __name__ == '__main__':
+    main()
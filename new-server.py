@@ -1,98 +1,167 @@
+import time
+# Wall time of importing this module, part of the startup report (see startup.py)
+_import_started = time.perf_counter()
 import os
-import google.generativeai as genai
 import logging
 import re
-import json
-import traceback
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
-from flask_bcrypt import Bcrypt
 import sqlite3
-from datetime import datetime
-import firebase_admin
-from firebase_admin import credentials, firestore, auth
+import db_pool
+import migrations
+from log_pipeline import LogPipeline, log_record
+from outbox import Outbox
+from signup_pipeline import SignupPipeline, SignupRejected
+from llm_client import LLMClient
+from itinerary_stream import IncrementalItineraryParser, format_event
+from single_flight import SingleFlight, AsyncSingleFlight
+from itinerary_store import ItineraryStore
+from preference_cache import PreferenceCache
+from activities import (ACTIVITY_LIST_SQL, encode_activities, decode_activities, normalize_activities,
+                        row_activities, save_trip_activities, link_trip_activities, find_trips_with_activity)
+from itinerary_cache import ItineraryCache, itinerary_cache_key, redate_itinerary
+from hashing import hashing_pool, needs_hash, credential_scheme, HashingBusy
+from phone_fingerprint import PhoneFingerprinter, FINGERPRINT_KEY_ENV
+from sync_engine import SyncEngine, TableSync, UPDATED_AT_FIELD
+from sync_scheduler import SyncScheduler, SWEEP
+from job_queue import JobQueue, JobLimitExceeded, FINISHED
+from itinerary_warmup import ItineraryWarmup, parse_hours
+from health import CircuitBreaker, CircuitOpen, HealthMonitor
+import startup
+from startup import Lazy, LazyModule
+from datetime import datetime, timezone
 import random
-import schedule
-import time
+import atexit
 import threading
+from concurrent.futures import ThreadPoolExecutor
 
 app = Flask(__name__)
-bcrypt = Bcrypt(app)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 # Enable CORS for specific origin (React app) and allow credentials
-CORS(app, resources={r"/*": {
+CORS_OPTIONS = {
     "origins": "http://localhost:3000",
     "supports_credentials": True,
     "methods": ["GET", "POST", "OPTIONS"],
     "allow_headers": ["Content-Type", "Authorization"]
-}})
-
-# Initialize Firebase Admin SDK
-cred = credentials.Certificate(os.getenv('FIREBASE_CREDENTIALS_PATH', r"D:\PRATHMESH NIKAM\Downloads\VS\trip-planner\database\serviceAccountKey.json"))
-firebase_admin.initialize_app(cred)
-db = firestore.client()
+}
+CORS(app, resources={r"/*": CORS_OPTIONS})
+
+# Firebase Admin SDK and Gemini clients are built on first use, once per process (see
+# startup.py). Importing this module does no network or disk I/O, and a worker forked
+# from a preloaded parent builds its own gRPC channels and HTTP sessions.
+FIREBASE_CREDENTIALS_PATH = os.getenv('FIREBASE_CREDENTIALS_PATH', r"D:\PRATHMESH NIKAM\Downloads\VS\trip-planner\database\serviceAccountKey.json")
+
+def init_firebase_app():
+    import firebase_admin
+    from firebase_admin import credentials
+    # An app inherited over fork carries the parent's sessions, replace it
+    try:
+        firebase_admin.delete_app(firebase_admin.get_app())
+    except ValueError:
+        pass
+    return firebase_admin.initialize_app(credentials.Certificate(FIREBASE_CREDENTIALS_PATH))
+
+def init_firestore():
+    from google.cloud import firestore as cloud_firestore
+    firebase = firebase_app.get()
+    # Not firestore.client(), which caches one client per app and would hand a forked worker the parent's channel
+    return cloud_firestore.Client(credentials=firebase.credential.get_credential(), project=firebase.project_id)
+
+# Async client for the ASGI routes (see asgi.py), its channel belongs to the event loop that first uses it
+def init_firestore_async():
+    from google.cloud import firestore as cloud_firestore
+    firebase = firebase_app.get()
+    return cloud_firestore.AsyncClient(credentials=firebase.credential.get_credential(), project=firebase.project_id)
+
+firebase_app = Lazy('firebase_app', init_firebase_app)
+db = Lazy('firestore', init_firestore)
+db_async = Lazy('firestore_async', init_firestore_async)
+firestore = LazyModule('firebase_admin.firestore')
+# Module only (exception classes, ActionCodeSettings), calls go through firebase_auth_call
+auth = LazyModule('firebase_admin.auth')
+
+# Call a Firebase Authentication function, initializing the Firebase app first
+def firebase_auth_call(name, *args, **kwargs):
+    firebase_app.get()
+    return getattr(auth, name)(*args, **kwargs)
+
+# Circuit breakers per remote dependency, fed by the outcomes of real calls and probed
+# in the background while open. Handlers read their state without any I/O (see health.py).
+firestore_breaker = CircuitBreaker('firestore', probe=lambda: db.collection('users').select([]).limit(1).get())
+firebase_auth_breaker = CircuitBreaker('firebase_auth', probe=lambda: firebase_auth_call('list_users', max_results=1),
+                                       ignore=lambda e: isinstance(e, (auth.EmailAlreadyExistsError, auth.UserNotFoundError)))
+gemini_breaker = CircuitBreaker('gemini', failure_threshold=3)
+health = HealthMonitor([firestore_breaker, firebase_auth_breaker, gemini_breaker])
 
 # Initialize Gemini client
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
-if not GEMINI_API_KEY:
-    raise ValueError("GEMINI_API_KEY environment variable is not set")
-genai.configure(api_key=GEMINI_API_KEY)
-model = genai.GenerativeModel('gemini-2.0-flash')
+
+def init_gemini_model():
+    if not GEMINI_API_KEY:
+        raise ValueError("GEMINI_API_KEY environment variable is not set")
+    import google.generativeai as genai
+    genai.configure(api_key=GEMINI_API_KEY)
+    return genai.GenerativeModel('gemini-2.0-flash')
+
+model = Lazy('gemini', init_gemini_model)
+
+# Gemini calls run off the request thread with a concurrency cap, a deadline,
+# retries and hedged requests (see llm_client.py). On timeout or failure the
+# routes fall back to generate_dynamic_itinerary. Calls from the ASGI routes wait on
+# their own, larger set of slots without holding a thread.
+gemini = LLMClient(model,
+                   max_concurrency=int(os.getenv('GEMINI_MAX_CONCURRENCY', 4)),
+                   timeout=float(os.getenv('GEMINI_TIMEOUT', 30)),
+                   breaker=gemini_breaker,
+                   async_max_concurrency=int(os.getenv('GEMINI_ASYNC_MAX_CONCURRENCY', 64)))
+
+# Itineraries keyed on normalized preferences, memory LRU backed by user.db (see itinerary_cache.py)
+itinerary_cache = ItineraryCache(max_entries=int(os.getenv('ITINERARY_CACHE_SIZE', 1024)),
+                                 ttl=int(os.getenv('ITINERARY_CACHE_TTL', 24 * 3600)),
+                                 pool=db_pool.pool)
+
+# Generated itineraries per user and trip, served from memory with ETags (see itinerary_store.py)
+itinerary_store = ItineraryStore(db_pool.pool, max_entries=int(os.getenv('ITINERARY_STORE_SIZE', 512)))
+
+# Concurrent generations for the same cache key share one Gemini call (see single_flight.py).
+# Followers that time out, or whose leader fails, fall back to generate_dynamic_itinerary.
+itinerary_flights = SingleFlight(wait_timeout=float(os.getenv('ITINERARY_COALESCE_TIMEOUT', gemini.timeout + 5)))
+itinerary_async_flights = AsyncSingleFlight(wait_timeout=itinerary_flights.wait_timeout)
+
+# bcrypt runs in hashing_pool's worker processes (see hashing.py). Request handlers
+# wait at most HASHING_TIMEOUT for a free slot before answering 503. The stored phone
+# hash is never verified, only kept salted, so it uses a lower cost factor.
+HASHING_TIMEOUT = float(os.getenv('HASHING_TIMEOUT', 5))
+PHONE_HASH_ROUNDS = int(os.getenv('PHONE_HASH_ROUNDS', 8))
+atexit.register(hashing_pool.shutdown)
+
+# Keyed HMAC of the normalized phone, stored next to the salted hash for uniqueness checks (see phone_fingerprint.py).
+# A missing PHONE_FINGERPRINT_KEY fails the first signup or phone check, not the import.
+phone_fingerprint = Lazy('phone_fingerprint', lambda: PhoneFingerprinter(os.getenv(FINGERPRINT_KEY_ENV)))
 
 # LOCAL DATABASE I.E USER.DB FILE KA INSTERACTION START
 # Initialize local database, this for storing the data locally 
 def init_db():
-    with sqlite3.connect('user.db') as conn:
-        conn.execute('''CREATE TABLE IF NOT EXISTS users (
-                        id INTEGER PRIMARY KEY,
-                        username TEXT UNIQUE NOT NULL,
-                        email TEXT UNIQUE NOT NULL,
-                        phone TEXT UNIQUE NOT NULL,
-                        password TEXT NOT NULL,
-                        created_at DATETIME NOT NULL)''')
-        
-        # Add trip_preferences table
-        conn.execute('''CREATE TABLE IF NOT EXISTS trip_preferences (
-                        id INTEGER PRIMARY KEY,
-                        user_id INTEGER NOT NULL,
-                        destination TEXT NOT NULL,
-                        start_date TEXT NOT NULL,
-                        end_date TEXT NOT NULL,
-                        budget TEXT NOT NULL,
-                        activities TEXT NOT NULL,
-                        group_size TEXT NOT NULL,
-                        created_at DATETIME NOT NULL,
-                        FOREIGN KEY (user_id) REFERENCES users (id))''')
-        
-        # Add logs table
-        conn.execute('''CREATE TABLE IF NOT EXISTS logs (
-                        id INTEGER PRIMARY KEY,
-                        message TEXT NOT NULL,
-                        level TEXT NOT NULL,
-                        timestamp DATETIME NOT NULL)''')
-    logger.info("Database initialized.")
-
-# Call init_db when the app starts
-init_db()
+    # Tables and indexes are created by the versioned migrations in migrations.py,
+    # a schema that is already current costs one read
+    if migrations.is_current(db_pool.pool):
+        return
+    applied = migrations.migrate(db_pool.pool)
+    logger.info(f"Database initialized, applied migrations: {applied or 'none'}.")
 
 # Helper function to interact with local database
-def query_db(query, args=(), one=False):
-    with sqlite3.connect('user.db') as conn:
-        cur = conn.cursor()
-        cur.execute(query, args)
-        conn.commit()
-        rv = cur.fetchall()
-        return (rv[0] if rv else None) if one else rv
+# Connections are pooled and reused, SELECTs skip the commit (see db_pool.py)
+query_db = db_pool.query_db
 
 # Function to insert user data into the local database
-def insert_user_local(username, email, phone, password, created_at):
+def insert_user_local(username, email, phone, password, created_at, fingerprint=None):
     try:
-        query_db("INSERT INTO users (username, email, phone, password, created_at) VALUES (?, ?, ?, ?, ?)",
-                 (username, email, phone, password, created_at))
+        query_db("INSERT INTO users (username, email, phone, password, created_at, phone_fingerprint) VALUES (?, ?, ?, ?, ?, ?)",
+                 (username, email, phone, password, created_at, fingerprint))
         logger.info(f"User {username} registered successfully in local DB!")
         return True
     except sqlite3.IntegrityError as e:
@@ -102,10 +171,21 @@ def insert_user_local(username, email, phone, password, created_at):
         logger.error(f"General Error: {e}")
         return False
 
+# Function to bring a credential from Firestore into the local DB without rehashing bcrypt hashes
+def import_credential(value, scheme=None):
+    if needs_hash(value, scheme):
+        return hashing_pool.hash(value)
+    return value
+
 # Function to check if user exists in local database
-def check_user_exists_local(email, phone):
+# The phone is matched by its fingerprint, and by value for old rows that still hold a raw phone
+def check_user_exists_local(email, phone, fingerprint=None):
     try:
-        user = query_db("SELECT * FROM users WHERE email = ? OR phone = ?", (email, phone), one=True)
+        # Index lookups instead of an OR, which SQLite may answer with a table scan
+        user = query_db("""SELECT 1 FROM users WHERE email = ?
+                           UNION ALL SELECT 1 FROM users WHERE phone_fingerprint = ?
+                           UNION ALL SELECT 1 FROM users WHERE phone = ? LIMIT 1""",
+                        (email, fingerprint or phone_fingerprint(phone), phone), one=True)
         return user is not None
     except Exception as e:
         logger.error(f"Error checking user existence in local DB: {e}")
@@ -115,30 +195,43 @@ def check_user_exists_local(email, phone):
 
 # FIREBASE INTERACTION START, INITIAL STAGE START
 
-# Function to insert user data into Firebase Firestore
-def insert_user_firebase(username, email, phone, password, created_at):
-    try:
-        user_ref = db.collection('users').document(email)
-        user_ref.set({
-            'username': username,
-            'email': email,
-            'phone': phone,
-            'password': password,
-            'created_at': created_at
-        })
-        logger.info(f"User {username} registered successfully in Firebase Firestore!")
-        return True
-    except Exception as e:
-        logger.error(f"Error registering user in Firebase Firestore: {e}")
-        return False
+# Firestore document of a user, keyed by email
+def user_document(username, email, phone, password, created_at, fingerprint=None):
+    return {
+        'username': username,
+        'email': email,
+        'phone': phone,
+        'password': password,
+        'password_scheme': credential_scheme(password),
+        'phone_scheme': credential_scheme(phone),
+        'phone_fingerprint': fingerprint,
+        'created_at': created_at
+    }
+
+# Function to create the Firebase Authentication account, returns its uid
+def create_user_firebase_auth(username, email, password):
+    user_record = firebase_auth_breaker.call(
+        firebase_auth_call, 'create_user',
+        email=email,
+        password=password,
+        display_name=username
+    )
+    logger.info(f"User {username} registered successfully in Firebase Authentication!")
+    return user_record.uid
+
+# Function to remove a Firebase Authentication account again after a failed signup
+def delete_user_firebase_auth(uid):
+    firebase_auth_call('delete_user', uid)
 
 # Function to check if user exists in Firebase Authentication
 def check_user_exists_firebase_auth(email):
     try:
-        user_record = auth.get_user_by_email(email)
+        user_record = firebase_auth_breaker.call(firebase_auth_call, 'get_user_by_email', email)
         return user_record is not None
     except auth.UserNotFoundError:
         return False
+    except CircuitOpen:
+        return False
     except Exception as e:
         logger.error(f"Error checking user existence in Firebase Authentication: {e}")
         return False
@@ -150,7 +243,7 @@ def check_user_exists_firebase(email, phone):
         for doc in users_ref:
             return True
         
-        users_ref = db.collection('users').where('phone', '==', phone).stream()
+        users_ref = db.collection('users').where('phone_fingerprint', '==', phone_fingerprint(phone)).stream()
         for doc in users_ref:
             return True
         
@@ -161,62 +254,89 @@ def check_user_exists_firebase(email, phone):
 
 # FIREBASE INTERACTION START, INITIAL STAGE END
 
+# created_at of a new trip, with microseconds so every save is its own trip: (user_id, created_at)
+# identifies the row locally and the document in Firebase Firestore
+def trip_created_at():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')
+
+# New preferences are mirrored to Firebase Firestore through the outbox
 def save_trip_preferences_local(user_id, destination, start_date, end_date, budget, activities, group_size):
+    created_at = trip_created_at()
+    return insert_trip_preferences_local(user_id, destination, start_date, end_date, budget, activities, group_size,
+                                         created_at, mirror=True)
+
+# Function to insert trip preferences into the local database with a given created_at,
+# synced rows keep the timestamp they were created with so they are recognised next cycle.
+# Returns the new row id, which doubles as the trip id for itinerary storage, or False.
+# With mirror the Firestore document is queued in the outbox in the same transaction.
+def insert_trip_preferences_local(user_id, destination, start_date, end_date, budget, activities, group_size, created_at,
+                                  mirror=False):
     try:
-        # Convert activities list to a comma-separated string
-        activities_str = ",".join(activities)
-        created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        
-        query_db("""
-            INSERT INTO trip_preferences 
-            (user_id, destination, start_date, end_date, budget, activities, group_size, created_at) 
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """, 
-            (user_id, destination, start_date, end_date, budget, activities_str, group_size, created_at))
-        
-        logger.info(f"Trip preferences for user {user_id} saved successfully in local DB!")
-        return True
+        with db_pool.pool.transaction() as conn:
+            trip_id = insert_trip_preferences(conn, user_id, destination, start_date, end_date, budget, activities,
+                                              group_size, created_at, mirror)
+        trip_preferences_saved(user_id, mirror)
+        return trip_id
     except Exception as e:
         logger.error(f"Error saving trip preferences in local DB: {e}")
         return False
 
-# Function to save trip preferences to Firebase Firestore
-def save_trip_preferences_firebase(user_id, destination, start_date, end_date, budget, activities, group_size):
-    try:
-        # Convert activities list to a comma-separated string
-        activities_str = ",".join(activities)
-        created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        
-        trip_prefs_ref = db.collection('trip_preferences').document(f'{user_id}_{created_at}')
-        trip_prefs_ref.set({
-            'user_id': user_id,
-            'destination': destination,
-            'start_date': start_date,
-            'end_date': end_date,
-            'budget': budget,
-            'activities': activities_str,
-            'group_size': group_size,
-            'created_at': created_at
-        })
-        
-        logger.info(f"Trip preferences for user {user_id} saved successfully in Firebase Firestore!")
-        return True
-    except Exception as e:
-        logger.error(f"Error saving trip preferences in Firebase Firestore: {e}")
-        return False
+# The insert itself, inside the caller's transaction. Call trip_preferences_saved() after the commit.
+def insert_trip_preferences(conn, user_id, destination, start_date, end_date, budget, activities, group_size, created_at,
+                            mirror=False):
+    # The comma-joined column is kept for older entry points, trip_activities is the source of truth
+    activities_str = encode_activities(activities)
+
+    # (user_id, created_at) is unique, a clash fails the save rather than merging two trips
+    trip_id = conn.execute("""
+    INSERT INTO trip_preferences
+    (user_id, destination, start_date, end_date, budget, activities, group_size, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    RETURNING id
+    """,
+    (user_id, destination, start_date, end_date, budget, activities_str, group_size, created_at)).fetchall()[0][0]
+    save_trip_activities(conn, trip_id, activities)
+    if mirror:
+        outbox.enqueue(conn, 'trip_preferences', f'{user_id}_{created_at}', trip_preference_document(
+            user_id, destination, start_date, end_date, budget, activities, group_size, created_at))
+    return trip_id
+
+# Wake the outbox for the Firestore mirror and drop the cached preferences of a committed save
+def trip_preferences_saved(user_id, mirror=False):
+    if mirror:
+        outbox.notify()
+        sync_scheduler.notify('push:trip_preferences')
+
+    preference_cache.invalidate(user_id)
+    logger.info(f"Trip preferences for user {user_id} saved successfully in local DB!")
+
+# Firestore document of a trip preference, keyed by f'{user_id}_{created_at}'
+def trip_preference_document(user_id, destination, start_date, end_date, budget, activities, group_size, created_at):
+    return {
+        'user_id': user_id,
+        'destination': destination,
+        'start_date': start_date,
+        'end_date': end_date,
+        'budget': budget,
+        'activities': encode_activities(activities),
+        'activity_list': normalize_activities(activities),
+        'group_size': group_size,
+        'created_at': created_at
+    }
 
 # Function to get trip preferences for a user from local database
 def get_trip_preferences_local(user_id):
     try:
-        result = query_db("SELECT * FROM trip_preferences WHERE user_id = ? ORDER BY created_at DESC LIMIT 1", 
+        result = query_db(f"""SELECT id, user_id, destination, start_date, end_date, budget, activities,
+                               {ACTIVITY_LIST_SQL}, group_size, created_at
+                               FROM trip_preferences WHERE user_id = ? ORDER BY created_at DESC LIMIT 1""", 
                         (user_id,), one=True)
         
         if result:
             # Unpack the result
-            id, user_id, destination, start_date, end_date, budget, activities_str, group_size, created_at = result
+            id, user_id, destination, start_date, end_date, budget, activities_str, activity_list, group_size, created_at = result
             
-            # Convert activities string back to list
-            activities = activities_str.split(",")
+            activities = row_activities(activity_list, activities_str)
             
             return {
                 "user_id": user_id,
@@ -232,65 +352,51 @@ def get_trip_preferences_local(user_id):
         logger.error(f"Error getting trip preferences from local DB: {e}")
         return None
 
+# Trip preferences as the routes return them, from a Firestore trip_preferences document
+def preferences_from_document(data):
+    # Documents written before activity_list existed only carry the comma-joined string
+    activities = data.get('activity_list') or decode_activities(data['activities'])
+
+    return {
+        "user_id": data['user_id'],
+        "destination": data['destination'],
+        "start_date": data['start_date'],
+        "end_date": data['end_date'],
+        "budget": data['budget'],
+        "activities": activities,
+        "group_size": data['group_size']
+    }
+
 # Function to get trip preferences for a user from Firebase Firestore
 def get_trip_preferences_firebase(user_id):
     try:
-        trip_prefs_ref = db.collection('trip_preferences').where('user_id', '==', user_id).order_by('created_at', direction=firestore.Query.DESCENDING).limit(1).stream()
+        query = db.collection('trip_preferences').where('user_id', '==', user_id).order_by('created_at', direction=firestore.Query.DESCENDING).limit(1)
+        trip_prefs_ref = firestore_breaker.call(lambda: list(query.stream()))
         
         for doc in trip_prefs_ref:
-            data = doc.to_dict()
-            # Convert activities string back to list
-            activities = data['activities'].split(",")
-            
-            return {
-                "user_id": data['user_id'],
-                "destination": data['destination'],
-                "start_date": data['start_date'],
-                "end_date": data['end_date'],
-                "budget": data['budget'],
-                "activities": activities,
-                "group_size": data['group_size']
-            }
+            return preferences_from_document(doc.to_dict())
+        return None
+    except CircuitOpen:
         return None
     except Exception as e:
         logger.error(f"Error getting trip preferences from Firebase Firestore: {e}")
         return None
 
-# Function to check internet connectivity
-def is_connected():
-    import requests
-    try:
-        requests.get('https://www.google.com', timeout=5)
-        return True
-    except requests.ConnectionError:
-        return False
+# Stamp of a user's local trip preferences, the newest row id, None when there are none.
+# One lookup on the (user_id, created_at) index.
+def trip_preferences_version(user_id):
+    return query_db("SELECT MAX(id) FROM trip_preferences WHERE user_id = ?", (user_id,), one=True)[0]
 
-# Function to sync users from local to Firebase Firestore
-def sync_users_to_firebase_firestore():
-    users = query_db("SELECT * FROM users")
-    for user in users:
-        user_id, username, email, phone, password, created_at = user
-        if not check_user_exists_firebase(email, phone):
-            if insert_user_firebase(username, email, phone, password, created_at):
-                logger.info(f"User {username} synced to Firebase Firestore!")
-            else:
-                logger.error(f"Failed to sync user {username} to Firebase Firestore")
-        else:
-            logger.info(f"User {username} already exists in Firebase Firestore.")
+# Latest trip preferences per user, read through memory -> local DB -> Firebase Firestore
+# and invalidated by every save. Memory hits are checked against trip_preferences_version,
+# so a save by another worker process is seen on the next read (see preference_cache.py)
+preference_cache = PreferenceCache(get_trip_preferences_local, get_trip_preferences_firebase,
+                                   version=trip_preferences_version,
+                                   ttl=int(os.getenv('PREFERENCE_CACHE_TTL', 300)))
 
-# Function to sync trip preferences from local to Firebase Firestore
-def sync_trip_preferences_to_firebase_firestore():
-    trip_prefs = query_db("SELECT * FROM trip_preferences")
-    for pref in trip_prefs:
-        id, user_id, destination, start_date, end_date, budget, activities_str, group_size, created_at = pref
-        activities = activities_str.split(",")
-        if not check_trip_preference_exists_firebase(user_id, created_at):
-            if save_trip_preferences_firebase(user_id, destination, start_date, end_date, budget, activities, group_size):
-                logger.info(f"Trip preferences for user {user_id} synced to Firebase Firestore!")
-            else:
-                logger.error(f"Failed to sync trip preferences for user {user_id} to Firebase Firestore")
-        else:
-            logger.info(f"Trip preferences for user {user_id} already exist in Firebase Firestore.")
+# Function to check connectivity, answered from the Firestore circuit breaker without any I/O
+def is_connected():
+    return firestore_breaker.available()
 
 # Function to check if trip preferences exist in Firebase Firestore
 def check_trip_preference_exists_firebase(user_id, created_at):
@@ -303,35 +409,6 @@ def check_trip_preference_exists_firebase(user_id, created_at):
         logger.error(f"Error checking trip preference existence in Firebase Firestore: {e}")
         return False
 
-# Function to sync users from Firebase Firestore to local
-def sync_users_from_firebase_firestore():
-    users_ref = db.collection('users').stream()
-    for doc in users_ref:
-        data = doc.to_dict()
-        if not check_user_exists_local(data['email'], data['phone']):
-            hashed_pw = bcrypt.generate_password_hash(data['password']).decode('utf-8')
-            hashed_phone = bcrypt.generate_password_hash(data['phone'].encode('utf-8')).decode('utf-8')
-            if insert_user_local(data['username'], data['email'], hashed_phone, hashed_pw, data['created_at']):
-                logger.info(f"User {data['username']} synced from Firebase Firestore to local DB!")
-            else:
-                logger.error(f"Failed to sync user {data['username']} from Firebase Firestore to local DB")
-        else:
-            logger.info(f"User {data['username']} already exists in local DB.")
-
-# Function to sync trip preferences from Firebase Firestore to local
-def sync_trip_preferences_from_firebase_firestore():
-    trip_prefs_ref = db.collection('trip_preferences').stream()
-    for doc in trip_prefs_ref:
-        data = doc.to_dict()
-        activities = data['activities'].split(",")
-        if not check_trip_preference_exists_local(data['user_id'], data['created_at']):
-            if save_trip_preferences_local(data['user_id'], data['destination'], data['start_date'], data['end_date'], data['budget'], activities, data['group_size']):
-                logger.info(f"Trip preferences for user {data['user_id']} synced from Firebase Firestore to local DB!")
-            else:
-                logger.error(f"Failed to sync trip preferences for user {data['user_id']} from Firebase Firestore to local DB")
-        else:
-            logger.info(f"Trip preferences for user {data['user_id']} already exist in local DB.")
-
 # Function to check if trip preferences exist in local database
 def check_trip_preference_exists_local(user_id, created_at):
     try:
@@ -341,28 +418,180 @@ def check_trip_preference_exists_local(user_id, created_at):
         logger.error(f"Error checking trip preference existence in local DB: {e}")
         return False
 
+# Row/document mappings for the change-tracking sync engine (see sync_engine.py)
+def user_to_document(row):
+    user_id, username, email, phone, password, created_at, fingerprint = row
+    return email, user_document(username, email, phone, password, created_at, fingerprint or phone_fingerprint(phone))
+
+def user_from_document(doc_id, data):
+    fingerprint = data.get('phone_fingerprint') or phone_fingerprint(data['phone'])
+    if check_user_exists_local(data['email'], data['phone'], fingerprint):
+        logger.info(f"User {data['username']} already exists in local DB.")
+        return True
+    # Values that are already hashed are copied verbatim, raw ones are hashed off-thread
+    hashed_pw = import_credential(data['password'], data.get('password_scheme'))
+    hashed_phone = import_credential(data['phone'], data.get('phone_scheme'))
+    if insert_user_local(data['username'], data['email'], hashed_phone, hashed_pw, data['created_at'], fingerprint):
+        logger.info(f"User {data['username']} synced from Firebase Firestore to local DB!")
+        return True
+    return False
+
+def trip_preference_to_document(row):
+    id, user_id, destination, start_date, end_date, budget, activities_str, activity_list, group_size, created_at = row
+    return f'{user_id}_{created_at}', trip_preference_document(
+        user_id, destination, start_date, end_date, budget, row_activities(activity_list, activities_str), group_size,
+        created_at)
+
+def trip_preference_from_document(doc_id, data):
+    if check_trip_preference_exists_local(data['user_id'], data['created_at']):
+        return True
+    activities = data.get('activity_list') or decode_activities(data['activities'])
+    if insert_trip_preferences_local(data['user_id'], data['destination'], data['start_date'], data['end_date'],
+                                     data['budget'], activities, data['group_size'], data['created_at']):
+        logger.info(f"Trip preferences for user {data['user_id']} synced from Firebase Firestore to local DB!")
+        return True
+    return False
+
+# Bulk forms of the from_document mappings, used for full-collection pulls.
+# One lookup finds which documents of the page are already local, the rest go in with
+# a single INSERT OR IGNORE executemany.
+def users_store_page(docs):
+    emails = [data.get('email') for _, data in docs]
+    placeholders = ",".join("?" * len(emails))
+    existing = {email for email, in query_db(f"SELECT email FROM users WHERE email IN ({placeholders})", emails)}
+    rows = []
+    for doc_id, data in docs:
+        if data.get('email') in existing:
+            continue
+        try:
+            fingerprint = data.get('phone_fingerprint') or phone_fingerprint(data['phone'])
+            # Raw credentials are hashed in the pool concurrently, resolved below
+            phone = (hashing_pool.submit(data['phone']) if needs_hash(data['phone'], data.get('phone_scheme'))
+                     else data['phone'])
+            password = (hashing_pool.submit(data['password']) if needs_hash(data['password'], data.get('password_scheme'))
+                        else data['password'])
+            rows.append([data['username'], data['email'], phone, password, data['created_at'], fingerprint])
+        except KeyError as e:
+            logger.error(f"Skipped users/{doc_id}, missing field {e}")
+    if not rows:
+        return 0
+    for row in rows:
+        row[2:4] = [value if isinstance(value, str) else value.result() for value in row[2:4]]
+    return db_pool.pool.write_many("INSERT OR IGNORE INTO users (username, email, phone, password, created_at, phone_fingerprint) "
+                                   "VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+def trip_preferences_store_page(docs):
+    rows = {}
+    for doc_id, data in docs:
+        try:
+            user_id = int(data['user_id'])
+            rows[(user_id, data['created_at'])] = (
+                user_id, data['destination'], data['start_date'], data['end_date'], data['budget'],
+                data.get('activity_list') or decode_activities(data['activities']), data['group_size'], data['created_at'])
+        except (KeyError, TypeError, ValueError) as e:
+            logger.error(f"Skipped trip_preferences/{doc_id}, it could not be stored in local DB: {e}")
+    if not rows:
+        return 0
+
+    def keys_in(conn, keys):
+        values = ",".join(["(?, ?)"] * len(keys))
+        return conn.execute(f"SELECT id, user_id, created_at FROM trip_preferences WHERE (user_id, created_at) IN (VALUES {values})",
+                            [value for key in keys for value in key]).fetchall()
+
+    with db_pool.pool.transaction() as conn:
+        existing = {(user_id, created_at) for _, user_id, created_at in keys_in(conn, list(rows))}
+        new = [row for key, row in rows.items() if key not in existing]
+        if not new:
+            return 0
+        conn.executemany("""INSERT OR IGNORE INTO trip_preferences
+                            (user_id, destination, start_date, end_date, budget, activities, group_size, created_at)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                         [(user_id, destination, start_date, end_date, budget, encode_activities(activities), group_size, created_at)
+                          for user_id, destination, start_date, end_date, budget, activities, group_size, created_at in new])
+        activities_by_key = {(row[0], row[7]): row[5] for row in new}
+        link_trip_activities(conn, [(trip_id, activities_by_key[(user_id, created_at)])
+                                    for trip_id, user_id, created_at in keys_in(conn, list(activities_by_key))])
+    for user_id in {row[0] for row in new}:
+        preference_cache.invalidate(user_id)
+    return len(new)
+
+# Each cycle only moves rows and documents changed since the last successful sync.
+# Built on first use, SERVER_TIMESTAMP comes from the Firestore SDK.
+def init_sync_engine():
+    return SyncEngine(db, db_pool.pool, [
+        TableSync('users', 'users', "id, username, email, phone, password, created_at, phone_fingerprint",
+                  user_to_document, user_from_document, store_page=users_store_page),
+        TableSync('trip_preferences', 'trip_preferences',
+                  f"id, user_id, destination, start_date, end_date, budget, activities, {ACTIVITY_LIST_SQL}, group_size, created_at",
+                  trip_preference_to_document, trip_preference_from_document, store_page=trip_preferences_store_page),
+    ], server_timestamp=firestore.SERVER_TIMESTAMP, breaker=firestore_breaker,
+       pull_workers=int(os.getenv('SYNC_PULL_WORKERS', 4)))
+
+sync_engine = Lazy('sync_engine', init_sync_engine)
+
+# Function to sync users from local to Firebase Firestore
+def sync_users_to_firebase_firestore():
+    return sync_engine.push('users')
+
+# Function to sync trip preferences from local to Firebase Firestore
+def sync_trip_preferences_to_firebase_firestore():
+    return sync_engine.push('trip_preferences')
+
+# Function to sync users from Firebase Firestore to local
+def sync_users_from_firebase_firestore():
+    return sync_engine.pull('users')
+
+# Function to sync trip preferences from Firebase Firestore to local
+def sync_trip_preferences_from_firebase_firestore():
+    return sync_engine.pull('trip_preferences')
+
+# Audit logs are queued and written to the local DB and Firebase Firestore in batches
+# by a background thread, request handlers only pay for the enqueue (see log_pipeline.py)
+log_pipeline = LogPipeline(db_pool.pool, db, breaker=firestore_breaker)
+atexit.register(log_pipeline.shutdown)
+
 # Function to log messages to both local and Firebase Firestore
 def log_message(message, level):
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    
-    # Log to local database
-    try:
-        query_db("INSERT INTO logs (message, level, timestamp) VALUES (?, ?, ?)", (message, level, timestamp))
-        logger.info(f"Log '{message}' stored in local DB.")
-    except Exception as e:
-        logger.error(f"Error storing log in local DB: {e}")
-    
-    # Log to Firebase Firestore
+    log_pipeline.log(message, level)
+
+# Firestore writes of local changes are recorded in the outbox inside the local
+# transaction and delivered by a background dispatcher (see outbox.py). Built on first
+# use like the sync engine, create_app() starts the dispatcher.
+outbox = Lazy('outbox', lambda: Outbox(db_pool.pool, db, server_timestamp=firestore.SERVER_TIMESTAMP,
+                                       updated_at_field=UPDATED_AT_FIELD, breaker=firestore_breaker,
+                                       max_attempts=int(os.getenv('OUTBOX_MAX_ATTEMPTS', 20))))
+
+# Function to store a new user locally. The Firestore user document and the audit log
+# entry go into the outbox in the same transaction. Returns False if the email or phone is taken.
+def register_user_local(username, email, phone, hashed_pw, hashed_phone):
+    created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    fingerprint = phone_fingerprint(phone)
+    log_id, message, level, timestamp = log_record(f"User {username} registered successfully", "INFO")
     try:
-        log_ref = db.collection('logs').document(timestamp)
-        log_ref.set({
-            'message': message,
-            'level': level,
-            'timestamp': timestamp
-        })
-        logger.info(f"Log '{message}' stored in Firebase Firestore.")
-    except Exception as e:
-        logger.error(f"Error storing log in Firebase Firestore: {e}")
+        with db_pool.pool.transaction() as conn:
+            conn.execute("INSERT INTO users (username, email, phone, password, created_at, phone_fingerprint) VALUES (?, ?, ?, ?, ?, ?)",
+                         (username, email, hashed_phone, hashed_pw, created_at, fingerprint))
+            conn.execute("INSERT INTO logs (message, level, timestamp) VALUES (?, ?, ?)", (message, level, timestamp))
+            outbox.enqueue(conn, 'users', email, user_document(username, email, hashed_phone, hashed_pw, created_at, fingerprint))
+            outbox.enqueue(conn, 'logs', log_id, {'message': message, 'level': level, 'timestamp': timestamp})
+    except sqlite3.IntegrityError as e:
+        logger.error(f"Integrity Error: {e}")
+        return False
+    outbox.notify()
+    sync_scheduler.notify('push:users')
+    logger.info(f"User {username} registered successfully in local DB!")
+    return True
+
+# Existence checks, hashing and the Firebase Authentication call overlap (see signup_pipeline.py)
+signup_executor = ThreadPoolExecutor(max_workers=int(os.getenv('SIGNUP_WORKERS', 8)), thread_name_prefix='signup')
+signup_pipeline = SignupPipeline(signup_executor, hashing_pool,
+                                 check_local=check_user_exists_local,
+                                 check_remote=check_user_exists_firebase_auth,
+                                 create_remote=create_user_firebase_auth,
+                                 delete_remote=delete_user_firebase_auth,
+                                 store_local=register_user_local,
+                                 phone_rounds=PHONE_HASH_ROUNDS,
+                                 hashing_timeout=HASHING_TIMEOUT)
 
 # Function to perform full sync
 def full_sync():
@@ -376,52 +605,50 @@ def full_sync():
     else:
         logger.info("No internet connection. Skipping sync.")
 
-# Schedule the sync function to run every 5 minutes
-schedule.every(5).minutes.do(full_sync)
-
-# Background thread to run the scheduler
-def run_scheduler():
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
-
-# Start the scheduler in a separate thread
-scheduler_thread = threading.Thread(target=run_scheduler)
-scheduler_thread.daemon = True
-scheduler_thread.start()
+# Function to run the sync work a scheduler wake-up asked for. A sweep is the full sync,
+# other events name one direction and table ("push:users", "pull:trip_preferences").
+def run_sync(kinds):
+    if SWEEP in kinds:
+        full_sync()
+        return
+    if not is_connected():
+        logger.info("No internet connection. Skipping sync.")
+        return
+    # Pushes first, so a pull in the same run sees this process's rows as already synced
+    for kind in sorted(kinds, key=lambda kind: not kind.startswith('push:')):
+        direction, table = kind.split(':', 1)
+        if direction == 'push':
+            sync_engine.push(table)
+        else:
+            sync_engine.pull(table)
+
+# Firestore listener that wakes the scheduler when documents of a collection change.
+# Only documents stamped after the listener starts are watched, the sweep covers the rest.
+def firestore_listener(collection):
+    def subscribe(notify):
+        query = db.collection(collection).where(UPDATED_AT_FIELD, '>=', datetime.now(timezone.utc))
+        return query.on_snapshot(lambda docs, changes, read_time: changes and notify(f'pull:{collection}'))
+    return subscribe
+
+# Syncs run when local writes or Firestore listeners report changes, plus a periodic
+# safety sweep. The lock file keeps it to one scheduler per host, across all server
+# workers sharing user.db (see sync_scheduler.py).
+sync_scheduler = SyncScheduler(run_sync, lock_path=f'{db_pool.DATABASE_PATH}.sync.lock',
+                               listeners=[firestore_listener('users'), firestore_listener('trip_preferences')],
+                               debounce=float(os.getenv('SYNC_DEBOUNCE', 2)),
+                               sweep_interval=int(os.getenv('SYNC_SWEEP_INTERVAL', 300)),
+                               lock_retry=int(os.getenv('SYNC_LOCK_RETRY', 30)))
 
 # Function to parse the itinerary text into a structured format
 def parse_itinerary(itinerary_text):
-    lines = itinerary_text.strip().split('\n')
-    itinerary = []
-    current_day = None
-
-    for line in lines:
-        line = line.strip()
-        if line.startswith('Day'):
-            current_day = int(re.search(r'\d+', line).group())
-            itinerary.append({
-                "day": current_day,
-                "morning": "",
-                "afternoon": "",
-                "evening": ""
-            })
-        elif line.startswith('Morning:'):
-            itinerary[-1]["morning"] = line.replace('Morning:', '').strip()
-        elif line.startswith('Afternoon:'):
-            itinerary[-1]["afternoon"] = line.replace('Afternoon:', '').strip()
-        elif line.startswith('Evening:'):
-            itinerary[-1]["evening"] = line.replace('Evening:', '').strip()
-
-    return itinerary
-
-# Function to generate itinerary with Gemini API
-def generate_itinerary_with_gemini(destination, start_date, end_date, budget, activities, group_size):
-    if not GEMINI_API_KEY:
-        raise ValueError("GEMINI_API_KEY environment variable is not set")
-
-    # Prepare the prompt for the Gemini API
-    prompt = f"""
+    parser = IncrementalItineraryParser()
+    parser.feed(itinerary_text.strip())
+    parser.close()
+    return parser.days
+
+# Function to prepare the prompt for the Gemini API
+def build_itinerary_prompt(destination, start_date, end_date, budget, activities, group_size):
+    return f"""
     Generate a detailed travel itinerary for the following preferences:
     - Destination: {destination}
     - Start Date: {start_date}
@@ -449,31 +676,172 @@ def generate_itinerary_with_gemini(destination, start_date, end_date, budget, ac
     Continue this format for each day of the itinerary.
     """
 
-    try:
-        # Call the Gemini API
-        response = model.generate_content(prompt)
+# Function to call the Gemini API, parse the itinerary and store it in the itinerary cache
+def generate_and_cache_itinerary(cache_key, prompt):
+    # Call the Gemini API and extract the itinerary from the response
+    itinerary_text = gemini.generate(prompt)
 
-        # Extract the itinerary from the response
-        itinerary_text = response.text
+    # Parse the itinerary text into a structured format
+    itinerary = parse_itinerary(itinerary_text)
+    itinerary_cache.put(cache_key, itinerary)
+    return itinerary
 
-        # Parse the itinerary text into a structured format
-        itinerary = parse_itinerary(itinerary_text)
+# Function to generate itinerary with Gemini API
+def generate_itinerary_with_gemini(destination, start_date, end_date, budget, activities, group_size):
+    if not GEMINI_API_KEY:
+        raise ValueError("GEMINI_API_KEY environment variable is not set")
+
+    try:
+        # Requests that normalize to the same trip share one cached itinerary
+        cache_key = itinerary_cache_key(destination, start_date, end_date, budget, activities, group_size)
+        itinerary = itinerary_cache.get(cache_key)
+
+        if itinerary is None:
+            prompt = build_itinerary_prompt(destination, start_date, end_date, budget, activities, group_size)
+            if cache_key is None:
+                itinerary = generate_and_cache_itinerary(cache_key, prompt)
+            else:
+                # Identical requests already being generated wait for that call instead of starting their own
+                itinerary = itinerary_flights.do(cache_key, generate_and_cache_itinerary, cache_key, prompt)
+
+        # Cached entries are undated, stamp the days from this request's start date
+        itinerary = redate_itinerary(itinerary, start_date)
 
-        # Save the itinerary to itinerary.json in the public directory
-        public_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'client', 'public')
-        itinerary_path = os.path.join(public_dir, 'itinerary.json')
-        os.makedirs(public_dir, exist_ok=True)
-        with open(itinerary_path, 'w', encoding='utf-8') as f:
-            json.dump(itinerary, f, indent=4, ensure_ascii=False)
-        
-        logger.info(f"Itinerary successfully saved to {itinerary_path}")
-        
         return itinerary
 
     except Exception as err:
         logger.error(f"Error generating itinerary with Gemini API: {err}")
         raise
 
+# Function to generate an itinerary template for the warm-up, undated days straight from Gemini
+def generate_itinerary_template(destination, start_date, end_date, budget, activities, group_size):
+    prompt = build_itinerary_prompt(destination, start_date, end_date, budget, activities, group_size)
+    return parse_itinerary(gemini.generate(prompt))
+
+# Templates for the most requested trips, generated off-peak into the itinerary cache so
+# matching requests skip Gemini (see itinerary_warmup.py). Pauses while this process has
+# Gemini calls of its own in flight.
+itinerary_warmup = ItineraryWarmup(db_pool.pool, itinerary_cache, generate_itinerary_template,
+                                   lock_path=f'{db_pool.DATABASE_PATH}.warmup.lock',
+                                   top_n=int(os.getenv('WARMUP_TOP_N', 50)),
+                                   lookback_days=int(os.getenv('WARMUP_LOOKBACK_DAYS', 30)),
+                                   min_requests=int(os.getenv('WARMUP_MIN_REQUESTS', 3)),
+                                   rate_per_minute=float(os.getenv('WARMUP_RATE_PER_MINUTE', 6)),
+                                   template_ttl=int(os.getenv('WARMUP_TEMPLATE_TTL', 7 * 24 * 3600)),
+                                   hours=parse_hours(os.getenv('WARMUP_HOURS', '1-6')),
+                                   busy=lambda: gemini.metrics()['in_flight'] > 0,
+                                   enabled=bool(GEMINI_API_KEY) and os.getenv('ITINERARY_WARMUP', '1') == '1')
+
+# Function to store a generated itinerary for the user's trip, a failure here must not fail the request
+def store_itinerary(user_id, trip_id, itinerary_details):
+    try:
+        itinerary_store.save(user_id, trip_id, itinerary_details)
+        logger.info(f"Itinerary for user {user_id}, trip {trip_id} stored successfully")
+    except Exception as e:
+        logger.error(f"Error storing itinerary for user {user_id}, trip {trip_id}: {e}")
+
+# Function to generate the itinerary of a saved trip, falling back to the dynamic itinerary
+# when Gemini fails, and store it. Returns the response body of /generate-itinerary.
+def itinerary_for_trip(user_id, trip_id, destination, start_date, end_date, budget, activities, group_size):
+    try:
+        # Try to generate itinerary using Gemini API
+        itinerary = generate_itinerary_with_gemini(destination, start_date, end_date, budget, activities, group_size)
+
+        # Include additional details in the itinerary object
+        itinerary_details = {
+            "destination": destination,
+            "start_date": start_date,
+            "end_date": end_date,
+            "budget": budget,
+            "group_size": group_size,
+            "activities": activities,
+            "itinerary": itinerary,
+            "trip_id": trip_id
+        }
+
+        store_itinerary(user_id, trip_id, itinerary_details)
+        return itinerary_details
+
+    except Exception as e:
+        logger.error(f"Error generating itinerary with Gemini API: {e}")
+        # If Gemini API fails, generate a dynamic itinerary as a fallback
+        itinerary = generate_dynamic_itinerary(destination, start_date, end_date, budget, activities, group_size)
+        itinerary["trip_id"] = trip_id
+        store_itinerary(user_id, trip_id, itinerary)
+        return itinerary
+
+# Itinerary generation as queued jobs, run by worker threads in every server process
+# with priorities, per-user limits and dedupe (see job_queue.py)
+itinerary_jobs = JobQueue(db_pool.pool, lambda payload: itinerary_for_trip(**payload),
+                          workers=int(os.getenv('ITINERARY_JOB_WORKERS', 4)),
+                          per_user_limit=int(os.getenv('ITINERARY_JOB_USER_CONCURRENCY', 2)),
+                          max_queued_per_user=int(os.getenv('ITINERARY_JOB_USER_QUEUED', 10)),
+                          lease=max(120, gemini.timeout * 4))
+JOB_PRIORITY_RANGE = (0, 9)
+# Longest an SSE connection to /api/jobs/<id>/events stays open, clients reconnect after it
+JOB_EVENTS_TIMEOUT = int(os.getenv('ITINERARY_JOB_EVENTS_TIMEOUT', 300))
+
+# Job mode is asked for with ?mode=async or a "Prefer: respond-async" header
+def wants_itinerary_job(args, headers):
+    return args.get('mode') == 'async' or 'respond-async' in (headers.get('Prefer') or '')
+
+# Function to queue the itinerary of a validated /generate-itinerary body, returns (body, status).
+# The preferences and the job are written in one transaction, so a refused job (429) or
+# a trip the user already has queued or running (answered with that job) stores no trip.
+def submit_itinerary_job(user_id, destination, start_date, end_date, budget, activities, group_size, priority=None):
+    cache_key = itinerary_cache_key(destination, start_date, end_date, budget, activities, group_size)
+    dedupe_key = f"{user_id}:{cache_key}" if cache_key is not None else None
+    existing = itinerary_jobs.active(dedupe_key)
+    if existing is not None:
+        return job_accepted(existing, deduped=True)
+
+    try:
+        priority = min(max(int(priority or 0), JOB_PRIORITY_RANGE[0]), JOB_PRIORITY_RANGE[1])
+    except (TypeError, ValueError):
+        priority = 0
+    created_at = trip_created_at()
+    try:
+        with db_pool.pool.transaction(immediate=True) as conn:
+            trip_id = insert_trip_preferences(conn, user_id, destination, start_date, end_date, budget, activities,
+                                              group_size, created_at, mirror=True)
+            payload = {
+                "user_id": user_id,
+                "trip_id": trip_id,
+                "destination": destination,
+                "start_date": start_date,
+                "end_date": end_date,
+                "budget": budget,
+                "activities": activities,
+                "group_size": group_size
+            }
+            job_id = itinerary_jobs.enqueue(conn, user_id, payload, priority, dedupe_key)
+    except JobLimitExceeded as e:
+        logger.error(f"Itinerary job refused: {e}")
+        return {"error": "Too many itineraries in progress, please wait for one to finish."}, 429
+    except sqlite3.IntegrityError:
+        # An identical request queued the same trip first
+        existing = itinerary_jobs.duplicate_of(dedupe_key)
+        if existing is not None:
+            return job_accepted(existing, deduped=True)
+        log_message(f"Failed to queue itinerary job for user {user_id}", "ERROR")
+        return {"error": "Failed to save preferences"}, 500
+    except Exception as e:
+        logger.error(f"Error saving trip preferences in local DB: {e}")
+        log_message(f"Failed to save trip preferences for user {user_id}", "ERROR")
+        return {"error": "Failed to save preferences"}, 500
+
+    trip_preferences_saved(user_id, mirror=True)
+    itinerary_jobs.notify()
+    return job_accepted(job_id)
+
+def job_accepted(job_id, deduped=False):
+    return {
+        "job_id": job_id,
+        "status_url": f"/api/jobs/{job_id}",
+        "events_url": f"/api/jobs/{job_id}/events",
+        "deduped": deduped
+    }, 202
+
 # Function to generate a dynamic itinerary based on user preferences
 def generate_dynamic_itinerary(destination, start_date, end_date, budget, activities, group_size):
     # Parse dates
@@ -520,17 +888,90 @@ def generate_dynamic_itinerary(destination, start_date, end_date, budget, activi
         "itinerary": itinerary
     }
 
-# Endpoint to serve the itinerary.json file
+# Endpoint to serve a user's itinerary, /itinerary.json?user_id=1[&trip_id=2] is kept for older clients.
+# Bodies come from the itinerary store with their ETag, a matching If-None-Match gets a 304.
 @app.route('/itinerary.json', methods=['GET'])
-def serve_itinerary():
-    public_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'client', 'public')
-    itinerary_path = os.path.join(public_dir, 'itinerary.json')
-    if os.path.exists(itinerary_path):
-        return send_file(itinerary_path, mimetype='application/json')
-    else:
-        logger.error("itinerary.json not found")
+@app.route('/api/itineraries/<int:user_id>', methods=['GET'])
+@app.route('/api/itineraries/<int:user_id>/<int:trip_id>', methods=['GET'])
+def serve_itinerary(user_id=None, trip_id=None):
+    if user_id is None:
+        user_id = request.args.get('user_id', type=int)
+        trip_id = request.args.get('trip_id', type=int)
+    if user_id is None:
+        return jsonify({"error": "user_id is required"}), 400
+
+    entry = itinerary_store.get(user_id, trip_id)
+    if entry is None:
+        logger.error(f"Itinerary not found for user {user_id}, trip {trip_id}")
         return jsonify({"error": "Itinerary not found"}), 404
 
+    _, body, etag = entry
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+# Itinerary Job Status Route, poll until status is "done" (with result) or "failed" (with error)
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = itinerary_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job), 200
+
+# Itinerary Job Events Route, Server-Sent Events. A status event every 15 seconds while
+# the job waits or runs, which also keeps proxies from closing the connection, then one
+# "done" or "failed" event with the job. Clients reconnect if JOB_EVENTS_TIMEOUT passes first.
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    job = itinerary_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+
+    def events():
+        current = job
+        deadline = time.monotonic() + JOB_EVENTS_TIMEOUT
+        while current["status"] not in FINISHED and time.monotonic() < deadline:
+            yield format_event('status', current, sse=True)
+            current = itinerary_jobs.wait(job_id, timeout=min(15, max(0, deadline - time.monotonic())))
+            if current is None:
+                return
+        if current["status"] in FINISHED:
+            yield format_event(current["status"], current, sse=True)
+
+    return Response(events(), mimetype='text/event-stream', headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+# Metrics Route, counters for the Gemini client, itinerary cache/coalescing/store/warm-up, preference cache, hashing pool, itinerary jobs, signup, outbox, sync scheduler, circuit breakers, log pipeline and the startup breakdown
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    return jsonify({
+        "gemini": gemini.metrics(),
+        "itinerary_cache": itinerary_cache.metrics(),
+        "itinerary_coalescing": itinerary_flights.metrics(),
+        "itinerary_coalescing_async": itinerary_async_flights.metrics(),
+        "itinerary_store": itinerary_store.metrics(),
+        "itinerary_warmup": itinerary_warmup.metrics(),
+        "preference_cache": preference_cache.metrics(),
+        "hashing": hashing_pool.metrics(),
+        "itinerary_jobs": itinerary_jobs.metrics(),
+        "signup": signup_pipeline.metrics(),
+        "outbox": outbox.metrics(),
+        "sync_scheduler": sync_scheduler.metrics(),
+        "health": health.metrics(),
+        "logs": dict(log_pipeline.stats, queue_depth=log_pipeline.queue_depth()),
+        "startup": startup.report()
+    }), 200
+
+# Health Route, cached circuit states of the remote dependencies, no I/O
+@app.route('/api/health', methods=['GET'])
+def health_status():
+    dependencies = health.snapshot()
+    status = "ok" if all(state == 'closed' for state in dependencies.values()) else "degraded"
+    return jsonify({"status": status, "dependencies": dependencies}), 200
+
 # Signup Route
 @app.route('/api/signup', methods=['POST'])
 def signup():
@@ -556,51 +997,34 @@ def signup():
         logger.error("Invalid phone number format in signup data")
         return jsonify({"error": "Invalid phone number format!"}), 400
 
-    # Check if user already exists in local DB or Firebase Authentication
-    if check_user_exists_local(email, phone) or check_user_exists_firebase_auth(email):
-        logger.error(f"User with email {email} or phone {phone} already exists")
-        return jsonify({"error": "User already exists!"}), 400
+    # Known to be down, answer at once instead of waiting on Firebase Authentication
+    if not firebase_auth_breaker.available():
+        logger.error("Firebase Authentication unavailable, refusing signup")
+        return jsonify({"error": "Sign up is temporarily unavailable, please try again."}), 503
 
-    hashed_pw = bcrypt.generate_password_hash(password).decode('utf-8')
-    hashed_phone = bcrypt.generate_password_hash(phone.encode('utf-8')).decode('utf-8')
-    created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-    # Create user in Firebase Authentication
+    # Existence checks, hashing, the Firebase Authentication account and the local insert,
+    # the Firestore document and audit log are delivered later through the outbox
     try:
-        user_record = auth.create_user(
-            email=email,
-            password=password,
-            display_name=username
-        )
-        logger.info(f"User {username} registered successfully in Firebase Authentication!")
+        signup_pipeline.run(username, email, phone, password)
+    except SignupRejected as e:
+        logger.error(f"Signup for {email} refused: {e.message}")
+        return jsonify({"error": e.message}), e.status
+    except HashingBusy:
+        logger.error("Hashing pool saturated during signup")
+        return jsonify({"error": "Server busy, please try again."}), 503
     except auth.EmailAlreadyExistsError:
         logger.error(f"User with email {email} already exists in Firebase Authentication")
         return jsonify({"error": "User already exists in Firebase Authentication!"}), 400
+    except CircuitOpen as e:
+        logger.error(f"Signup for {email} refused: {e}")
+        return jsonify({"error": "Sign up is temporarily unavailable, please try again."}), 503
     except Exception as e:
-        logger.error(f"Error registering user in Firebase Authentication: {e}")
-        return jsonify({"error": f"Error registering user in Firebase Authentication: {str(e)}"}), 500
-
-    # Insert user data into local database
-    try:
-        user_inserted_local = insert_user_local(username, email, hashed_phone, hashed_pw, created_at)
-    except Exception as e:
-        logger.error(f"Error inserting user into local DB: {e}")
-        return jsonify({"error": f"Error inserting user into local DB: {str(e)}"}), 500
-
-    # Insert user data into Firebase Firestore
-    try:
-        user_inserted_firebase = insert_user_firebase(username, email, hashed_phone, hashed_pw, created_at)
-    except Exception as e:
-        logger.error(f"Error inserting user into Firebase Firestore: {e}")
-        return jsonify({"error": f"Error inserting user into Firebase Firestore: {str(e)}"}), 500
-
-    if user_inserted_local and user_inserted_firebase:
-        log_message(f"User {username} registered successfully", "INFO")
-        return jsonify({"message": "User registered successfully!", "user_registered": True}), 201
-    else:
+        logger.error(f"Error registering user {username}: {e}")
         log_message(f"Failed to register user {username}", "ERROR")
         return jsonify({"error": "An error occurred during registration.", "user_registered": False}), 500
 
+    return jsonify({"message": "User registered successfully!", "user_registered": True}), 201
+
 # Login Route
 @app.route('/api/login', methods=['POST', 'OPTIONS'])
 def login():
@@ -616,7 +1040,12 @@ def login():
         return jsonify({"error": "Email and password are required!"}), 400
 
     user = query_db("SELECT * FROM users WHERE email = ?", (email,), one=True)
-    if user and bcrypt.check_password_hash(user[4], password):
+    try:
+        verified = user is not None and hashing_pool.verify(password, user[4], timeout=HASHING_TIMEOUT)
+    except HashingBusy:
+        logger.error("Hashing pool saturated during login")
+        return jsonify({"error": "Server busy, please try again."}), 503
+    if verified:
         log_message(f"User {user[1]} logged in successfully", "INFO")
         return jsonify({"message": "Login successful!", "username": user[1], "user_id": user[0]}), 200
     else:
@@ -641,18 +1070,15 @@ def save_preferences():
         logger.error("Missing required fields in trip preferences data")
         return jsonify({"error": "All fields are required!"}), 400
 
-    # Save trip preferences to both local and Firebase Firestore databases
+    # Save trip preferences locally, the outbox mirrors them to Firebase Firestore
     saved_local = save_trip_preferences_local(
         user_id, destination, start_date, end_date, budget, activities, group_size
     )
-    saved_firebase = save_trip_preferences_firebase(
-        user_id, destination, start_date, end_date, budget, activities, group_size
-    )
 
-    if saved_local and saved_firebase:
+    if saved_local:
         log_message(f"Trip preferences for user {user_id} saved successfully", "INFO")
         # Return the saved preferences
-        preferences = get_trip_preferences_firebase(user_id)
+        preferences = preference_cache.get(user_id)
         return jsonify({"message": "Preferences saved successfully!", "preferences": preferences}), 201
     else:
         log_message(f"Failed to save trip preferences for user {user_id}", "ERROR")
@@ -661,7 +1087,7 @@ def save_preferences():
 # Get Trip Preferences Route
 @app.route('/api/trip-preferences/<int:user_id>', methods=['GET'])
 def get_preferences(user_id):
-    preferences = get_trip_preferences_firebase(user_id)
+    preferences = preference_cache.get(user_id)
     
     if preferences:
         log_message(f"Retrieved trip preferences for user {user_id}", "INFO")
@@ -670,6 +1096,18 @@ def get_preferences(user_id):
         log_message(f"No trip preferences found for user {user_id}", "WARNING")
         return jsonify({"error": "No preferences found for this user"}), 404
 
+# Trips Including An Activity Route, optionally limited to one user
+@app.route('/api/activities/<activity>/trips', methods=['GET'])
+def get_activity_trips(activity):
+    user_id = request.args.get('user_id', type=int)
+    limit = max(1, min(request.args.get('limit', 100, type=int), 500))
+    try:
+        trips = find_trips_with_activity(db_pool.pool, activity, user_id, limit)
+    except Exception as e:
+        logger.error(f"Error finding trips for activity {activity}: {e}")
+        return jsonify({"error": "Could not look up trips"}), 500
+    return jsonify({"activity": activity, "trips": trips}), 200
+
 # Generate Itinerary Route
 @app.route('/generate-itinerary', methods=['POST'])
 def generate_itinerary():
@@ -689,40 +1127,109 @@ def generate_itinerary():
         logger.error("Missing required fields in itinerary data")
         return jsonify({"error": "All fields are required!"}), 400
 
-    # Save trip preferences to both local and Firebase Firestore databases
+    # Job mode, answered with 202 and a job to poll or follow over SSE
+    if wants_itinerary_job(request.args, request.headers):
+        body, status = submit_itinerary_job(user_id, destination, start_date, end_date, budget, activities,
+                                            group_size, data.get('priority'))
+        headers = {"Location": body["status_url"]} if status == 202 else {}
+        return jsonify(body), status, headers
+
+    # Save trip preferences locally, the outbox mirrors them to Firebase Firestore
     saved_local = save_trip_preferences_local(
         user_id, destination, start_date, end_date, budget, activities, group_size
     )
-    saved_firebase = save_trip_preferences_firebase(
+
+    if not saved_local:
+        log_message(f"Failed to save trip preferences for user {user_id}", "ERROR")
+        return jsonify({"error": "Failed to save preferences"}), 500
+
+    # The local trip_preferences row id identifies this trip's itinerary
+    trip_id = saved_local
+
+    return jsonify(itinerary_for_trip(user_id, trip_id, destination, start_date, end_date, budget, activities,
+                                      group_size)), 200
+
+# Streaming Generate Itinerary Route
+# Same request body as /generate-itinerary. Days are pushed as they are parsed out of
+# the Gemini stream, as NDJSON by default or as Server-Sent Events when the client
+# sends Accept: text/event-stream. Events: meta, day (one per day), done.
+@app.route('/generate-itinerary/stream', methods=['POST'])
+def generate_itinerary_stream():
+    data = request.json
+    logger.info("Received streaming itinerary data: %s", data)
+
+    user_id = data.get('user_id')
+    destination = data.get('destination')
+    start_date = data.get('start_date')
+    end_date = data.get('end_date')
+    budget = data.get('budget')
+    activities = data.get('activities')
+    group_size = data.get('group_size')
+
+    if not all([user_id, destination, start_date, end_date, budget, activities, group_size]):
+        logger.error("Missing required fields in itinerary data")
+        return jsonify({"error": "All fields are required!"}), 400
+
+    saved_local = save_trip_preferences_local(
         user_id, destination, start_date, end_date, budget, activities, group_size
     )
 
-    if not saved_local or not saved_firebase:
+    if not saved_local:
         log_message(f"Failed to save trip preferences for user {user_id}", "ERROR")
         return jsonify({"error": "Failed to save preferences"}), 500
 
-    try:
-        # Try to generate itinerary using Gemini API
-        itinerary = generate_itinerary_with_gemini(destination, start_date, end_date, budget, activities, group_size)
-
-        # Include additional details in the itinerary object
-        itinerary_details = {
-            "destination": destination,
-            "start_date": start_date,
-            "end_date": end_date,
-            "budget": budget,
-            "group_size": group_size,
-            "activities": activities,
-            "itinerary": itinerary
-        }
+    trip_id = saved_local
+    sse = 'text/event-stream' in request.headers.get('Accept', '')
+    details = {
+        "destination": destination,
+        "start_date": start_date,
+        "end_date": end_date,
+        "budget": budget,
+        "group_size": group_size,
+        "activities": activities,
+        "trip_id": trip_id
+    }
 
-        return jsonify(itinerary_details), 200
+    def events():
+        yield format_event('meta', details, sse)
+        cache_key = itinerary_cache_key(destination, start_date, end_date, budget, activities, group_size)
+        itinerary = itinerary_cache.get(cache_key)
+        fallback = False
 
-    except Exception as e:
-        logger.error(f"Error generating itinerary with Gemini API: {e}")
-        # If Gemini API fails, generate a dynamic itinerary as a fallback
-        itinerary = generate_dynamic_itinerary(destination, start_date, end_date, budget, activities, group_size)
-        return jsonify(itinerary), 200
+        if itinerary is not None:
+            itinerary = redate_itinerary(itinerary, start_date)
+            for day in itinerary:
+                yield format_event('day', {"day": day}, sse)
+        else:
+            parser = IncrementalItineraryParser()
+            try:
+                prompt = build_itinerary_prompt(destination, start_date, end_date, budget, activities, group_size)
+                for chunk in gemini.stream(prompt):
+                    for day in parser.feed(chunk):
+                        yield format_event('day', {"day": redate_itinerary([day], start_date)[0]}, sse)
+                for day in parser.close():
+                    yield format_event('day', {"day": redate_itinerary([day], start_date)[0]}, sse)
+                itinerary_cache.put(cache_key, parser.days)
+                itinerary = redate_itinerary(parser.days, start_date)
+            except Exception as e:
+                logger.error(f"Error streaming itinerary from Gemini API: {e}")
+                # Finish the trip with the dynamic itinerary from the first day not yet sent
+                fallback = True
+                sent = len(parser.days)
+                dynamic = generate_dynamic_itinerary(destination, start_date, end_date, budget, activities, group_size)
+                rest = redate_itinerary(dynamic["itinerary"][sent:], start_date)
+                for day in rest:
+                    yield format_event('day', {"day": day}, sse)
+                itinerary = redate_itinerary(parser.days, start_date) + rest
+
+        store_itinerary(user_id, trip_id, dict(details, itinerary=itinerary))
+        yield format_event('done', dict(details, itinerary=itinerary, fallback=fallback), sse)
+
+    mimetype = 'text/event-stream' if sse else 'application/x-ndjson'
+    return Response(events(), mimetype=mimetype, headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
 
 # Forgot Password Route
 @app.route('/api/forgot-password', methods=['POST', 'OPTIONS'])
@@ -748,7 +1255,7 @@ def forgot_password():
             handle_code_in_app=False
         )
 
-        auth.send_password_reset_email(email, action_code_settings)
+        firebase_auth_call('send_password_reset_email', email, action_code_settings)
         logger.info(f"Password reset email sent to {email}")
 
         return jsonify({"message": "Password reset email sent successfully!"}), 200
@@ -759,5 +1266,56 @@ def forgot_password():
         logger.error(f"Error sending password reset email: {e}")
         return jsonify({"error": "Failed to send password reset email."}), 500
 
+# Background workers of a serving process. Started off the calling thread, so the
+# Firestore SDK import and client setup behind the outbox don't hold up the first request.
+def start_background_workers():
+    with startup.timed('background_workers'):
+        for worker in (health, outbox, sync_scheduler, itinerary_jobs, itinerary_warmup):
+            try:
+                worker.start()
+            except Exception as e:
+                logger.error(f"Could not start {worker!r}: {e}")
+    logger.info(f"Startup breakdown in process {os.getpid()} (ms): {startup.report()}")
+
+# Stop the workers of this process. The scheduler releases its lock so another process
+# takes over syncing, undelivered outbox rows and queued jobs wait in user.db for the next start.
+def stop_background_workers():
+    for worker in (itinerary_warmup, itinerary_jobs, sync_scheduler, outbox, health):
+        if worker is outbox and not outbox.initialized:
+            continue
+        try:
+            worker.shutdown()
+        except Exception as e:
+            logger.error(f"Error stopping {worker!r}: {e}")
+
+startup.record('import', time.perf_counter() - _import_started)
+
+# Application factory. Importing this module only defines the app, its routes and the
+# lazy clients. create_app() brings a serving process up: the schema check (skipped with
+# RUN_MIGRATIONS=0 when the deployment runs `python migrations.py` once instead) and the
+# background workers. Routes stay on the module-level app, repeated calls in the same
+# process return it without starting anything twice. Pre-forking servers call it in
+# each worker after the fork and migrate once in the master (see wsgi.py).
+_started_pid = None
+
+def create_app(run_migrations=None):
+    global _started_pid
+    if _started_pid == os.getpid():
+        return app
+    _started_pid = os.getpid()
+    if run_migrations is None:
+        run_migrations = os.getenv('RUN_MIGRATIONS', '1') == '1'
+    if run_migrations:
+        with startup.timed('migrations'):
+            init_db()
+    if not GEMINI_API_KEY:
+        logger.warning("GEMINI_API_KEY environment variable is not set, itineraries use the built-in generator")
+    threading.Thread(target=start_background_workers, name='startup', daemon=True).start()
+    atexit.register(stop_background_workers)
+    return app
+
 if __name__ == '__main__':
+    # Under the debug reloader the parent process only watches files, the serving child starts the app
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        create_app()
     app.run(port=5000, debug=True)
@@ -0,0 +1,264 @@
+import os
+import json
+import time
+import bisect
+import random
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Largest number of writes Firestore accepts in one batch commit
+MAX_BATCH_WRITES = 500
+
+OP_SET = 'set'
+OP_DELETE = 'delete'
+
+# Upper bounds (seconds) of the enqueue-to-delivery lag histogram, the last bucket is open-ended
+LAG_BUCKETS = (0.1, 0.5, 1, 5, 30, 60, 300)
+
+
+# Durable hand-off of Firestore writes.
+# A local write calls enqueue() with the connection of its own transaction, so the
+# outbox row commits or rolls back together with the data it mirrors. A background
+# dispatcher then ships pending rows to Firestore in batch commits and deletes them
+# once delivered. When a batch commit fails its documents are sent again one at a
+# time, so a document Firestore keeps rejecting only holds back itself. Rows that
+# fail are retried with jittered exponential backoff, and after max_attempts they
+# become dead letters: kept with dead_at set, skipped by the dispatcher and counted
+# in metrics() until retry_dead() queues them again. A dead letter is dropped once a
+# newer row for its document is delivered, so reviving it never puts stale data back.
+# While the breaker is open no row is sent, so an outage does not use up attempts.
+# Rows for one document are delivered in the order they were enqueued. Document ids
+# are chosen at enqueue time, so a retried set() overwrites rather than duplicates.
+# When a batch holds several rows for one document only the newest is sent, the
+# older ones are superseded and removed with it.
+class Outbox:
+    def __init__(self, pool, client, server_timestamp=None, updated_at_field='updated_at',
+                 batch_size=200, poll_interval=1.0, backoff=1.0, max_backoff=300, max_attempts=20,
+                 breaker=None):
+        self.pool = pool
+        self.client = client
+        self.server_timestamp = server_timestamp
+        self.updated_at_field = updated_at_field
+        self.batch_size = min(batch_size, MAX_BATCH_WRITES)
+        self.poll_interval = poll_interval
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        # Optional health.CircuitBreaker for Firestore, nothing is sent while it is open
+        self.breaker = breaker
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.stats = {'enqueued': 0, 'delivered': 0, 'superseded': 0, 'batches': 0, 'failed_batches': 0,
+                      'failed_rows': 0, 'dead_lettered': 0, 'dead_superseded': 0}
+        self._lag_histogram = [0] * (len(LAG_BUCKETS) + 1)
+        self._last_delivered_at = None
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.stats[name] += n
+
+    # Record a write inside the caller's transaction, call notify() after it commits
+    def enqueue(self, conn, collection, doc_id, data=None, op=OP_SET):
+        conn.execute('''INSERT INTO outbox (collection, doc_id, op, data, created_at)
+                        VALUES (?, ?, ?, ?, ?)''',
+                     (collection, doc_id, op, json.dumps(data) if data is not None else None, time.time()))
+        self._count('enqueued')
+
+    # Wake the dispatcher so freshly committed rows go out without waiting for the next poll
+    def notify(self):
+        self.start()
+        self._wakeup.set()
+
+    def start(self):
+        # The dispatcher thread does not survive a fork, start a fresh one in the child
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._stop.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='outbox-dispatcher', daemon=True)
+            self._thread.start()
+
+    def pending(self):
+        return self.pool.read("SELECT COUNT(*) FROM outbox WHERE dead_at IS NULL", one=True)[0]
+
+    # Next due rows in id order, dead letters aside. A row that is still backing off
+    # holds back every later row for the same document.
+    def _due(self, now):
+        due = []
+        blocked = set()
+        for row in self.pool.read('''SELECT id, collection, doc_id, op, data, attempts, next_attempt_at, created_at
+                                     FROM outbox WHERE dead_at IS NULL ORDER BY id LIMIT ?''', (self.batch_size * 4,)):
+            key = (row[1], row[2])
+            if key in blocked:
+                continue
+            if row[6] > now:
+                blocked.add(key)
+                continue
+            due.append(row)
+            if len(due) >= self.batch_size:
+                break
+        return due
+
+    def _commit(self, rows):
+        batch = self.client.batch()
+        for _, collection, doc_id, op, data, _, _, _ in rows:
+            ref = self.client.collection(collection).document(doc_id)
+            if op == OP_DELETE:
+                batch.delete(ref)
+                continue
+            data = json.loads(data)
+            if self.server_timestamp is not None:
+                data[self.updated_at_field] = self.server_timestamp
+            batch.set(ref, data)
+        batch.commit()
+
+    def _retry_at(self, attempts):
+        delay = min(self.max_backoff, self.backoff * 2 ** attempts)
+        return time.time() + delay * random.uniform(0.5, 1.0)
+
+    # Commit rows, reporting the outcome to the breaker
+    def _send(self, rows):
+        try:
+            self._commit(rows)
+        except Exception as e:
+            if self.breaker is not None:
+                self.breaker.record_error(e)
+            raise
+        if self.breaker is not None:
+            self.breaker.record_success()
+
+    # Remove delivered rows, each group holds the rows of one document in id order.
+    # Dead letters of those documents are older than what was just sent, they go too.
+    def _delivered(self, groups):
+        if not groups:
+            return
+        with self.pool.transaction() as conn:
+            conn.executemany("DELETE FROM outbox WHERE id = ?", [(row[0],) for group in groups for row in group])
+            dead = conn.executemany('''DELETE FROM outbox WHERE collection = ? AND doc_id = ? AND id < ?
+                                       AND dead_at IS NOT NULL''',
+                                    [(group[-1][1], group[-1][2], group[-1][0]) for group in groups]).rowcount
+        now = time.time()
+        with self._lock:
+            self.stats['dead_superseded'] += dead
+            self.stats['delivered'] += len(groups)
+            self.stats['superseded'] += sum(len(group) - 1 for group in groups)
+            self.stats['batches'] += 1
+            self._last_delivered_at = now
+            for group in groups:
+                self._lag_histogram[bisect.bisect_left(LAG_BUCKETS, now - group[-1][7])] += 1
+
+    # Back off the rows of a document that failed, or set them aside once out of attempts
+    def _failed(self, group, error):
+        now = time.time()
+        self.pool.write_many('''UPDATE outbox SET attempts = attempts + 1, next_attempt_at = ?, last_error = ?,
+                                dead_at = CASE WHEN attempts + 1 >= ? THEN ? END WHERE id = ?''',
+                             [(self._retry_at(row[5]), str(error)[:500], self.max_attempts, now, row[0])
+                              for row in group])
+        self._count('failed_rows', len(group))
+        dead = [row for row in group if row[5] + 1 >= self.max_attempts]
+        if dead:
+            self._count('dead_lettered', len(dead))
+            _, collection, doc_id = group[-1][:3]
+            logger.error(f"Gave up delivering {collection}/{doc_id} to Firebase Firestore after "
+                         f"{self.max_attempts} attempts, kept as a dead letter: {error}")
+
+    # Deliver one batch, returns the number of rows delivered
+    def dispatch_once(self):
+        rows = self._due(time.time())
+        if not rows or (self.breaker is not None and not self.breaker.allow()):
+            return 0
+        # Rows arrive in id order, the last one per document wins
+        by_document = {}
+        for row in rows:
+            by_document.setdefault((row[1], row[2]), []).append(row)
+        groups = list(by_document.values())
+        if len(groups) == 1:
+            return self._dispatch_each(groups)
+        try:
+            self._send([group[-1] for group in groups])
+        except Exception as e:
+            self._count('failed_batches')
+            logger.error(f"Error delivering {len(rows)} outbox rows to Firebase Firestore, "
+                         f"sending them one at a time: {e}")
+            return self._dispatch_each(groups)
+        self._delivered(groups)
+        return len(rows)
+
+    # Send each document on its own after a failed batch. Stops when the breaker opens,
+    # the rows not tried yet keep their attempts.
+    def _dispatch_each(self, groups):
+        delivered = []
+        for group in groups:
+            if self.breaker is not None and not self.breaker.allow():
+                break
+            try:
+                self._send([group[-1]])
+            except Exception as e:
+                self._failed(group, e)
+            else:
+                delivered.append(group)
+        self._delivered(delivered)
+        return sum(len(group) for group in delivered)
+
+    # Queue the dead letters again with fresh attempts, returns how many were revived.
+    # A dead letter with a newer row for its document still waiting is dropped instead,
+    # the newer row carries the document.
+    def retry_dead(self):
+        with self.pool.transaction() as conn:
+            dead = conn.execute('''DELETE FROM outbox WHERE dead_at IS NOT NULL AND EXISTS (
+                                       SELECT 1 FROM outbox AS newer WHERE newer.collection = outbox.collection
+                                       AND newer.doc_id = outbox.doc_id AND newer.id > outbox.id)''').rowcount
+            revived = conn.execute('''UPDATE outbox SET dead_at = NULL, attempts = 0, next_attempt_at = 0
+                                      WHERE dead_at IS NOT NULL RETURNING id''').fetchall()
+        self._count('dead_superseded', dead)
+        if revived:
+            self.notify()
+        return len(revived)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self.dispatch_once():
+                    continue
+            except Exception as e:
+                logger.error(f"Outbox dispatcher error: {e}")
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    # Outbox lag: how much is waiting, how long the oldest row has waited, how many rows
+    # are being retried or were given up on, and how long delivered rows spent in the outbox
+    def metrics(self):
+        with self._lock:
+            histogram = {f"le_{bound}": count for bound, count in zip(LAG_BUCKETS, self._lag_histogram)}
+            histogram['le_inf'] = self._lag_histogram[-1]
+            stats = dict(self.stats,
+                         lag_histogram=histogram,
+                         seconds_since_delivery=(round(time.time() - self._last_delivered_at, 3)
+                                                 if self._last_delivered_at else None))
+        pending, oldest, retrying, max_attempts = self.pool.read(
+            "SELECT COUNT(*), MIN(created_at), SUM(attempts > 0), MAX(attempts) FROM outbox WHERE dead_at IS NULL",
+            one=True)
+        dead_letters = self.pool.read("SELECT COUNT(*) FROM outbox WHERE dead_at IS NOT NULL", one=True)[0]
+        stats.update(pending=pending,
+                     dead_letters=dead_letters,
+                     oldest_pending_age=round(time.time() - oldest, 3) if oldest else 0,
+                     retrying=retrying or 0,
+                     max_attempts=max_attempts or 0)
+        return stats
+
+    # Stop the dispatcher, rows not yet delivered stay in the table for the next start
+    def shutdown(self, timeout=10):
+        self._stop.set()
+        self._wakeup.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive() and self._pid == os.getpid():
+            thread.join(timeout)
+        self._thread = None
@@ -0,0 +1,91 @@
+import os
+import re
+import hmac
+import hashlib
+import logging
+import argparse
+import sqlite3
+
+from hashing import is_bcrypt_hash
+
+logger = logging.getLogger(__name__)
+
+# Deterministic keyed phone fingerprints.
+# users.phone keeps a salted bcrypt hash, which can never be compared against a
+# raw phone. Next to it users.phone_fingerprint stores HMAC-SHA256(key, normalized
+# phone) under a UNIQUE index, so "is this phone taken" is one index lookup and
+# duplicates are rejected by the database. Without the key the fingerprints can't
+# be brute-forced from the small phone number space.
+
+FINGERPRINT_KEY_ENV = 'PHONE_FINGERPRINT_KEY'
+
+
+# Digits only, without a leading trunk zero, so "098765 43210" and "9876543210" match
+def normalize_phone(phone):
+    return re.sub(r'\D', '', str(phone or '')).lstrip('0')
+
+
+class PhoneFingerprinter:
+    def __init__(self, key):
+        if not key:
+            raise ValueError(f"{FINGERPRINT_KEY_ENV} environment variable is not set")
+        self._key = key.encode('utf-8') if isinstance(key, str) else key
+
+    # Fingerprint of a raw phone, None for empty values and hashes that can't be fingerprinted
+    def __call__(self, phone):
+        if is_bcrypt_hash(phone):
+            return None
+        digits = normalize_phone(phone)
+        if not digits:
+            return None
+        return hmac.new(self._key, digits.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+# Fill phone_fingerprint for existing users whose phone is still stored raw.
+# Phones that are already bcrypt hashed can't be recovered and are only counted,
+# those users get a fingerprint when their record is next written with a raw phone.
+# Each batch commits on its own so the tool can be interrupted and re-run.
+def backfill(pool, fingerprint, batch_size=1000):
+    stats = {'fingerprinted': 0, 'hashed': 0, 'conflicts': 0}
+    last_id = 0
+    while True:
+        rows = pool.read('''SELECT id, phone FROM users WHERE phone_fingerprint IS NULL AND id > ?
+                            ORDER BY id LIMIT ?''', (last_id, batch_size))
+        if not rows:
+            return stats
+        last_id = rows[-1][0]
+        with pool.transaction() as conn:
+            for user_id, phone in rows:
+                value = fingerprint(phone)
+                if value is None:
+                    stats['hashed'] += 1
+                    continue
+                try:
+                    conn.execute("UPDATE users SET phone_fingerprint = ? WHERE id = ?", (value, user_id))
+                    stats['fingerprinted'] += 1
+                except sqlite3.IntegrityError:
+                    # Another user already holds this phone, left for manual review
+                    stats['conflicts'] += 1
+                    logger.warning(f"User {user_id} shares a phone number with another user")
+
+
+#   PHONE_FINGERPRINT_KEY=... python phone_fingerprint.py [--database user.db] [--batch-size 1000]
+def main():
+    import db_pool
+    import migrations
+
+    parser = argparse.ArgumentParser(description="Backfill users.phone_fingerprint")
+    parser.add_argument('--database', default=db_pool.DATABASE_PATH)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    pool = db_pool.ConnectionPool(args.database)
+    migrations.migrate(pool)
+    stats = backfill(pool, PhoneFingerprinter(os.getenv(FINGERPRINT_KEY_ENV)), args.batch_size)
+    pool.close_all()
+    print(f"fingerprinted {stats['fingerprinted']}, already hashed {stats['hashed']}, conflicts {stats['conflicts']}")
+
+
+if __name__ == '__main__':
+    main()
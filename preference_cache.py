@@ -0,0 +1,110 @@
+import time
+import threading
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+# Routes see user ids as ints, JSON bodies may send them as strings
+def _key(user_id):
+    try:
+        return int(user_id)
+    except (TypeError, ValueError):
+        return user_id
+
+
+# Read-through cache for a user's latest trip preferences.
+# Lookups go memory -> local SQLite copy -> Firestore, and whatever is found is
+# remembered per user. Users with no preferences are remembered too (for a shorter
+# time) so an empty dashboard doesn't query Firestore on every load. Every local or
+# Firestore write for a user invalidates that user's entry in this process. Other
+# server processes write to the same user.db, so with `version` each entry also keeps
+# version(user_id), a cheap stamp of the user's local rows read before loading, and a
+# memory hit whose stamp no longer matches is dropped and loaded again.
+class PreferenceCache:
+    def __init__(self, load_local, load_remote, version=None, max_entries=4096, ttl=300, negative_ttl=60):
+        self.load_local = load_local
+        self.load_remote = load_remote
+        self.version = version
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'memory_hits': 0, 'local_hits': 0, 'remote_hits': 0, 'misses': 0, 'invalidations': 0,
+                      'stale': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _remember(self, user_id, preferences, stamp):
+        user_id = _key(user_id)
+        ttl = self.ttl if preferences is not None else self.negative_ttl
+        with self._lock:
+            self._entries[user_id] = (preferences, time.monotonic() + ttl, stamp)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _cached(self, user_id, stamp):
+        user_id = _key(user_id)
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return _MISSING
+            preferences, expires_at, cached_stamp = entry
+            if expires_at <= time.monotonic():
+                del self._entries[user_id]
+                return _MISSING
+            if cached_stamp != stamp:
+                # Written by another process since it was cached
+                del self._entries[user_id]
+                self.stats['stale'] += 1
+                return _MISSING
+            self._entries.move_to_end(user_id)
+            self.stats['memory_hits'] += 1
+            return preferences
+
+    def get(self, user_id):
+        stamp = self.version(user_id) if self.version is not None else None
+        preferences = self._cached(user_id, stamp)
+        if preferences is not _MISSING:
+            return preferences
+
+        preferences = self.load_local(user_id)
+        if preferences is not None:
+            self._count('local_hits')
+        else:
+            preferences = self.load_remote(user_id)
+            self._count('remote_hits' if preferences is not None else 'misses')
+        self._remember(user_id, preferences, stamp)
+        return preferences
+
+    # get() for the ASGI app, with coroutine loaders (and version) in place of the sync ones
+    async def aget(self, user_id, load_local, load_remote, version=None):
+        stamp = await version(user_id) if version is not None else None
+        preferences = self._cached(user_id, stamp)
+        if preferences is not _MISSING:
+            return preferences
+
+        preferences = await load_local(user_id)
+        if preferences is not None:
+            self._count('local_hits')
+        else:
+            preferences = await load_remote(user_id)
+            self._count('remote_hits' if preferences is not None else 'misses')
+        self._remember(user_id, preferences, stamp)
+        return preferences
+
+    def invalidate(self, user_id):
+        with self._lock:
+            if self._entries.pop(_key(user_id), None) is not None:
+                self.stats['invalidations'] += 1
+
+    def metrics(self):
+        with self._lock:
+            return dict(self.stats, entries=len(self._entries))
@@ -0,0 +1,104 @@
+import time
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SignupRejected(Exception):
+    """Signup refused for a reason the client can act on, carries the HTTP status."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+# Signup as a concurrent pipeline.
+#   1. the local and Firebase Auth existence checks run side by side on the executor
+#   2. the password and phone hashes start in the hashing pool's processes, and
+#      the Firebase Auth account is created on this thread while they run
+#   3. the user is stored locally. store_local is expected to append the Firestore
+#      mirror and audit log to the outbox in the same transaction.
+# If anything fails after the Auth account exists, the account is deleted again so
+# a retry of the same signup is not refused as a duplicate.
+class SignupPipeline:
+    def __init__(self, executor, hashing_pool, check_local, check_remote, create_remote, delete_remote,
+                 store_local, phone_rounds=None, hashing_timeout=None):
+        self.executor = executor
+        self.hashing_pool = hashing_pool
+        self.check_local = check_local
+        self.check_remote = check_remote
+        self.create_remote = create_remote
+        self.delete_remote = delete_remote
+        self.store_local = store_local
+        self.phone_rounds = phone_rounds
+        self.hashing_timeout = hashing_timeout
+        self._lock = threading.Lock()
+        self.stats = {'registered': 0, 'rejected': 0, 'failed': 0, 'compensated': 0, 'compensation_failures': 0}
+        self._latency_total = 0.0
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _compensate(self, uid):
+        try:
+            self.delete_remote(uid)
+            self._count('compensated')
+            logger.info(f"Removed Firebase Authentication user {uid} after a failed signup")
+        except Exception as e:
+            self._count('compensation_failures')
+            logger.error(f"Could not remove Firebase Authentication user {uid} after a failed signup: {e}")
+
+    # Returns the Firebase Authentication uid, raises SignupRejected or the underlying error
+    def run(self, username, email, phone, password):
+        started = time.monotonic()
+        try:
+            uid = self._run(username, email, phone, password)
+        except SignupRejected:
+            self._count('rejected')
+            raise
+        except Exception:
+            self._count('failed')
+            raise
+        with self._lock:
+            self.stats['registered'] += 1
+            self._latency_total += time.monotonic() - started
+        return uid
+
+    def _run(self, username, email, phone, password):
+        local = self.executor.submit(self.check_local, email, phone)
+        remote = self.executor.submit(self.check_remote, email)
+        if local.result() or remote.result():
+            raise SignupRejected("User already exists!")
+
+        pw_future = self.hashing_pool.submit(password, timeout=self.hashing_timeout)
+        try:
+            phone_future = self.hashing_pool.submit(phone, rounds=self.phone_rounds, timeout=self.hashing_timeout)
+        except Exception:
+            pw_future.cancel()
+            raise
+
+        try:
+            uid = self.create_remote(username, email, password)
+        except Exception:
+            pw_future.cancel()
+            phone_future.cancel()
+            raise
+
+        try:
+            hashed_pw = pw_future.result()
+            hashed_phone = phone_future.result()
+            if not self.store_local(username, email, phone, hashed_pw, hashed_phone):
+                raise SignupRejected("User already exists!")
+        except Exception:
+            self._compensate(uid)
+            raise
+        return uid
+
+    def metrics(self):
+        with self._lock:
+            registered = self.stats['registered']
+            return dict(self.stats,
+                        latency_avg=round(self._latency_total / registered, 4) if registered else None)
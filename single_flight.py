@@ -0,0 +1,126 @@
+import threading
+import logging
+
+from startup import LazyModule
+
+logger = logging.getLogger(__name__)
+
+# Only AsyncSingleFlight needs it, WSGI processes never import asyncio
+asyncio = LazyModule('asyncio')
+
+
+class SingleFlightTimeout(Exception):
+    pass
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+# Coalesces identical concurrent calls.
+# The first caller for a key (the leader) runs the function, callers that arrive
+# while it is running (followers) wait for it and share its result. If the leader
+# fails, every follower gets the same exception so it can take its own fallback
+# path; a follower that waits longer than wait_timeout gets SingleFlightTimeout.
+class SingleFlight:
+    def __init__(self, wait_timeout=60):
+        self.wait_timeout = wait_timeout
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.stats = {
+            'leaders': 0,
+            'coalesced': 0,
+            'leader_failures': 0,
+            'follower_timeouts': 0,
+        }
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                leader = True
+                self.stats['leaders'] += 1
+            else:
+                leader = False
+                flight.followers += 1
+                self.stats['coalesced'] += 1
+
+        if not leader:
+            if not flight.done.wait(self.wait_timeout):
+                with self._lock:
+                    self.stats['follower_timeouts'] += 1
+                raise SingleFlightTimeout(f"Timed out after {self.wait_timeout}s waiting for in-flight call {key}")
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn(*args, **kwargs)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            with self._lock:
+                self.stats['leader_failures'] += 1
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            if flight.followers:
+                logger.info(f"Shared one result for {key} with {flight.followers} coalesced callers")
+            flight.done.set()
+
+    def metrics(self):
+        with self._lock:
+            return dict(self.stats, in_flight=len(self._flights))
+
+
+# SingleFlight for coroutines on one event loop (see asgi.py). The leader's call runs
+# as a task of its own, so a leader whose client goes away doesn't cancel the result
+# its followers are waiting for.
+class AsyncSingleFlight:
+    def __init__(self, wait_timeout=60):
+        self.wait_timeout = wait_timeout
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.stats = {
+            'leaders': 0,
+            'coalesced': 0,
+            'leader_failures': 0,
+            'follower_timeouts': 0,
+        }
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _finish(self, key, task):
+        with self._lock:
+            del self._flights[key]
+            if not task.cancelled() and task.exception() is not None:
+                self.stats['leader_failures'] += 1
+
+    async def do(self, key, fn, *args, **kwargs):
+        task = self._flights.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            with self._lock:
+                self._flights[key] = task
+                self.stats['leaders'] += 1
+            task.add_done_callback(lambda t: self._finish(key, t))
+            return await asyncio.shield(task)
+
+        self._count('coalesced')
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), self.wait_timeout)
+        except asyncio.TimeoutError:
+            self._count('follower_timeouts')
+            raise SingleFlightTimeout(f"Timed out after {self.wait_timeout}s waiting for in-flight call {key}")
+
+    def metrics(self):
+        with self._lock:
+            return dict(self.stats, in_flight=len(self._flights))
@@ -0,0 +1,91 @@
+import os
+import time
+import importlib
+import threading
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Milliseconds spent in each startup step and in the first use of each lazy client,
+# in the order they happened
+_timings = {}
+_timings_lock = threading.Lock()
+
+
+def record(name, seconds):
+    with _timings_lock:
+        _timings[name] = round(seconds * 1000, 1)
+
+
+@contextmanager
+def timed(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+# Startup breakdown, e.g. {"import": 84.2, "migrations": 3.1, "init:firestore": 412.7}
+def report():
+    with _timings_lock:
+        return dict(_timings)
+
+
+# Per-process singleton built by `factory` on first use.
+# Attribute access and calls are forwarded to the built object, so a Lazy can stand
+# in for a module-level client. Nothing is built at import time, and a process
+# forked after the parent built it (a pre-forking server worker) builds its own
+# instead of sharing the parent's sockets, gRPC channels and threads. A factory
+# that raises is retried on the next use.
+class Lazy:
+    def __init__(self, name, factory):
+        self._name = name
+        self._factory = factory
+        self._value = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return self._value
+        if self._lock_pid_changed(pid):
+            self._lock = threading.Lock()
+        with self._lock:
+            if self._pid != pid:
+                with timed(f'init:{self._name}'):
+                    value = self._factory()
+                self._value, self._pid = value, pid
+                logger.info(f"Initialized {self._name} in process {pid}")
+        return self._value
+
+    # A lock held by another thread at fork time would never be released in the child
+    def _lock_pid_changed(self, pid):
+        return self._pid is not None and self._pid != pid
+
+    @property
+    def initialized(self):
+        return self._pid == os.getpid()
+
+    # Drop the built object, the next use builds a new one
+    def reset(self):
+        self._lock = threading.Lock()
+        self._value, self._pid = None, None
+
+    def __getattr__(self, attr):
+        return getattr(self.get(), attr)
+
+    def __call__(self, *args, **kwargs):
+        return self.get()(*args, **kwargs)
+
+    def __repr__(self):
+        state = 'initialized' if self.initialized else 'pending'
+        return f"<Lazy {self._name} ({state})>"
+
+
+# Module imported on first attribute access, for heavy SDKs that are not needed to serve most requests
+class LazyModule(Lazy):
+    def __init__(self, module_name):
+        super().__init__(module_name, lambda: importlib.import_module(module_name))
@@ -0,0 +1,294 @@
+import threading
+import logging
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Field stamped with the server commit time on every document the app writes,
+# remote pulls only ask for documents whose stamp is past the stored cursor
+UPDATED_AT_FIELD = 'updated_at'
+
+# Firestore's special field path for ordering and filtering by document id
+DOCUMENT_ID = '__name__'
+
+# Largest number of writes Firestore accepts in one batch commit
+MAX_BATCH_WRITES = 500
+
+# How one local table maps onto one Firestore collection.
+#   to_document(row)            -> (document_id, data) for a local row
+#   from_document(doc_id, data) -> True once the document is present locally,
+#                                  False if it can never be stored; raise to retry
+#   store_page(docs)            -> optional bulk form of from_document for a list of
+#                                  (doc_id, data), stores what is missing in one
+#                                  transaction and returns how many rows were added
+class TableSync:
+    def __init__(self, table, collection, columns, to_document, from_document, store_page=None):
+        self.table = table
+        self.collection = collection
+        self.columns = columns
+        self.to_document = to_document
+        self.from_document = from_document
+        self.store_page = store_page
+
+
+# Change-tracking sync between user.db and Firestore.
+# Push: local tables are insert-only, so the INTEGER PRIMARY KEY is a ready-made
+# change log and the high-water mark is the last id that reached Firestore.
+# Pull: a cursor on the server-side updated_at stamp per collection, plus the ids
+# already seen at exactly that stamp so documents committed in the same instant
+# are neither skipped nor re-imported.
+# Cursors live in the sync_state table, created by migrations.py.
+class SyncEngine:
+    def __init__(self, client, pool, specs, server_timestamp, batch_size=500, breaker=None,
+                 pull_workers=4, page_size=500, clock_skew=60):
+        self.client = client
+        self.pool = pool
+        self.specs = {spec.table: spec for spec in specs}
+        self.server_timestamp = server_timestamp
+        self.batch_size = batch_size
+        self.pull_workers = pull_workers
+        self.page_size = page_size
+        # Seconds the server clock may be ahead of Firestore's commit stamps
+        self.clock_skew = clock_skew
+        # Optional health.CircuitBreaker for Firestore, push and pull are skipped while it is open
+        self.breaker = breaker
+
+    def get_state(self, name, default=None):
+        row = self.pool.read("SELECT value FROM sync_state WHERE name = ?", (name,), one=True)
+        return row[0] if row else default
+
+    def set_state(self, name, value):
+        self.pool.write("INSERT INTO sync_state (name, value, updated_at) VALUES (?, ?, ?) "
+                        "ON CONFLICT(name) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at",
+                        (name, value, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+
+    # Push local rows created since the last successful push.
+    # Existence is checked for a whole page of rows in one call and the missing
+    # documents go out through WriteBatch, so round trips scale with the number of
+    # pages rather than the number of rows. The very first push (no watermark yet)
+    # diffs against the full remote key set instead of looking pages up one by one.
+    def push(self, table):
+        spec = self.specs[table]
+        if self.breaker is not None and not self.breaker.allow():
+            logger.info(f"Firebase Firestore unavailable, skipping push of {spec.table}")
+            return 0
+        mark_name = f"push:{table}"
+        mark = int(self.get_state(mark_name, 0))
+        pushed = 0
+        try:
+            remote = self.remote_keys(spec.collection) if mark == 0 else None
+            while True:
+                rows = self.pool.read(f"SELECT {spec.columns} FROM {spec.table} WHERE id > ? ORDER BY id LIMIT ?",
+                                      (mark, self.batch_size))
+                if not rows:
+                    break
+                documents = dict(spec.to_document(row) for row in rows)
+                existing = remote if remote is not None else self.existing_keys(spec.collection, list(documents))
+                missing = [(doc_id, data) for doc_id, data in documents.items() if doc_id not in existing]
+                self.write_documents(spec.collection, missing)
+                pushed += len(missing)
+                mark = rows[-1][0]
+                self.set_state(mark_name, str(mark))
+        except Exception as e:
+            if self.breaker is not None:
+                self.breaker.record_error(e)
+            # The watermark stays on the last page that made it, retry from there next cycle
+            logger.error(f"Error pushing {spec.table} rows after id {mark} to Firebase Firestore: {e}")
+            return pushed
+        if self.breaker is not None:
+            self.breaker.record_success()
+        logger.info(f"Pushed {pushed} new {spec.table} rows to Firebase Firestore.")
+        return pushed
+
+    # Every document id in a collection, fetched in key-only pages
+    def remote_keys(self, collection, page_size=1000):
+        keys = set()
+        query = self.client.collection(collection).select([]).order_by(DOCUMENT_ID).limit(page_size)
+        last = None
+        while True:
+            page = list((query.start_after(last) if last is not None else query).stream())
+            keys.update(doc.id for doc in page)
+            if len(page) < page_size:
+                return keys
+            last = page[-1]
+
+    # Which of the given document ids already exist, one batched lookup
+    def existing_keys(self, collection, doc_ids):
+        if not doc_ids:
+            return set()
+        coll = self.client.collection(collection)
+        snapshots = self.client.get_all([coll.document(doc_id) for doc_id in doc_ids], field_paths=[])
+        return {snapshot.id for snapshot in snapshots if snapshot.exists}
+
+    # Write documents in WriteBatch chunks of at most MAX_BATCH_WRITES
+    def write_documents(self, collection, documents):
+        coll = self.client.collection(collection)
+        for i in range(0, len(documents), MAX_BATCH_WRITES):
+            batch = self.client.batch()
+            for doc_id, data in documents[i:i + MAX_BATCH_WRITES]:
+                data[UPDATED_AT_FIELD] = self.server_timestamp
+                batch.set(coll.document(doc_id), data)
+            batch.commit()
+
+    def _load_cursor(self, name):
+        value = self.get_state(name)
+        if not value:
+            return None, set()
+        stamp, _, ids = value.partition('|')
+        return datetime.fromisoformat(stamp), set(filter(None, ids.split('\x1f')))
+
+    def _save_cursor(self, name, stamp, ids):
+        self.set_state(name, f"{stamp.isoformat()}|" + '\x1f'.join(sorted(ids)))
+
+    # Cursor for a full walk starting now. Documents are not read in stamp order, one
+    # updated behind the walk can carry a smaller stamp than the newest one read, so
+    # the cursor is the start time (less clock_skew) and the next pull reads again
+    # what changed during the walk.
+    def _walk_started(self):
+        return datetime.now(timezone.utc) - timedelta(seconds=self.clock_skew)
+
+    # Stream a query, reporting the outcome to the breaker. A consumer that stops
+    # early still counts as a success, the documents were arriving.
+    def _stream(self, query):
+        failed = False
+        try:
+            yield from query.stream()
+        except Exception as e:
+            failed = True
+            if self.breaker is not None:
+                self.breaker.record_error(e)
+            raise
+        finally:
+            if not failed and self.breaker is not None:
+                self.breaker.record_success()
+
+    # Pull documents stamped since the last successful pull.
+    # The first run has no cursor and walks the whole collection once, in bulk
+    # when the table supports it.
+    def pull(self, table):
+        spec = self.specs[table]
+        if self.breaker is not None and not self.breaker.allow():
+            logger.info(f"Firebase Firestore unavailable, skipping pull of {spec.collection}")
+            return 0
+        if spec.store_page is not None and self.get_state(f"pull:{spec.collection}") is None:
+            return self.bulk_pull(table)
+        cursor_name = f"pull:{spec.collection}"
+        stamp, seen = self._load_cursor(cursor_name)
+        started = self._walk_started()
+
+        query = self.client.collection(spec.collection)
+        if stamp is not None:
+            query = query.where(UPDATED_AT_FIELD, '>=', stamp).order_by(UPDATED_AT_FIELD)
+
+        pulled = 0
+        completed = True
+        new_stamp, new_seen = stamp, set(seen)
+        for doc in self._stream(query):
+            data = doc.to_dict()
+            doc_stamp = data.get(UPDATED_AT_FIELD)
+            if stamp is not None and doc_stamp == stamp and doc.id in seen:
+                continue
+            try:
+                stored = spec.from_document(doc.id, data)
+            except Exception as e:
+                # Stop short so the failed document is retried next cycle
+                logger.error(f"Error pulling {spec.collection}/{doc.id} from Firebase Firestore: {e}")
+                completed = False
+                break
+            if stored:
+                pulled += 1
+            else:
+                # Rejected by the local schema, retrying would fail the same way
+                logger.error(f"Skipped {spec.collection}/{doc.id}, it could not be stored in local DB")
+            if doc_stamp is None:
+                continue
+            if new_stamp is None or doc_stamp > new_stamp:
+                new_stamp, new_seen = doc_stamp, {doc.id}
+            elif doc_stamp == new_stamp:
+                new_seen.add(doc.id)
+
+        if stamp is None:
+            # The first walk is unordered, only a complete pass may set the cursor
+            if completed:
+                self._save_cursor(cursor_name, started, set())
+        elif new_stamp != stamp or new_seen != seen:
+            self._save_cursor(cursor_name, new_stamp, new_seen)
+        logger.info(f"Pulled {pulled} changed {spec.collection} documents from Firebase Firestore.")
+        return pulled
+
+    # Queries that together cover a collection. Firestore splits it into key ranges of
+    # similar size with get_partitions, backends without partition support get one range.
+    def partitions(self, collection):
+        count = self.pull_workers * 2
+        try:
+            queries = [partition.query() for partition in
+                       self.client.collection_group(collection).get_partitions(count)]
+        except Exception as e:
+            logger.info(f"Partitioned reads unavailable for {collection} ({e}), using one key range")
+            queries = []
+        return queries or [self.client.collection(collection).order_by(DOCUMENT_ID)]
+
+    # Documents of a key-ordered query in pages of page_size, only one page held at a time
+    def pages(self, query):
+        last = None
+        while True:
+            page_query = query.limit(self.page_size)
+            if last is not None:
+                page_query = page_query.start_after(last)
+            page = list(self._stream(page_query))
+            if page:
+                yield page
+            if len(page) < self.page_size:
+                return
+            last = page[-1]
+
+    # Full-collection pull without a cursor.
+    # Partitions are read concurrently on a small thread pool. Each page is handed to
+    # the table's store_page as a whole (one executemany per page instead of an
+    # existence check and insert per document), so memory stays at pull_workers
+    # pages no matter how large the collection is. The cursor is only set once
+    # every partition finished, otherwise the next pull starts over, and it is set to
+    # when the walk started (inserts are INSERT OR IGNORE, so repeating pages or
+    # documents is harmless).
+    def bulk_pull(self, table):
+        spec = self.specs[table]
+        cursor_name = f"pull:{spec.collection}"
+        started = self._walk_started()
+        lock = threading.Lock()
+        totals = {'documents': 0}
+
+        def pull_partition(query):
+            stored = 0
+            for page in self.pages(query):
+                docs = [(doc.id, doc.to_dict()) for doc in page]
+                stored += spec.store_page(docs)
+                with lock:
+                    totals['documents'] += len(docs)
+            return stored
+
+        queries = self.partitions(spec.collection)
+        pulled = 0
+        completed = True
+        with ThreadPoolExecutor(max_workers=min(self.pull_workers, len(queries)),
+                                thread_name_prefix=f'pull-{spec.collection}') as executor:
+            futures = [executor.submit(pull_partition, query) for query in queries]
+            for future in futures:
+                try:
+                    pulled += future.result()
+                except Exception as e:
+                    completed = False
+                    logger.error(f"Error bulk pulling {spec.collection} from Firebase Firestore: {e}")
+
+        if completed:
+            self._save_cursor(cursor_name, started, set())
+        logger.info(f"Bulk pulled {pulled} new of {totals['documents']} {spec.collection} documents "
+                    f"in {len(queries)} partitions from Firebase Firestore.")
+        return pulled
+
+    # One sync cycle, pushes first so the pull sees this instance's own writes settle
+    def run_once(self):
+        for table in self.specs:
+            self.push(table)
+        for table in self.specs:
+            self.pull(table)
@@ -0,0 +1,204 @@
+import os
+import time
+import threading
+import logging
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+SWEEP = 'sweep'
+
+
+# Exclusive, non-blocking lock on a file, held for as long as the process keeps it.
+# The OS drops it when the process dies, so a crashed holder never blocks a successor.
+class LockFile:
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def acquire(self):
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+        return True
+
+    def release(self):
+        fd, self._fd = self._fd, None
+        if fd is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(fd)
+
+    # Drop a descriptor inherited over fork without unlocking, the parent still holds the lock
+    def forget(self):
+        fd, self._fd = self._fd, None
+        if fd is not None:
+            os.close(fd)
+
+    @property
+    def held(self):
+        return self._fd is not None
+
+
+# Event-driven sync scheduling.
+# notify(kind) is called after local writes and by Firestore on_snapshot listeners.
+# Kinds that arrive close together are coalesced. A run starts once no new event has
+# come in for `debounce` seconds, or `max_delay` seconds after the first one if a
+# burst never settles. A full sweep also runs every `sweep_interval` seconds, however
+# busy the event traffic, to pick up changes no event reported (other entry points
+# writing user.db, documents changed while a listener was disconnected). Pulls only
+# see documents stamped with updated_at, so every writer must stamp it.
+# Only one scheduler per host does the work: the first process to take the lock file
+# runs syncs and holds the listeners. The others retry the lock every `lock_retry`
+# seconds and ignore notifications until they get it, since the holder's listeners
+# and sweep cover their writes too.
+class SyncScheduler:
+    def __init__(self, run, lock_path, listeners=(), debounce=2.0, max_delay=30.0, sweep_interval=300,
+                 lock_retry=30):
+        self.run = run
+        self.lock = LockFile(lock_path)
+        self.listeners = list(listeners)
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.sweep_interval = sweep_interval
+        self.lock_retry = lock_retry
+        self._pending = set()
+        self._first_event = None
+        self._last_event = None
+        self._last_sweep = time.monotonic()
+        self._watches = []
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self.stats = {'notifications': 0, 'runs': 0, 'sweeps': 0, 'coalesced': 0, 'failures': 0}
+
+    # Request a sync of `kind`, returns immediately
+    def notify(self, kind):
+        with self._cond:
+            self.stats['notifications'] += 1
+            if kind in self._pending:
+                self.stats['coalesced'] += 1
+            self._pending.add(kind)
+            now = time.monotonic()
+            self._last_event = now
+            if self._first_event is None:
+                self._first_event = now
+            self._cond.notify()
+
+    def start(self):
+        # One scheduler thread per process, a forked child starts its own
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        if self._pid is not None and self._pid != os.getpid():
+            self.lock.forget()
+            self._watches = []
+        self._stop.clear()
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._loop, name='sync-scheduler', daemon=True)
+        self._thread.start()
+
+    def _subscribe(self):
+        for subscribe in self.listeners:
+            try:
+                self._watches.append(subscribe(self.notify))
+            except Exception as e:
+                logger.error(f"Could not start sync listener: {e}")
+
+    def _unsubscribe(self):
+        watches, self._watches = self._watches, []
+        for watch in watches:
+            try:
+                watch.unsubscribe()
+            except Exception as e:
+                logger.error(f"Error stopping sync listener: {e}")
+
+    def _take(self, kinds):
+        self._pending = set()
+        self._first_event = self._last_event = None
+        return kinds, 0
+
+    # Kinds to run now, or how long to wait before looking again. A sweep that is due
+    # runs at once, together with whatever is pending.
+    def _next(self):
+        now = time.monotonic()
+        sweep_at = self._last_sweep + self.sweep_interval
+        if sweep_at <= now:
+            return self._take(self._pending | {SWEEP})
+        if self._pending:
+            due = min(self._last_event + self.debounce, self._first_event + self.max_delay)
+            if due <= now:
+                return self._take(self._pending)
+            return None, min(due, sweep_at) - now
+        return None, sweep_at - now
+
+    def _loop(self):
+        while not self._stop.is_set():
+            if not self.lock.held:
+                if not self.lock.acquire():
+                    with self._cond:
+                        self._pending.clear()
+                        self._first_event = self._last_event = None
+                    self._stop.wait(self.lock_retry)
+                    continue
+                logger.info(f"Sync scheduler active in process {os.getpid()}")
+                self._subscribe()
+                # Catch up on whatever changed while no process was syncing
+                self.notify(SWEEP)
+
+            with self._cond:
+                kinds, wait = self._next()
+                if kinds is None:
+                    self._cond.wait(wait)
+                    continue
+
+            with self._cond:
+                self.stats['runs'] += 1
+                if SWEEP in kinds:
+                    self.stats['sweeps'] += 1
+                    self._last_sweep = time.monotonic()
+            try:
+                self.run(kinds)
+            except Exception as e:
+                with self._cond:
+                    self.stats['failures'] += 1
+                logger.error(f"Sync run for {sorted(kinds)} failed: {e}")
+
+        self._unsubscribe()
+        self.lock.release()
+
+    def metrics(self):
+        with self._cond:
+            return dict(self.stats, active=self.lock.held, pending=sorted(self._pending))
+
+    # Stop listening, let a running sync finish and release the lock for another process
+    def shutdown(self, timeout=30):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify()
+        thread = self._thread
+        if thread is not None and thread.is_alive() and self._pid == os.getpid():
+            thread.join(timeout)
+        self._thread = None
@@ -2,6 +2,7 @@ from flask import Flask, request, jsonify, Blueprint
 from flask_cors import CORS
 from flask_bcrypt import Bcrypt
 import sqlite3
+import db_pool
 from datetime import datetime
 
 app = Flask(__name__)
@@ -27,13 +28,8 @@ def init_db():
 init_db()
 
 # Helper function to interact with database
-def query_db(query, args=(), one=False):
-    with sqlite3.connect('user.db') as conn:
-        cur = conn.cursor()
-        cur.execute(query, args)
-        conn.commit()
-        rv = cur.fetchall()
-        return (rv[0] if rv else None) if one else rv
+# Connections are pooled and reused, SELECTs skip the commit (see db_pool.py)
+query_db = db_pool.query_db
 
 # Signup Route
 @userdb_bp.route('/api/signup', methods=['POST'])
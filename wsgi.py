@@ -0,0 +1,38 @@
+import os
+import importlib
+
+import db_pool
+
+# WSGI entry point for production serving, several worker processes instead of the
+# single-process development server:
+#   gunicorn -c gunicorn.conf.py wsgi:app
+# The module only loads new-server.py, which opens no connection and builds no client
+# at import, so it is safe to preload in a pre-forking master. Each worker brings
+# itself up after the fork with create_app(): SQLite connections, the Firestore gRPC
+# channel and the Gemini client are opened in the worker that uses them (see
+# startup.py and db_pool.py), and the sync scheduler runs in whichever worker holds
+# the lock file, so exactly one per host (see sync_scheduler.py).
+server = importlib.import_module('new-server')
+
+
+# Started on its first request in each process, for servers without fork hooks
+def app(environ, start_response):
+    return server.create_app()(environ, start_response)
+
+
+# Master, before any worker is forked: migrate once for the deployment and leave no
+# SQLite connection open for the workers to inherit
+def prepare():
+    if os.getenv('RUN_MIGRATIONS', '1') == '1':
+        server.init_db()
+    db_pool.pool.close_all()
+
+
+# Worker, right after the fork
+def post_fork():
+    server.create_app(run_migrations=False)
+
+
+# Worker, on its way out. Releases the scheduler lock at once so another worker takes over.
+def worker_exit():
+    server.stop_background_workers()